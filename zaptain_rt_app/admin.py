@@ -40,14 +40,18 @@ from urllib.parse import urlencode
 from io import StringIO
 import logging
 
-from import_export import resources
+from import_export import resources, fields
 from import_export.admin import ImportExportModelAdmin, ImportMixin, ExportMixin, ExportActionModelAdmin
 
 from .exceptions import EmptyCollectionException, EmptySampleException, IllegalStateException
 from .online_configuration import CK_MAIN_AI
 from .models import RtConfig, Guideline, ReleaseCandidate
-from .models import Collection, Document, SubjectAssignment, SubjectIndexer
+from .models import Collection, Document, SubjectAssignment, SubjectIndexer, Concept
 from .models import Review, SubjectLevelReview
+from .models import ReleaseCandidateStatistics, ReleaseCandidateValidation, ImportCheckpoint
+from .models import PipelineStage, STAGE_STUBS, STAGE_METADATA, STATUS_DONE
+from .models import SAMPLE_STRATA
+from . import pipeline
 
 from .catalog_connection import CatalogApi
 from .thesaurus_connection import ThesaurusApi
@@ -68,6 +72,13 @@ class CollectionResource(resources.ModelResource):
     class Meta:
         model = Collection
 
+class SubjectAssignmentResource(resources.ModelResource):
+    subject = fields.Field(attribute='concept__uri', column_name='subject', readonly=True)
+    
+    class Meta:
+        model = SubjectAssignment
+        exclude = ('concept',)
+
 #-----# special views and forms: #----#
         
 class SampleForm(forms.Form):
@@ -80,6 +91,12 @@ class SampleForm(forms.Form):
     size = forms.IntegerField(label="Size", min_value=1, max_value=1000)
     count = forms.IntegerField(label="Number of collections", min_value=1, max_value=1000)
     prefix = forms.CharField(label='Prefix for collection names', min_length=1, max_length=20, initial='C')
+    stratify_by = forms.ChoiceField(label="Stratify by", required=False,
+                                    choices=[('', '-')] + [(k, k) for k in SAMPLE_STRATA])
+    seed = forms.IntegerField(label="Seed", required=False, min_value=0,
+                              help_text="seed of the random draw, leave empty for a random one. "
+                                        "Note: documents of existing collections are not drawn, "
+                                        "so reusing a seed does not reproduce an earlier sample")
 
 # see: ReleaseCandidateAdmin.sample_view ## def sample_view_fun(request, rc_id, *args, **kwargs):
     
@@ -92,14 +109,35 @@ class SampleForm(forms.Form):
 # - https://docs.djangoproject.com/en/2.0/ref/contrib/admin/#module-django.contrib.admin
 # - https://docs.djangoproject.com/en/2.0/ref/contrib/admin/#django.contrib.admin.ModelAdmin.list_filter
 
+class PipelineStageInline(admin.TabularInline):
+    model = PipelineStage
+    fields = ('stage', 'status', 'progress', 'message', 'started', 'finished')
+    readonly_fields = fields
+    extra = 0
+    max_num = 0
+    can_delete = False
+    verbose_name_plural = "pipeline"
+
 @admin.register(ReleaseCandidate)
 class ReleaseCandidateAdmin(admin.ModelAdmin):
-    list_display = ('name', 'pub_date', 'file', 'indexer', 'num_documents', 'sample')
-    actions = ['compute_info', 'compare', 'sample_action', 'create_stubs', 'fetch_metadata_complete', 'fetch_title_action']
+    list_display = ('name', 'pub_date', 'file', 'indexer', 'num_documents', 'valid', 'pipeline_status', 'sample')
+    actions = ['compute_info', 'compare', 'sample_action', 'run_pipeline', 'create_stubs', 'fetch_metadata_complete', 'fetch_title_action']
+    inlines = [PipelineStageInline]
         
     def get_urls(self):
         sample_url = path('sample/<rc_id>', self.admin_site.admin_view(self.sample_view), name='sample')
         return [sample_url] + super(ReleaseCandidateAdmin, self).get_urls()
+    
+    def save_model(self, request, obj, form, change):
+        super(ReleaseCandidateAdmin, self).save_model(request, obj, form, change)
+        if 'file' in form.changed_data:
+            ReleaseCandidateStatistics.objects.filter(rc=obj).delete()
+            ReleaseCandidateValidation.objects.filter(rc=obj).delete()
+            ## the workers must not see the release candidate before it is committed
+            transaction.on_commit(lambda: pipeline.start(obj))
+    
+    def get_queryset(self, request):
+        return super(ReleaseCandidateAdmin, self).get_queryset(request).select_related('statistics', 'validation').prefetch_related('pipeline_stages')
 
     def sample(self, obj):
         """
@@ -130,28 +168,27 @@ class ReleaseCandidateAdmin(admin.ModelAdmin):
                     with transaction.atomic():
                         rc_selected = form.cleaned_data["rc"]
                         
-                        whiteset = None
                         white_queryset = None
                         parent_rec = None
                         if form.cleaned_data["require_abstract"]:
-                            white_queryset = (white_queryset if white_queryset else Document.objects.all()).filter(has_abstract=True)
+                            white_queryset = (white_queryset if white_queryset is not None else Document.objects.all()).filter(has_abstract=True)
                         if form.cleaned_data["require_fulltext_url"]:
-                            white_queryset = (white_queryset if white_queryset else Document.objects.all()).filter(has_ft_url=True)
-                        collections = Collection.objects.iterator()
-                        white_queryset = (white_queryset if white_queryset else Document.objects.all()).exclude(collection__in=collections)
-                        if white_queryset:
-                            whiteset = set(white_queryset.values_list("external_id", flat=True))
+                            white_queryset = (white_queryset if white_queryset is not None else Document.objects.all()).filter(has_ft_url=True)
+                        ## exclude documents that are part of any collection already
+                        white_queryset = (white_queryset if white_queryset is not None else Document.objects.all()).filter(collection__isnull=True)
+                        if not white_queryset.exists():
+                            white_queryset = None
                         
                         rc = ReleaseCandidate.objects.get(name=rc_selected)
                         size = form.cleaned_data["size"]
                         count = form.cleaned_data['count']
+                        stratify_by = form.cleaned_data["stratify_by"] or None
                         n_samples = size * count
-                        docids = rc.sample(n_samples, whiteset=whiteset).tolist()
+                        docids, seed = rc.sample_stream(n_samples, seed=form.cleaned_data["seed"],
+                                                        stratify_by=stratify_by, queryset=white_queryset)
                         if len(docids) == 0:
                             raise EmptyCollectionException("Empty collection.")
-                        if whiteset is not None and len(docids) > len(whiteset):
-                            raise IllegalStateException("collection size > whitelist size")
-                        if whiteset is not None and len(docids) < n_samples:
+                        if white_queryset is not None and len(docids) < n_samples:
                             raise IllegalStateException("Not enought matching documents.")
                         #
                         rc.import_records(docids)
@@ -159,9 +196,11 @@ class ReleaseCandidateAdmin(admin.ModelAdmin):
                         new_name_prefix = form.cleaned_data['prefix']
                         for idx in range(count):
                             new_name = f'{new_name_prefix}_{idx:04d}'
-                            col = Collection.objects.create(name=new_name)
-                            col.documents.add(*[Document.objects.get_or_create(external_id=docid)[0] for docid in docids[idx*size:(idx+1)*size]])
-                            col.description = "Sample from %s" % (rc.name,)
+                            col = Collection.objects.create(name=new_name, sample_seed=seed)
+                            col.documents.add(*docids[idx*size:(idx+1)*size])
+                            col.description = "Sample from %s (seed = %d)" % (rc.name, seed)
+                            if stratify_by:
+                                col.description += " | stratified by %s" % (stratify_by,)
                             if parent_rec:
                                 col.description += " | parent = " 
                                 col.description += '"%s" (%s)' % (parent_rec.title, str(parent_rec_id),)
@@ -170,7 +209,7 @@ class ReleaseCandidateAdmin(admin.ModelAdmin):
                         _cm = Collection._meta
                         url = reverse("admin:%s_%s_changelist" % (_cm.app_label, _cm.model_name))
                         return HttpResponseRedirect(url)
-                except (EmptySampleException, IllegalStateException) as err:
+                except (EmptyCollectionException, EmptySampleException, IllegalStateException) as err:
                     msg = "Collection could not be created: %s." % (str(err),)
                     self.message_user(request, msg, messages.WARNING)
         sample_template_name = "admin/zaptain_rt_app/sample.html"
@@ -209,7 +248,27 @@ class ReleaseCandidateAdmin(admin.ModelAdmin):
     
     
     def num_documents(self, obj):
-        return len(obj.get_document_ids())
+        stats = obj.get_statistics()
+        return stats.n_lines if stats is not None else '-'
+    num_documents.admin_order_field = 'statistics__n_lines'
+    
+    def valid(self, obj):
+        validation = obj.get_validation()
+        if validation is None:
+            return None
+        return validation.is_valid()
+    valid.boolean = True
+    
+    def pipeline_status(self, obj):
+        """
+        current stage of the last pipeline run
+        """
+        stages = list(obj.pipeline_stages.all())
+        if len(stages) == 0:
+            return '-'
+        current = next((stage for stage in stages if stage.status != STATUS_DONE), stages[-1])
+        return "%s: %s %s" % (current.stage, current.status, current.progress())
+    pipeline_status.short_description = "pipeline"
     
     def compute_info(self, request, queryset):
         msg = ""
@@ -230,32 +289,27 @@ class ReleaseCandidateAdmin(admin.ModelAdmin):
         msg = "<br/>".join(msg.splitlines())
         self.message_user(request, format_html(msg))
     
-    def create_stubs(self, request, queryset):
+    def _start_pipeline(self, request, queryset, stages):
         if queryset.count() != 1:
             self.message_user(request, "Too many items selected!", messages.ERROR)
             return
         rc = queryset.first()
-        rc.create_document_stubs()
-        self.message_user(request, "OK", messages.SUCCESS)
-    create_stubs.short_description = "Create stubs"
+        transaction.on_commit(lambda: pipeline.start(rc, stages))
+        url = reverse("admin:zaptain_rt_app_releasecandidate_change", args=(rc.name,))
+        msg = format_html('begin: {stages} asynchronously, see the <a href="{url}">progress</a>.', 
+                          stages=" -> ".join(stages), url=url)
+        self.message_user(request, msg, messages.WARNING)
     
-    def _fetch_metadata_complete_task(self, rc):
-        catapi = CatalogApi.create_from_db()
-        rc.create_document_stubs()
-        catapi.fetch_metadata(Document.objects.all()) # TODO: only fetch RC's documents rather than ALL
+    def run_pipeline(self, request, queryset):
+        self._start_pipeline(request, queryset, pipeline.PIPELINE_STAGES)
+    run_pipeline.short_description = "Run pipeline (validate, index, stats, stubs, meta-data)"
+    
+    def create_stubs(self, request, queryset):
+        self._start_pipeline(request, queryset, (STAGE_STUBS,))
+    create_stubs.short_description = "Create stubs"
     
     def fetch_metadata_complete(self, request, queryset):
-        if queryset.count() != 1:
-            self.message_user(request, "Too many items selected!", messages.ERROR)
-            return
-        rc = queryset.first()
-        logging.warning(rc)
-        task_id = async_task(self._fetch_metadata_complete_task, rc)
-        tasks_url = reverse("admin:app_list", args=("django_q",))
-        msg_tmplt = 'begin: gather meta-data asynchronously, <a href="{url}">task id = {id}</a>.'
-        msg_data = {"url": tasks_url, "id": task_id}
-        msg = format_html(msg_tmplt, **msg_data)
-        self.message_user(request, msg, messages.WARNING)
+        self._start_pipeline(request, queryset, (STAGE_STUBS, STAGE_METADATA))
     fetch_metadata_complete.short_description = "Fetch meta-data (complete!)"
 
 class IsAiListFilter(admin.SimpleListFilter):
@@ -324,7 +378,7 @@ class SubjectIndexerAdmin(admin.ModelAdmin):
 class CollectionAdmin(ImportMixin, ExportActionModelAdmin, admin.ModelAdmin):
     resource_class = CollectionResource ## for import/export
     search_fields = ('name', 'description')
-    list_display = ('name', 'description', 'size', 'analysis_link') # id
+    list_display = ('name', 'description', 'size', 'sample_seed', 'analysis_link') # id
     exclude = ('documents',) # issue: page loading takes long when there are MANY documents !    
     actions = ["fetch_title_action", "merge_action"]
     # filter_horizontal = ('documents',)
@@ -433,8 +487,25 @@ class DocumentAdmin(ImportMixin, ExportActionModelAdmin, admin.ModelAdmin):
 @admin.register(SubjectAssignment)
 class SubjectAssignmentAdmin(ExportActionModelAdmin, admin.ModelAdmin):
     list_display = ('id', 'document', 'subject', 'score', 'indexer')
+    resource_class = SubjectAssignmentResource
     list_filter = ('indexer',)
-    search_fields = ('document__external_id', 'subject')
+    list_select_related = ('document', 'concept')
+    search_fields = ('document__external_id', 'concept__uri')
+
+@admin.register(ReleaseCandidateValidation)
+class ReleaseCandidateValidationAdmin(admin.ModelAdmin):
+    list_display = ('rc', 'checked', 'n_lines', 'n_issues')
+    readonly_fields = ('rc', 'checked', 'n_lines', 'n_issues', 'counts', 'issues')
+
+@admin.register(ImportCheckpoint)
+class ImportCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('file', 'indexer', 'offset', 'n_lines', 'n_assignments', 'completed', 'updated')
+    list_filter = ('indexer', 'completed')
+
+@admin.register(Concept)
+class ConceptAdmin(admin.ModelAdmin):
+    list_display = ('id', 'uri')
+    search_fields = ('uri',)
 
 @admin.register(Review)
 class ReviewAdmin(ExportActionModelAdmin, admin.ModelAdmin):
@@ -455,6 +526,7 @@ class ReviewAdmin(ExportActionModelAdmin, admin.ModelAdmin):
 class SubjectLevelReviewAdmin(ExportActionModelAdmin, admin.ModelAdmin):
     list_display = ('id', 'document', 'subject', 'reviewer', 'value')
     list_filter = ('value', 'review__reviewer')
+    list_select_related = ('review__reviewer', 'subject_assignment__document', 'subject_assignment__concept')
     
     def reviewer(self, obj):
         return obj.review.reviewer
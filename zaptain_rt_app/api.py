@@ -69,7 +69,7 @@ def basecontext(request, external_id=None):
             ctx[k] = RtConfig.objects.get(key=k).value
         except ObjectDoesNotExist:
             pass
-    ctx["kos"] = ThesaurusApi(ctx[CK_THES_SPARQL_ENDPOINT], ctx[CK_THES_DESCRIPTOR_TYPE], ctx[CK_THES_CATEGORY_TYPE])
+    ctx["kos"] = ThesaurusApi.create(ctx[CK_THES_SPARQL_ENDPOINT], ctx[CK_THES_DESCRIPTOR_TYPE], ctx[CK_THES_CATEGORY_TYPE])
     ctx["catalog"] = CatalogApi(ctx[CK_CATALOG_API_PATTERN]) # .create_from_db()
     if request.user.is_authenticated:
         ctx["reviewer"] = ReviewerWrapper(request.user)
@@ -117,13 +117,13 @@ def explain(request, external_id):
             ctx[k] = RtConfig.objects.get(key=k).value
         except ObjectDoesNotExist:
             pass
-    ctx["kos"] = ThesaurusApi(ctx[CK_THES_SPARQL_ENDPOINT], ctx[CK_THES_DESCRIPTOR_TYPE], ctx[CK_THES_CATEGORY_TYPE])
+    ctx["kos"] = ThesaurusApi.create(ctx[CK_THES_SPARQL_ENDPOINT], ctx[CK_THES_DESCRIPTOR_TYPE], ctx[CK_THES_CATEGORY_TYPE])
     try:
         document = Document.objects.get(external_id=external_id)
     except Document.DoesNotExist:
         raise Http404("Document does not exist")
     assignments = defaultdict(list)
-    for sa in SubjectAssignment.objects.filter(document=document): # TODO is_ai?
+    for sa in SubjectAssignment.objects.filter(document=document).select_related('concept', 'indexer'): # TODO is_ai?
         assignments[sa.subject].append({"indexer": sa.indexer.ai_name, "score": sa.score})
     subj_labels = ctx['kos'].labels(list(assignments.keys()))
     assignments = dict((k, {"support": v}) for k, v in assignments.items())
@@ -155,7 +155,7 @@ def subjects_graph(request, external_id):
     except Document.DoesNotExist:
         raise Http404("Document does not exist")
     assignments = defaultdict(list)
-    for sa in SubjectAssignment.objects.filter(document=document): # TODO is_ai?
+    for sa in SubjectAssignment.objects.filter(document=document).select_related('concept', 'indexer'): # TODO is_ai?
         assignments[sa.subject].append({"indexer": sa.indexer.ai_name, "score": sa.score})
 
     subj_ = list(assignments.keys())
@@ -214,7 +214,8 @@ def j_list_reviews(external_id, ai=None):
     # reviewers = [r.by for rid, r in revdict.items()]
     ratdict = defaultdict(dict)
     for rev in dbrevs:
-        for rat in SubjectLevelReview.objects.filter(review=rev): # rev.ratings.all():
+        for rat in SubjectLevelReview.objects.filter(review=rev).select_related(
+                'subject_assignment__concept', 'subject_assignment__indexer'): # rev.ratings.all():
             _rattup = (rev.reviewer.username, rat.value)
             sa = rat.subject_assignment
             _ratdata = ratdict[sa.subject]
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Backend specific bulk loaders for large imports, bypassing the per-object overhead of the ORM:
+
+- SQLite: executemany on a raw cursor, with import-time PRAGMAs (see import_session)
+- PostgreSQL: COPY ... FROM STDIN (psycopg2, else QuerySet.bulk_create)
+- other backends: QuerySet.bulk_create
+
+The loader is chosen by the engine of the database connection, see get_loader.
+Rows are plain tuples of column values, no model instances are created;
+call insert_rows inside a transaction, like bulk_create.
+"""
+__author__ = "Martin Toepfer"
+
+from contextlib import contextmanager
+from decimal import Decimal
+import io
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+class OrmLoader(object):
+    """
+    Fallback for all backends: bulk_create
+    """
+    
+    def __init__(self, connection):
+        self.connection = connection
+    
+    def insert_rows(self, model, field_names, rows, batch_size=1000):
+        """
+        insert rows (tuples of values for field_names, foreign keys as primary keys) into the table of model,
+        returns: number of rows
+        """
+        attnames = [model._meta.get_field(name).attname for name in field_names]
+        objs = [model(**dict(zip(attnames, row))) for row in rows]
+        model.objects.using(self.connection.alias).bulk_create(objs, batch_size=batch_size)
+        return len(objs)
+    
+    @contextmanager
+    def import_session(self):
+        """
+        context for a whole import (of several transactions), 
+        loaders may tune the connection for bulk loading
+        """
+        yield self
+    
+    def _columns(self, model, field_names):
+        fields = [model._meta.get_field(name) for name in field_names]
+        qn = self.connection.ops.quote_name
+        return [qn(field.column) for field in fields], fields
+    
+    def _adapt(self, fields, row):
+        ## decimals as formatted by the backend, e.g. scores: "0.70"
+        return tuple(self.connection.ops.adapt_decimalfield_value(value, field.max_digits, field.decimal_places) 
+                     if isinstance(value, Decimal) else value 
+                     for field, value in zip(fields, row))
+
+
+class SqliteLoader(OrmLoader):
+    """
+    executemany of one INSERT statement on a raw cursor
+    
+    synchronous is NORMAL during imports (no corruption on crashes, durable with journal_mode WAL),
+    OFF is faster but may corrupt the db on power loss, opt in by settings.RT_SQLITE_IMPORT_SYNCHRONOUS = "OFF"
+    """
+    ## applied by import_session, if not inside a transaction
+    PRAGMAS = (("temp_store", "MEMORY"), ("cache_size", "-262144"))
+    SYNCHRONOUS = ("NORMAL", "OFF", "FULL", "EXTRA")
+    
+    def insert_rows(self, model, field_names, rows, batch_size=1000):
+        columns, fields = self._columns(model, field_names)
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (self.connection.ops.quote_name(model._meta.db_table), 
+                                                   ", ".join(columns), ", ".join(["%s"] * len(columns)))
+        n_rows = 0
+        with self.connection.cursor() as cursor:
+            for i in range(0, len(rows), batch_size):
+                part = [self._adapt(fields, row) for row in rows[i:i + batch_size]]
+                cursor.executemany(sql, part)
+                n_rows += len(part)
+        return n_rows
+    
+    @contextmanager
+    def import_session(self):
+        if self.connection.in_atomic_block:
+            ## PRAGMA synchronous cannot be changed inside a transaction
+            yield self
+            return
+        synchronous = getattr(settings, "RT_SQLITE_IMPORT_SYNCHRONOUS", "NORMAL").upper()
+        if not synchronous in SqliteLoader.SYNCHRONOUS:
+            raise ValueError("illegal RT_SQLITE_IMPORT_SYNCHRONOUS: %s" % (synchronous,))
+        with self.connection.cursor() as cursor:
+            previous = list()
+            for name, value in (("synchronous", synchronous),) + SqliteLoader.PRAGMAS:
+                cursor.execute("PRAGMA %s" % (name,))
+                previous.append((name, cursor.fetchone()[0]))
+                cursor.execute("PRAGMA %s = %s" % (name, value))
+        try:
+            yield self
+        finally:
+            with self.connection.cursor() as cursor:
+                for name, value in previous:
+                    cursor.execute("PRAGMA %s = %s" % (name, value))
+
+
+class PostgresLoader(OrmLoader):
+    """
+    COPY ... FROM STDIN (text format) via psycopg2,
+    drivers without copy_expert fall back to bulk_create (see OrmLoader)
+    """
+    
+    def insert_rows(self, model, field_names, rows, batch_size=1000):
+        columns, fields = self._columns(model, field_names)
+        sql = "COPY %s (%s) FROM STDIN" % (self.connection.ops.quote_name(model._meta.db_table), ", ".join(columns))
+        with self.connection.cursor() as cursor:
+            copy_expert = getattr(cursor.cursor, "copy_expert", None)
+            if copy_expert is None:
+                return super(PostgresLoader, self).insert_rows(model, field_names, rows, batch_size)
+            buf = io.StringIO()
+            for row in rows:
+                buf.write("\t".join(_copy_value(value) for value in self._adapt(fields, row)))
+                buf.write("\n")
+            buf.seek(0)
+            copy_expert(sql, buf)
+        return len(rows)
+    
+    @contextmanager
+    def import_session(self):
+        ## the checkpoints of imports are committed with the data, thus, losing the last commits is fine
+        with self.connection.cursor() as cursor:
+            cursor.execute("SET synchronous_commit TO OFF")
+        try:
+            yield self
+        finally:
+            with self.connection.cursor() as cursor:
+                cursor.execute("RESET synchronous_commit")
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    value = str(value)
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+_LOADERS = {
+    "sqlite": SqliteLoader,
+    "postgresql": PostgresLoader,
+}
+
+def get_loader(using=DEFAULT_DB_ALIAS):
+    """
+    returns: the bulk loader for the engine of the database connection,
+    (vendor of DATABASES[using]['ENGINE'], falls back to OrmLoader)
+    """
+    connection = connections[using]
+    return _LOADERS.get(connection.vendor, OrmLoader)(connection)
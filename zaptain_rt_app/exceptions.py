@@ -37,4 +37,10 @@ class IllegalStateException(Exception):
     """
     Raised when an illegal state of the app or some data occurs.
     """
-    pass
\ No newline at end of file
+    pass
+
+class InvalidReleaseCandidateException(Exception):
+    """
+    Raised when the file of a release candidate does not pass the validation.
+    """
+    pass
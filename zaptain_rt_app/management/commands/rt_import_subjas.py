@@ -23,13 +23,25 @@
 
 from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone as tz
+from django.db import transaction
 from django.db.utils import OperationalError
 
 from zaptain_rt_app.models import RtConfig, Document, SubjectIndexer, Collection
+from zaptain_rt_app.models import ImportCheckpoint, import_statements, IMPORT_BATCH_SIZE
+from zaptain_rt_app.bulk_loader import get_loader
+from zaptain_rt_app.releasecandidate_storage import parse_line, chunked
+from zaptain_rt_app.releasecandidate_storage import is_compressed, iter_range_offsets
+from zaptain_rt_app.releasecandidate_storage import map_ranges, parse_range_offsets, filter_statements, count_lines
+
+import os
+import time
 
 # see:
 # https://docs.djangoproject.com/en/2.0/howto/custom-management-commands/
 
+## size of the line ranges parsed by worker processes
+IMPORT_RANGE_BYTES = 1 << 22
+
 class Command(BaseCommand):
     help = 'Import subject assignments generated by an automatic method.'
     
@@ -42,16 +54,28 @@ class Command(BaseCommand):
         parser.add_argument('--skip_docfail', help="wheter to skip illegal document references", action="store_true")
         parser.add_argument('--create_indexer', help="wheter to create the indexer if does not exist already", action="store_true")
         parser.add_argument('--collection', help="create a corresponding collection with the given name", default=None)
-        parser.add_argument('file', nargs=1, help="file format for each line, cells separated by tabs: documentid, concept id1, concept id2, ...") # '+'
+        parser.add_argument('--batch-size', help="import chunks of $batch_size lines (default: %d), each in one transaction; "
+                            "documents that already have assignments by the indexer are skipped" % (IMPORT_BATCH_SIZE,), 
+                            default=None, type=int)
+        parser.add_argument('--workers', help="parse line ranges of the files with $workers processes, "
+                            "a single writer imports the results in file order (compressed files are parsed by the writer)", 
+                            default=1, type=int)
+        parser.add_argument('--min-score', help="skip subjects with lower scores", default=None, type=float)
+        parser.add_argument('--top-k', help="import at most $top_k subjects (best scores first) per document", 
+                            default=None, type=int)
+        parser.add_argument('--resume', help="continue the import of each file after its last committed chunk", 
+                            action="store_true")
+        parser.add_argument('file', nargs='+', help="file format for each line, cells separated by tabs: documentid, concept id1, concept id2, ... (optionally compressed: .gz, .bz2, .xz, .zst)") # '+'
     
     def handle(self, *args, **options):
         indexernm = options['indexer']
         colnm = options['collection']
+        collection = None
         if not colnm is None:
-            collection = Collection.objects.create(name=colnm, description='')
-        #
-        parse_cell = lambda cell: (cell if ':' in cell else cell + ':1.0').split(':') 
-        _ctmplt = options['concept_template']
+            if options['resume']:
+                collection, _ = Collection.objects.get_or_create(name=colnm, defaults={"description": ''})
+            else:
+                collection = Collection.objects.create(name=colnm, description='')
         try:
             indexer = SubjectIndexer.objects.get(ai_name=indexernm)
         except SubjectIndexer.DoesNotExist as err:
@@ -59,35 +83,102 @@ class Command(BaseCommand):
                 indexer = SubjectIndexer.objects.create(ai_name=indexernm)
             else:
                 raise err
-        for fn in options['file']:
-            # TODO bulk_create..._toadd = list()
-            with open(fn, 'r') as fin:
-                for lni, ln in enumerate(fin):
-                    _cells = ln.strip().split('\t')
-                    docid = _cells[0]
-                    doc = None
-                    try:
-                        doc = Document.objects.get(external_id=docid)
-                    except Document.DoesNotExist as err:
-                        if options['create_emptydoc']:
-                            doc = Document.objects.create(external_id=docid, title='-')
-                        else:
-                            if options['skip_docfail']:
-                                pass
-                                # self.stderr.write("illegal document reference to %s" % (str(docid,)))
-                            else:
-                                raise err
-                    if not doc is None:
-                        crefs = dict((_ctmplt.format(cid=cid), float(score)) for cid, score in map(parse_cell, _cells[1:]))
-                        indexer.assign_scored(doc, crefs)
-                        if not colnm is None:
-                            collection.documents.add(doc) # _imports.append(doc)
-                        if options['limit'] > -1 and lni >= options['limit']:
+        if options['batch_size'] is None:
+            options['batch_size'] = IMPORT_BATCH_SIZE
+        self.import_bulk(indexer, collection, options)
+
+    def import_bulk(self, indexer, collection, options):
+        """
+        import chunks of lines with a constant number of queries each (rows are written by the bulk loader
+        of the db backend, see bulk_loader.get_loader),
+        the progress per file is recorded by an ImportCheckpoint in the transaction of each chunk
+        """
+        _ctmplt = options['concept_template']
+        batch_size = options['batch_size']
+        limit = options['limit']
+        n_lines, n_docs, n_rows = 0, 0, 0
+        t_start = time.time()
+        loader = get_loader()
+        with loader.import_session():
+            for fn in options['file']:
+                checkpoint = self.get_checkpoint(fn, indexer, options)
+                if checkpoint.completed:
+                    self.stdout.write('%s: already imported (%d lines), skipped' % (fn, checkpoint.n_lines))
+                    continue
+                if checkpoint.offset > 0:
+                    self.stdout.write('%s: resuming at byte %d after %d lines' % (fn, checkpoint.offset, checkpoint.n_lines))
+                records = self.iter_statements(fn, _ctmplt, options['workers'], checkpoint.offset)
+                for chunk in chunked(records, batch_size):
+                    if limit > -1:
+                        chunk = chunk[:max(limit - n_lines, 0)]
+                        if len(chunk) == 0:
                             break
-        self.stdout.write(self.style.SUCCESS('Successfully imported subject assignments.'))
+                    statements = filter_statements([stmt for _, _, stmt in chunk], options['min_score'], options['top_k'])
+                    with transaction.atomic():
+                        docs, rows = import_statements(indexer, statements, 
+                                                       create_emptydoc=options['create_emptydoc'],
+                                                       skip_docfail=options['skip_docfail'],
+                                                       collection=collection, batch_size=batch_size, loader=loader,
+                                                       locations=["%s:%d" % (fn, lineno) for _, lineno, _ in chunk])
+                        checkpoint.offset = chunk[-1][0]
+                        checkpoint.n_lines += len(chunk)
+                        checkpoint.n_assignments += rows
+                        checkpoint.save()
+                    n_lines += len(chunk)
+                    n_docs += docs
+                    n_rows += rows
+                else:
+                    checkpoint.completed = True
+                    checkpoint.save()
+        elapsed = max(time.time() - t_start, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+                'Successfully imported %d subject assignments for %d documents (%d lines) in %.1fs, %.0f rows/s.' 
+                % (n_rows, n_docs, n_lines, elapsed, n_rows / elapsed)))
+
+    def get_checkpoint(self, fn, indexer, options):
+        """
+        returns the checkpoint of file fn, reset unless options['resume'] is set
+        """
+        file_size = os.path.getsize(fn)
+        _filter = {"min_score": options['min_score'], "top_k": options['top_k']}
+        checkpoint, created = ImportCheckpoint.objects.get_or_create(file=os.path.abspath(fn), indexer=indexer,
+                                                                     defaults=dict(file_size=file_size, **_filter))
+        if not created:
+            if not options['resume']:
+                checkpoint.offset, checkpoint.n_lines, checkpoint.n_assignments = 0, 0, 0
+                checkpoint.completed = False
+                checkpoint.file_size = file_size
+                checkpoint.min_score, checkpoint.top_k = _filter["min_score"], _filter["top_k"]
+                checkpoint.save()
+            elif checkpoint.file_size != file_size:
+                raise CommandError('%s has been modified since its checkpoint, restart the import without --resume' % (fn,))
+            elif (checkpoint.min_score, checkpoint.top_k) != (_filter["min_score"], _filter["top_k"]):
+                raise CommandError('%s: the checkpoint was recorded with --min-score %s --top-k %s' 
+                                   % (fn, checkpoint.min_score, checkpoint.top_k))
+        return checkpoint
+
+    def iter_statements(self, fn, ctmplt, workers, start=0):
+        """
+        yield (offset, line number, statement) for the lines of file fn in file order, from byte start on
+        (offset: position after the line, see rcstorage.iter_range_offsets);
+        with workers > 1, line ranges are parsed by worker processes 
+        (at most 2 * workers pending ranges, see rcstorage.map_ranges)
+        """
+        lineno = count_lines(fn, start) if start > 0 else 0
+        if workers > 1 and not is_compressed(fn):
+            for n_lines, records in map_ranges(fn, parse_range_offsets, (ctmplt,), workers=workers, 
+                                               ordered=True, range_bytes=IMPORT_RANGE_BYTES, start=start):
+                for pos, i, stmt in records:
+                    yield pos, lineno + i, stmt
+                lineno += n_lines
+        else:
+            for pos, ln in iter_range_offsets(fn, start, None):
+                lineno += 1
+                if ln.strip():
+                    yield pos, lineno, parse_line(ln, ctmplt)
 
 #            if fn.enswith(''):
 #                pass
 #            else:
 #                self.stdout.write('warning: unhandled file type, @ file ' + str(fn))
-        
\ No newline at end of file
+        
@@ -19,7 +19,9 @@
 """
 Import 
 - specific documents and their subject indexing from a release candidate
-- and put them in a collection, which will be cleaned in advance.
+- and put them in a collection, whose previous members are removed (the documents are kept).
+
+Only the whitelisted records are read from the release candidate, by its sidecar index.
 
 @author: Martin Toepfer, 2018
 """
@@ -46,6 +48,9 @@ class Command(BaseCommand):
         parser.add_argument('--f_whitelist', required=True, help="external document ids file")
         parser.add_argument('--collection', required=True, help="collection name")
         parser.add_argument('--rc', default=None, help="release candidate")
+        parser.add_argument('--min-score', default=None, type=float, help="skip subjects with lower scores (recorded on the rc, no value clears it)")
+        parser.add_argument('--top-k', default=None, type=int, help="import at most $top_k subjects per document (recorded on the rc, no value clears it)")
+        parser.add_argument('--delta', action="store_true", help="update existing assignments of the rc's indexer instead of skipping their documents")
         # action=store_true
 
     def handle(self, *args, **options):
@@ -55,8 +60,17 @@ class Command(BaseCommand):
         
         rc = ReleaseCandidate.objects.get(name=rc_nm)
         col = Collection.objects.get(name=collection_nm)
-        col.documents.all().delete()
         
         with open(f_whitelist) as fin:
-            docids = [docid.strip() for docid in fin]
-        rc.import_records(docids, collection=col)
\ No newline at end of file
+            docids = set(docid.strip() for docid in fin)
+        docids.discard('')
+        index = rc.get_index()
+        docids = [docid for docid in docids if docid in index]
+        n_imported = rc.import_records(docids, delta=options['delta'], 
+                                       min_score=options['min_score'], top_k=options['top_k'])
+        n_members = col.replace_documents(docids)
+        ## record the filter of this import
+        rc.min_score, rc.top_k = options['min_score'], options['top_k']
+        rc.save(update_fields=["min_score", "top_k"])
+        self.stdout.write(self.style.SUCCESS('Imported %d documents, collection %s has %d documents.' 
+                                             % (n_imported, col.name, n_members)))
@@ -27,17 +27,24 @@ from django.utils import timezone as tz
 from django.db.utils import OperationalError
 
 from zaptain_rt_app.models import ReleaseCandidate
+from zaptain_rt_app.releasecandidate_diff import RcDiff
 
-import pandas as pd
+import numpy as np
+import csv
+import json
+import sys
 
 # see:
 # https://docs.djangoproject.com/en/2.0/howto/custom-management-commands/
 
 class Command(BaseCommand):
-    help = 'Very basic comparison of release candidates.'
+    help = 'Comparison of release candidates, optionally with a document-level diff.'
     
     def add_arguments(self, parser):
         parser.add_argument('rc_ID', nargs=2, help="exactly two ids of release candidates")
+        parser.add_argument('--diff', default=None, help="write a document-level diff to this file ('-' for stdout)")
+        parser.add_argument('--format', default='csv', choices=['csv', 'json'], help="format of the diff file")
+        parser.add_argument('--top', default=20, type=int, help="number of most-changed concepts to report")
 
     def handle(self, *args, **options):
         _LNL = 40
@@ -45,20 +52,52 @@ class Command(BaseCommand):
         _LN = "-" * _LNL
         
         rcs = ReleaseCandidate.objects.filter(name__in=options['rc_ID'])
-        rc1, rc2 = rcs.first(), rcs.last()
-        ids1 = rc1.get_document_ids()
-        ids2 = rc2.get_document_ids()
+        rc1, rc2 = [rcs.get(name=name) for name in options['rc_ID']]
+        cols1 = rc1.get_columns()
+        cols2 = rc2.get_columns()
         
         
         self.stdout.write(_LN_STRONG)
-        self.stdout.write("#docs %s = %d" % (rc1.name, len(ids1)))
-        self.stdout.write("#docs %s = %d" % (rc2.name, len(ids2)))
-        self.stdout.write("overlap = %d" % (len(set(ids1).intersection(ids2))))
+        self.stdout.write("#docs %s = %d" % (rc1.name, cols1.n_documents))
+        self.stdout.write("#docs %s = %d" % (rc2.name, cols2.n_documents))
+        self.stdout.write("overlap = %d" % (np.intersect1d(cols1.documents, cols2.documents).shape[0]))
         self.stdout.write(_LN)
-        ser1 = pd.Series(map(lambda t: len(t["subjects"]), rc1.iter_statements()))
-        ser2 = pd.Series(map(lambda t: len(t["subjects"]), rc2.iter_statements()))
         # avg_n_subjs = .mean()
-        self.stdout.write("avg. num. of subjects '%s' = %.3f" % (rc1.name, ser1.mean()))
-        self.stdout.write("avg. num. of subjects '%s' = %.3f" % (rc2.name, ser2.mean()))
+        self.stdout.write("avg. num. of subjects '%s' = %.3f" % (rc1.name, cols1.subjects_per_document().mean()))
+        self.stdout.write("avg. num. of subjects '%s' = %.3f" % (rc2.name, cols2.subjects_per_document().mean()))
         self.stdout.write(_LN_STRONG)
-    
\ No newline at end of file
+        
+        if not options['diff'] is None:
+            rcdiff = RcDiff(cols1, cols2)
+            if options['diff'] == '-':
+                self._write_diff(rcdiff, sys.stdout, options)
+            else:
+                with open(options['diff'], 'w', newline='', encoding='utf-8') as fout:
+                    self._write_diff(rcdiff, fout, options)
+            self.stdout.write("diff '%s' -> '%s':" % (rc1.name, rc2.name))
+            for k, v in rcdiff.summary().items():
+                self.stdout.write("%s = %s" % (k, ("%.3f" % v) if isinstance(v, float) else v))
+            self.stdout.write(_LN)
+            self.stdout.write("most-changed concepts (added/removed):")
+            for e in rcdiff.top_concepts(options['top']):
+                self.stdout.write("%s +%d/-%d" % (rc1.format_concepts([e['concept']])[0], e['added'], e['removed']))
+            self.stdout.write(_LN_STRONG)
+    
+    def _write_diff(self, rcdiff, fout, options):
+        """
+        write one row/object per document, only a single document diff is kept in memory.
+        """
+        _fmt_deltas = lambda deltas: " ".join("%s:%+.2f" % (c, d) for c, d in deltas)
+        if options['format'] == 'csv':
+            writer = csv.writer(fout)
+            writer.writerow(["external_id", "status", "n_a", "n_b", "jaccard", "added", "removed", "score_deltas"])
+            for d in rcdiff:
+                writer.writerow([d.external_id, d.status, d.n_a, d.n_b, "%.4f" % d.jaccard,
+                                 " ".join(d.added), " ".join(d.removed), _fmt_deltas(d.score_deltas)])
+        else:
+            fout.write('{"documents": [\n')
+            for i, d in enumerate(rcdiff):
+                fout.write(("" if i == 0 else ",\n") + json.dumps(d._asdict()))
+            fout.write('\n],\n')
+            fout.write('"concepts": %s,\n' % (json.dumps(rcdiff.top_concepts(options['top'])),))
+            fout.write('"summary": %s}\n' % (json.dumps(rcdiff.summary()),))
@@ -36,6 +36,7 @@ class Command(BaseCommand):
     
     def add_arguments(self, parser):
         parser.add_argument('rc_ID', nargs='*', help="ids of ")
+        parser.add_argument('--recompute', help="recompute the statistics from the file", action="store_true")
 
     def handle(self, *args, **options):
         _LNL = 40
@@ -53,8 +54,18 @@ class Command(BaseCommand):
             self.stdout.write("file = %s" % (dbrc.file,))
             self.stdout.write("url  = %s" % (dbrc.file.url,))
             
-            docids = dbrc.get_document_ids()
-            self.stdout.write("# lns= %s" % (len(docids),))
+            stats = dbrc.get_statistics()
+            if stats is None or options['recompute']:
+                stats = dbrc.compute_statistics()
+            self.stdout.write("# lns= %s" % (stats.n_lines,))
+            self.stdout.write("# assignments = %s" % (stats.n_assignments,))
+            self.stdout.write("# concepts = %s" % (stats.n_concepts,))
+            self.stdout.write("avg. num. of subjects = %.3f" % (stats.mean_subjects(),))
+            self.stdout.write("num. of subjects: num. of docs = %s" % (
+                    ", ".join("%d: %d" % (i, n) for i, n in enumerate(stats.subjects_per_document) if n > 0),))
+            _hist = stats.score_histogram
+            self.stdout.write("score histogram = %s" % (
+                    ", ".join("[%.1f, %.1f): %d" % (lo, hi, n) for lo, hi, n in zip(_hist["edges"], _hist["edges"][1:], _hist["counts"]) if n > 0),))
         
         self.stdout.write(_LN_STRONG)
         self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Check release candidate files before they are imported, see releasecandidate_validation.
+
+@author: Martin Toepfer, 2018
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from zaptain_rt_app.models import ReleaseCandidate, Concept
+from zaptain_rt_app.releasecandidate_validation import validate_file
+
+# see:
+# https://docs.djangoproject.com/en/2.0/howto/custom-management-commands/
+
+class Command(BaseCommand):
+    help = 'Validate release candidate files: cells, scores, duplicate documents and concepts.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('rc_ID', nargs='*', help="names of release candidates, the results are saved")
+        parser.add_argument('--file', help="validate this file instead of release candidates", default=None)
+        parser.add_argument('--concept_template', help="str.format template with concept id as name cid (required with --file)", default=None)
+        parser.add_argument('--vocabulary', help="file with the known concept URIs, one per line", default=None)
+        parser.add_argument('--known_concepts_db', help="only accept concepts that are already in the db", action="store_true")
+        parser.add_argument('--max_issues', help="report at most $max_issues issues per file", default=100, type=int)
+
+    def handle(self, *args, **options):
+        known_concepts = None
+        if not options['vocabulary'] is None:
+            with open(options['vocabulary']) as fin:
+                known_concepts = set(ln.strip() for ln in fin if ln.strip())
+        elif options['known_concepts_db']:
+            known_concepts = set(Concept.objects.values_list("uri", flat=True))
+        n_issues = 0
+        if not options['file'] is None:
+            if not options['concept_template']:
+                raise CommandError('--concept_template is required with --file, e.g. http://zbw.eu/stw/descriptor/{cid}')
+            validator, issues = validate_file(options['file'], options['concept_template'], 
+                                              known_concepts, options['max_issues'])
+            self.report(options['file'], validator.n_lines, validator.summary(), issues)
+            n_issues += sum(validator.counts.values())
+        else:
+            rcs = ReleaseCandidate.objects.filter(name__in=options['rc_ID'])
+            if len(rcs) == 0:
+                raise CommandError('no release candidate or file given')
+            for rc in rcs:
+                validation = rc.validate(known_concepts, options['max_issues'])
+                self.report(rc.name, validation.n_lines, validation.counts, validation.issues)
+                n_issues += validation.n_issues
+        if n_issues > 0:
+            raise CommandError('%d issues found' % (n_issues,))
+        self.stdout.write(self.style.SUCCESS('No issues found.'))
+    
+    def report(self, name, n_lines, counts, issues):
+        self.stdout.write("%s: %d lines, %s" % (name, n_lines, 
+                ", ".join("%s = %d" % (kind, n) for kind, n in counts.items() if n > 0) or "ok"))
+        for lni, kind, message in issues:
+            self.stdout.write("  line %d: %s: %s" % (lni, kind, message))
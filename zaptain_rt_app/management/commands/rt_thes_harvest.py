@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Harvest the configured thesaurus into a local store, see thesaurus_store.
+
+@author: Martin Toepfer, 2018
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from zaptain_rt_app.thesaurus_connection import ThesaurusApi
+from zaptain_rt_app.thesaurus_store import harvest, HARVEST_PAGE_SIZE, ThesaurusStore
+from zaptain_rt_app.exceptions import IllegalStateException
+
+# see:
+# https://docs.djangoproject.com/en/2.0/howto/custom-management-commands/
+
+class Command(BaseCommand):
+    help = 'Harvest labels, relations and categories of the thesaurus (CK_THES_* configuration) into a local store.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="directory of the store, defaults to settings.RT_THESAURUS_STORE", default=None)
+        parser.add_argument('--languages', help="languages of the labels", nargs='+', default=["de", "en"])
+        parser.add_argument('--page_size', help="number of results per SPARQL request", default=HARVEST_PAGE_SIZE, type=int)
+        parser.add_argument('--closure_only', help="only recompute the category closure of the existing store", action="store_true")
+
+    def handle(self, *args, **options):
+        path = options['output'] or getattr(settings, "RT_THESAURUS_STORE", None)
+        if not path:
+            raise CommandError('no output directory given, set --output or settings.RT_THESAURUS_STORE')
+        if options['closure_only']:
+            store = ThesaurusStore.load(path, mmap_mode=None)
+            store.compute_closure()
+            store.save(path)
+            self.stdout.write(self.style.SUCCESS('Saved the category closure of %s.' % (path,)))
+            return
+        try:
+            api = ThesaurusApi.create_from_db(local=False)
+        except KeyError as err:
+            raise CommandError('thesaurus configuration missing: %s' % (err,))
+        try:
+            store = harvest(api, options['languages'], options['page_size'])
+        except IllegalStateException as err:
+            raise CommandError(str(err))
+        store.save(path)
+        self.stdout.write("%d concepts, %d top categories, %d broader, %d related relations" % (
+                len(store), int(store.top.sum()), store.broader_idx.shape[0], store.related_idx.shape[0]))
+        self.stdout.write(self.style.SUCCESS('Saved %s.' % (path,)))
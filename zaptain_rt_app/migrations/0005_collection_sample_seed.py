@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0004_add_ft_url_to_doc'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='sample_seed',
+            field=models.BigIntegerField(blank=True, help_text='seed of the random sample the collection was drawn with, if any', null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0005_collection_sample_seed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReleaseCandidateStatistics',
+            fields=[
+                ('rc', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='statistics', serialize=False, to='zaptain_rt_app.releasecandidate')),
+                ('computed', models.DateTimeField(auto_now=True)),
+                ('n_lines', models.IntegerField()),
+                ('n_assignments', models.BigIntegerField()),
+                ('n_concepts', models.IntegerField()),
+                ('subjects_per_document', models.JSONField(default=list)),
+                ('score_histogram', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
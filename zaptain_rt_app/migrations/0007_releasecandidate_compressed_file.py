@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0006_releasecandidatestatistics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='releasecandidate',
+            name='file',
+            field=models.FileField(help_text='File content:\n        tab-separated values; for each row: first cell = document external id, then subjects;\n        optionally compressed (.gz, .bz2, .xz, .zst)', upload_to='releasecandidates/'),
+        ),
+    ]
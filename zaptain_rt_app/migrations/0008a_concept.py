@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0007_releasecandidate_compressed_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Concept',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uri', models.URLField(max_length=300, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='subjectassignment',
+            name='concept',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='zaptain_rt_app.concept'),
+        ),
+        migrations.AlterField(
+            model_name='subjectassignment',
+            name='subject',
+            field=models.URLField(max_length=300, null=True),
+        ),
+    ]
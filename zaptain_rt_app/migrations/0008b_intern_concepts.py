@@ -0,0 +1,54 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:40
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+## concepts are created and assignments updated in batches, each batch is committed on its own
+BATCH_SIZE = 10000
+
+
+def _pk_ranges(model, batch_size=BATCH_SIZE):
+    pks = model.objects.order_by('pk').values_list('pk', flat=True)
+    last = pks.last()
+    start = pks.first()
+    while not start is None and start <= last:
+        yield start, start + batch_size
+        start += batch_size
+
+
+def intern_subjects(apps, schema_editor):
+    Concept = apps.get_model('zaptain_rt_app', 'Concept')
+    SubjectAssignment = apps.get_model('zaptain_rt_app', 'SubjectAssignment')
+    uris = SubjectAssignment.objects.order_by('subject').values_list('subject', flat=True).distinct().iterator()
+    batch = list()
+    for uri in uris:
+        batch.append(Concept(uri=uri))
+        if len(batch) >= BATCH_SIZE:
+            Concept.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = list()
+    Concept.objects.bulk_create(batch, ignore_conflicts=True)
+    ## one set-based UPDATE per range of assignments (uri is indexed by its unique constraint)
+    concept_ids = Concept.objects.filter(uri=OuterRef('subject')).values('id')[:1]
+    for start, end in _pk_ranges(SubjectAssignment):
+        SubjectAssignment.objects.filter(pk__gte=start, pk__lt=end, concept__isnull=True).update(concept_id=Subquery(concept_ids))
+
+
+def restore_subjects(apps, schema_editor):
+    Concept = apps.get_model('zaptain_rt_app', 'Concept')
+    SubjectAssignment = apps.get_model('zaptain_rt_app', 'SubjectAssignment')
+    uris = Concept.objects.filter(id=OuterRef('concept_id')).values('uri')[:1]
+    for start, end in _pk_ranges(SubjectAssignment):
+        SubjectAssignment.objects.filter(pk__gte=start, pk__lt=end).update(subject=Subquery(uris))
+
+
+class Migration(migrations.Migration):
+    ## no schema changes in the same transaction as the data updates (PostgreSQL: pending trigger events)
+    atomic = False
+
+    dependencies = [
+        ('zaptain_rt_app', '0008a_concept'),
+    ]
+
+    operations = [
+        migrations.RunPython(intern_subjects, restore_subjects),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0008b_intern_concepts'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='subjectassignment',
+            unique_together={('document', 'concept', 'indexer')},
+        ),
+        migrations.RemoveField(
+            model_name='subjectassignment',
+            name='subject',
+        ),
+        migrations.AlterField(
+            model_name='subjectassignment',
+            name='concept',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='zaptain_rt_app.concept'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0008c_concept_required'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.CharField(max_length=500)),
+                ('file_size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('n_lines', models.BigIntegerField(default=0)),
+                ('n_assignments', models.BigIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('indexer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='zaptain_rt_app.subjectindexer')),
+            ],
+            options={
+                'unique_together': {('file', 'indexer')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0009_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReleaseCandidateValidation',
+            fields=[
+                ('rc', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='validation', serialize=False, to='zaptain_rt_app.releasecandidate')),
+                ('checked', models.DateTimeField(auto_now=True)),
+                ('n_lines', models.IntegerField()),
+                ('n_issues', models.IntegerField()),
+                ('counts', models.JSONField(default=dict)),
+                ('issues', models.JSONField(default=list)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0010_releasecandidatevalidation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineStage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run', models.CharField(max_length=32)),
+                ('stage', models.CharField(choices=[('validate', 'validate'), ('index', 'index'), ('stats', 'stats'), ('stubs', 'stubs'), ('metadata', 'metadata')], max_length=20)),
+                ('position', models.SmallIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=10)),
+                ('n_chunks', models.IntegerField(default=0)),
+                ('n_done', models.IntegerField(default=0)),
+                ('message', models.CharField(blank=True, max_length=500)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('rc', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pipeline_stages', to='zaptain_rt_app.releasecandidate')),
+            ],
+            options={
+                'ordering': ('rc', 'position'),
+                'unique_together': {('rc', 'stage')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('zaptain_rt_app', '0011_pipelinestage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='min_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='top_k',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='releasecandidate',
+            name='min_score',
+            field=models.FloatField(blank=True, help_text='import filter: subjects with lower scores are not imported', null=True),
+        ),
+        migrations.AddField(
+            model_name='releasecandidate',
+            name='top_k',
+            field=models.PositiveIntegerField(blank=True, help_text='import filter: at most top_k subjects (with the best scores) are imported per document', null=True),
+        ),
+    ]
@@ -41,7 +41,17 @@ from .online_configuration import RtConfigKeys, RtConfigChoices
 from .online_configuration import CK_MAIN_AI
 from .online_configuration import CK_DOCUMENT_WEBLINK_PATTERN
 from .online_configuration import CK_CATALOG_API_PATTERN
+from . import releasecandidate_storage as rcstorage
+from . import releasecandidate_validation as rcvalidation
+from . import bulk_loader
+from . import sampling
 
+import random
+import logging
+from decimal import Decimal
+from collections import defaultdict
+
+import numpy as np
 import pandas as pd
 
 #
@@ -223,6 +233,9 @@ class Document(models.Model):
     class Meta:
         ordering = ('external_id',)
 
+## number of records per chunk (and rows per INSERT) of bulk imports
+IMPORT_BATCH_SIZE = 1000
+
 class Collection(models.Model):
     """
     A collection of documents.
@@ -232,6 +245,7 @@ class Collection(models.Model):
     name = models.CharField(max_length=300, unique=True)
     description = models.CharField(max_length=500)
     documents = models.ManyToManyField(Document)
+    sample_seed = models.BigIntegerField(blank=True, null=True, help_text="""seed of the random sample the collection was drawn with, if any""")
     
     def compute_overlap(self, other):
         return self.documents.filter(external_id__in=other.documents.values("external_id")).count()
@@ -239,10 +253,96 @@ class Collection(models.Model):
     def count_reviews(self):
         return Review.objects.filter(document__in=self.documents.all()).count()
     
+    def replace_documents(self, docids, batch_size=IMPORT_BATCH_SIZE):
+        """
+        replace the members of the collection by the documents docids (unknown ids are ignored),
+        with bulk queries on the m2m table; the documents themselves are not touched.
+        
+        returns the number of members
+        """
+        Through = Collection.documents.through
+        n_members = 0
+        with transaction.atomic():
+            Through.objects.filter(collection_id=self.pk).delete()
+            for part in rcstorage.chunked(docids, batch_size):
+                known = Document.objects.filter(external_id__in=part).values_list("external_id", flat=True)
+                links = [Through(collection_id=self.pk, document_id=docid) for docid in known]
+                Through.objects.bulk_create(links, batch_size=batch_size, ignore_conflicts=True)
+                n_members += len(links)
+        return n_members
+    
     def __str__(self):
         return self.name
 
 
+## process-level cache of the concept table, uri <=> id;
+# filled only after the surrounding transaction has been committed
+_CONCEPT_IDS = dict()
+_CONCEPT_URIS = dict()
+
+def _remember_concepts(pairs):
+    pairs = list(pairs)
+    def remember():
+        for uri, cid in pairs:
+            _CONCEPT_IDS[uri] = cid
+            _CONCEPT_URIS[cid] = uri
+    transaction.on_commit(remember)
+
+
+class Concept(models.Model):
+    """
+    Interned subject URI, e.g. "http://zbw.eu/stw/descriptor/10503-3".
+    
+    Subject assignments refer to concepts by integer key instead of repeating
+    the full URI in every row.
+    """
+    uri = models.URLField(max_length=300, unique=True)
+    
+    @classmethod
+    def intern(clz, uris, batch_size=IMPORT_BATCH_SIZE):
+        """
+        returns: dictionary, uri => concept id; unknown URIs are created in bulk
+        """
+        ids = dict()
+        missing = list()
+        for uri in set(uris):
+            cid = _CONCEPT_IDS.get(uri)
+            if cid is None:
+                missing.append(uri)
+            else:
+                ids[uri] = cid
+        for part in rcstorage.chunked(missing, batch_size):
+            found = dict(clz.objects.filter(uri__in=part).values_list("uri", "id"))
+            new = [uri for uri in part if not uri in found]
+            if new:
+                clz.objects.bulk_create([clz(uri=uri) for uri in new], 
+                                        batch_size=batch_size, ignore_conflicts=True)
+                found.update(clz.objects.filter(uri__in=new).values_list("uri", "id"))
+            _remember_concepts(found.items())
+            ids.update(found)
+        return ids
+    
+    @classmethod
+    def get_id(clz, uri):
+        return clz.intern([uri])[uri]
+    
+    @classmethod
+    def get_uri(clz, cid):
+        uri = _CONCEPT_URIS.get(cid)
+        if uri is None:
+            uri = clz.objects.values_list("uri", flat=True).get(id=cid)
+            _remember_concepts([(uri, cid)])
+        return uri
+    
+    @staticmethod
+    def clear_cache():
+        _CONCEPT_IDS.clear()
+        _CONCEPT_URIS.clear()
+    
+    def __str__(self):
+        return self.uri
+
+
 class SubjectAssignment(models.Model):
     """
     Assignment of relevance of a subject to a document.
@@ -252,9 +352,12 @@ class SubjectAssignment(models.Model):
     
     free text can be supported as well in a later version, example:
         subject = "http://mycustomdomain/keyword/Kiel"
+    
+    The subject URI is stored in the Concept table,
+    the property 'subject' resolves it (and accepts URIs on construction).
     """
     document = models.ForeignKey(Document, on_delete=models.CASCADE)
-    subject = models.URLField(max_length=300)
+    concept = models.ForeignKey(Concept, on_delete=models.PROTECT)
     score = models.DecimalField(max_digits=3, decimal_places=2) # TODO limit 0 <= x <= 1
     indexer = models.ForeignKey(SubjectIndexer, on_delete=models.CASCADE)
     ## add the possibility of binding the assignment to a specific review:
@@ -264,11 +367,21 @@ class SubjectAssignment(models.Model):
                blank=True, null=True,
                related_name='missing_subjects')
     
+    @property
+    def subject(self):
+        if self._meta.get_field("concept").is_cached(self):
+            return self.concept.uri
+        return Concept.get_uri(self.concept_id)
+    
+    @subject.setter
+    def subject(self, uri):
+        self.concept_id = Concept.get_id(uri)
+    
     def __str__(self):
         return "%s^%0.2f#%s" % (self.document.external_id, self.score, self.subject)
     
     class Meta:
-        unique_together = ("document", "subject", "indexer")
+        unique_together = ("document", "concept", "indexer")
 
 class ReviewerWrapper(object):
     """
@@ -378,18 +491,16 @@ class SubjectLevelReview(models.Model):
         unique_together = ("review", "subject_assignment")
 
 
-_parse_cell = lambda cell: (cell if ':' in cell else cell + ':1.0').split(':') 
+_parse_cell = rcstorage.parse_cell
 
-def _sample(docids, size, whiteset=None):
-    if whiteset is not None:
-        docids = list(whiteset.intersection(docids))
-    else:
-        docids = docids
-    pdser = pd.Series(docids)
-    n = min(size, pdser.size)
-    if n == 0:
-        raise EmptySampleException()
-    return pdser.sample(n)
+_parse_line = rcstorage.parse_line
+
+## scores as stored by SubjectAssignment.score
+_quantize_score = lambda score: Decimal("%.2f" % score)
+
+## document attributes and derived keys that samples can be stratified by
+SAMPLE_STRATA_DOCUMENT = ("doc_type", "has_abstract", "has_ft_url")
+SAMPLE_STRATA = SAMPLE_STRATA_DOCUMENT + ("score_band",)
 
 class ReleaseCandidate(models.Model):
     """
@@ -402,31 +513,157 @@ class ReleaseCandidate(models.Model):
     description = models.CharField(max_length=500, blank=True)
     pub_date = models.DateTimeField('date published', help_text="""Published means, e.g., upload into releasetool, not published to operative IR system.""")
     file = models.FileField(upload_to='releasecandidates/', help_text="""File content:
-        tab-separated values; for each row: first cell = document external id, then subjects""")
+        tab-separated values; for each row: first cell = document external id, then subjects;
+        optionally compressed (.gz, .bz2, .xz, .zst)""")
     indexer = models.ForeignKey(SubjectIndexer, on_delete=models.CASCADE)
     concept_template = models.CharField(max_length=300, blank=True, null=True, help_text="""str.format template with concept id inserted as named argument "cid", e.g., http://zbw.eu/stw/descriptor/{cid}""")
+    min_score = models.FloatField(blank=True, null=True, help_text="""import filter: subjects with lower scores are not imported""")
+    top_k = models.PositiveIntegerField(blank=True, null=True, help_text="""import filter: at most top_k subjects (with the best scores) are imported per document""")
+    
+    def build_index(self):
+        """
+        (re-)build the sidecar index (docid -> byte offset/length) of the file,
+        called when a file is uploaded.
+        """
+        return rcstorage.build_index(self.file.path)
+    
+    def get_index(self):
+        """
+        returns: RecordIndex of this RC, see releasecandidate_storage
+        """
+        return rcstorage.load_index(self.file.path)
+    
+    def build_columns(self):
+        """
+        (re-)build the columnar store of the file, called when a file is uploaded.
+        """
+        return rcstorage.build_columns(self.file.path)
+    
+    def get_columns(self):
+        """
+        returns: memory-mapped ColumnarRC of this RC, see releasecandidate_storage
+        """
+        return rcstorage.load_columns(self.file.path)
+    
+    def format_concepts(self, concept_ids):
+        """
+        apply concept_template to raw concept ids, e.g., from ColumnarRC.concepts
+        """
+        _ctmplt = self.concept_template
+        return [_ctmplt.format(cid=cid) for cid in concept_ids]
+    
+    def compute_statistics(self):
+        """
+        compute statistics from the columnar store and persist them,
+        see ReleaseCandidateStatistics.
+        """
+        cols = self.get_columns()
+        spd = cols.subjects_per_document()
+        scores = np.clip(cols.scores.astype(np.float64), 0.0, 1.0)
+        counts, edges = np.histogram(scores, bins=SCORE_HISTOGRAM_BINS, range=(0.0, 1.0))
+        stats, _ = ReleaseCandidateStatistics.objects.update_or_create(rc=self, defaults={
+                "n_lines": cols.n_documents,
+                "n_assignments": cols.n_assignments,
+                "n_concepts": int(np.count_nonzero(cols.concept_counts())),
+                "subjects_per_document": np.bincount(spd).tolist() if spd.size > 0 else [],
+                "score_histogram": {"edges": edges.round(4).tolist(), "counts": counts.tolist()},
+                })
+        return stats
+    
+    def get_statistics(self):
+        """
+        returns: persisted ReleaseCandidateStatistics, or None if they have not been computed yet
+        """
+        try:
+            return self.statistics
+        except ReleaseCandidateStatistics.DoesNotExist:
+            return None
+    
+    def validate(self, known_concepts=None, max_issues=100):
+        """
+        check the file in one pass (see releasecandidate_validation) and persist the result,
+        see ReleaseCandidateValidation.
+        
+        known_concepts: collection of valid concept URIs, None: accept all well-formed URIs
+        """
+        validator, issues = rcvalidation.validate_file(self.file.path, self.concept_template, 
+                                                       known_concepts, max_issues)
+        validation, _ = ReleaseCandidateValidation.objects.update_or_create(rc=self, defaults={
+                "n_lines": validator.n_lines,
+                "n_issues": sum(validator.counts.values()),
+                "counts": validator.summary(),
+                "issues": [list(issue) for issue in issues],
+                })
+        return validation
+    
+    def get_validation(self):
+        """
+        returns: persisted ReleaseCandidateValidation, or None if the file has not been validated yet
+        """
+        try:
+            return self.validation
+        except ReleaseCandidateValidation.DoesNotExist:
+            return None
     
     def get_document_ids(self):
         """
         returns: LIST of all document ids comprised by this RC
         """
-        with self.file.open(mode="r") as fi:
-            return [row.split('\t')[0] for row in fi.read().splitlines()]
+        return list(self.get_index().docids)
+    
+    def has_document(self, docid):
+        return docid in self.get_index()
     
     def get_content(self):
-        with self.file.open(mode="r") as fi:
+        with rcstorage.open_text(self.file.path) as fi:
             return fi.read()
     
     def iter_statements(self):
         _ctmplt = self.concept_template
-        with self.file.open(mode="r") as fi:
+        with rcstorage.open_text(self.file.path) as fi:
             for ln in fi:
-                _cells = ln.strip().split("\t")
-                docid = _cells[0]
-                crefs = dict((_ctmplt.format(cid=cid), float(score)) for cid, score in map(_parse_cell, _cells[1:]))
-                yield {"external_id": docid, "subjects": crefs}
+                yield _parse_line(ln, _ctmplt)
+    
+    def iter_compact_records(self, docids=None):
+        """
+        like iter_statements (or iter_records, given docids), but yields compact records 
+        with raw concept ids and array('f') scores (see rcstorage.CompactRecord),
+        URIs are formatted on demand: record.subjects(rc.concept_template)
+        """
+        if docids is None:
+            yield from rcstorage.iter_compact_records(self.file.path)
+        else:
+            for docid, ln in rcstorage.read_lines(self.file.path, self.get_index(), docids):
+                yield rcstorage.parse_record(ln)
     
-    def sample(self, n=200, whiteset=None):
+    def iter_statements_parallel(self, workers=None, ordered=True):
+        """
+        like iter_statements, but the file is split into line-aligned byte ranges
+        that are parsed by a pool of worker processes.
+        
+        ordered: if False, statements of a range are yielded as soon as it is parsed
+        """
+        return rcstorage.iter_statements_parallel(self.file.path, self.concept_template,
+                                                  workers=workers, ordered=ordered)
+    
+    def iter_records(self, docids):
+        """
+        random access by the sidecar index,
+        yield statements (see iter_statements) for the given docids, in file order.
+        """
+        _ctmplt = self.concept_template
+        for docid, ln in rcstorage.read_lines(self.file.path, self.get_index(), docids):
+            yield _parse_line(ln, _ctmplt)
+    
+    def get_record(self, docid):
+        """
+        returns: statement (see iter_statements) of docid, or None if docid is not part of this RC
+        """
+        for stmt in self.iter_records([docid]):
+            return stmt
+        return None
+    
+    def sample(self, n=200, whiteset=None, seed=None):
         """
         Simple method that can be used to create new collections.
         If you want to create collections in a more sophicsticated way,
@@ -434,61 +671,128 @@ class ReleaseCandidate(models.Model):
         
         return a random sample (pd.Series) of $n document ids from this release candidate.
         """
-        return _sample(self.get_document_ids(), n, whiteset)
+        docids, _seed = self.sample_stream(n, seed=seed, whiteset=whiteset)
+        if len(docids) == 0:
+            raise EmptySampleException()
+        return pd.Series(docids)
     
-    @transaction.atomic
-    def create_document_stubs(self):
+    def sample_stream(self, n, seed=None, stratify_by=None, queryset=None, whiteset=None,
+                      n_bands=5, batch_size=IMPORT_BATCH_SIZE):
+        """
+        Single pass, seeded reservoir sampling of $n document ids, 
+        optionally stratified (proportional allocation) by one of SAMPLE_STRATA.
+        
+        Document ids are streamed from the columnar store in chunks of batch_size,
+        candidates can be restricted by a Document queryset (evaluated per chunk) and/or a whiteset.
+        
+        returns (LIST of document ids, seed), the same seed and candidates reproduce the sample
+        """
+        if not stratify_by is None and not stratify_by in SAMPLE_STRATA:
+            raise ValueError("illegal stratify_by parameter: %s" % (stratify_by,))
+        if seed is None:
+            seed = sampling.new_seed()
+        rng = random.Random(seed)
+        candidates = self._iter_sample_candidates(stratify_by, queryset, whiteset, n_bands, batch_size)
+        if stratify_by is None:
+            docids = sampling.reservoir_sample((docid for _, docid in candidates), n, rng)
+        else:
+            docids = sampling.stratified_sample(candidates, n, rng)
+        return docids, seed
+    
+    def _iter_sample_candidates(self, stratify_by, queryset, whiteset, n_bands, batch_size):
+        """
+        yield (stratum key, docid) for sampling
+        """
+        cols = self.get_columns()
+        bands = None
+        if stratify_by == "score_band":
+            counts = cols.subjects_per_document()
+            sums = np.bincount(cols.doc_idx, weights=cols.scores, minlength=cols.n_documents)
+            means = sums / np.maximum(counts, 1)
+            bands = np.minimum((means * n_bands).astype(int), n_bands - 1)
+        for start in range(0, cols.n_documents, batch_size):
+            chunk = cols.documents[start:start + batch_size].tolist()
+            keys = bands[start:start + batch_size].tolist() if bands is not None else [None] * len(chunk)
+            candidates = list(zip(keys, chunk))
+            if not whiteset is None:
+                candidates = [(k, d) for k, d in candidates if d in whiteset]
+            if stratify_by in SAMPLE_STRATA_DOCUMENT or not queryset is None:
+                qs = (queryset if not queryset is None else Document.objects).filter(
+                        external_id__in=[d for _, d in candidates])
+                if stratify_by in SAMPLE_STRATA_DOCUMENT:
+                    ## without queryset, documents lacking a db object form a stratum of their own
+                    attrs = dict(qs.values_list("external_id", stratify_by))
+                    candidates = [(attrs.get(d), d) for _, d in candidates if queryset is None or d in attrs]
+                else:
+                    attrs = set(qs.values_list("external_id", flat=True))
+                    candidates = [(k, d) for k, d in candidates if d in attrs]
+            for candidate in candidates:
+                yield candidate
+    
+    def create_document_stubs(self, docids=None, batch_size=IMPORT_BATCH_SIZE, progress=None):
         """
         create Document object stubs (only external_id, empty title) for ALL
-        records of this RC.
+        records of this RC, or only for docids.
+        
+        Ids are processed in chunks of batch_size, only missing documents are inserted (in bulk)
+        and each chunk is committed on its own: the db is never locked for long,
+        and an interrupted run can simply be repeated.
+        
+        progress: optional callable(n_processed, n_total, n_created), called after each chunk
+        returns the number of created stubs
         """
-        for lni, row in enumerate(self.get_content().splitlines()):
-            _cells = row.strip().split("\t")
-            docid = _cells[0]
-            dbdoc, _ = Document.objects.get_or_create(external_id=docid)
+        if docids is None:
+            docids = self.get_document_ids()
+        n_total = len(docids)
+        n_processed, n_created = 0, 0
+        for chunk in rcstorage.chunked(docids, batch_size):
+            with transaction.atomic():
+                known = set(Document.objects.filter(external_id__in=chunk).values_list("external_id", flat=True))
+                stubs = [Document(external_id=docid, title='') for docid in set(chunk) if not docid in known]
+                Document.objects.bulk_create(stubs, batch_size=batch_size, ignore_conflicts=True)
+            n_processed += len(chunk)
+            n_created += len(stubs)
+            if not progress is None:
+                progress(n_processed, n_total, n_created)
+        return n_created
     
     def import_records(self, docids, create_emptydoc=True, skip_docfail=False, 
-                         collection=None, limit=-1):
+                         collection=None, limit=-1, batch_size=IMPORT_BATCH_SIZE, delta=False,
+                         min_score=None, top_k=None):
         """
         if necessary, create document stubs and subj assignments for all docids.
         
-        note: docids for which subj assignments with INDEXER are already in the DB will be EXCLUDED
+        Records are streamed by the sidecar index and written in chunks of batch_size records,
+        each chunk costs a constant number of queries and is committed on its own.
+        
+        note: docids for which subj assignments with INDEXER are already in the DB will be EXCLUDED,
+        unless delta is set: then, existing assignments are compared with the records,
+        new subjects are inserted, changed scores updated and removed subjects deleted
+        (except for reviewed assignments, which are kept), unchanged assignments are not touched.
+        
+        min_score, top_k: filter the subjects of each record before anything is written
+        (see rcstorage.filter_statements), only for this call: the filter recorded on the RC
+        (by rt_import_subjas_from_rc) is informative and never applied implicitly.
+        
+        returns the number of imported documents
         """
-        rc = self
         _ctmplt = self.concept_template
-        indexer = self.indexer
-        ## determine already available assignments
-        # these documents are excluded
-        # convert to set! > https://wiki.python.org/moin/TimeComplexity
-        exclude = set(SubjectAssignment.objects.filter(
-                document__external_id__in=docids, indexer=rc.indexer).values_list("document__external_id", flat=True))
-        for lni, row in enumerate(rc.get_content().splitlines()):
-            _cells = row.strip().split("\t")
-            docid = _cells[0]
-            doci = 0
-            if docid in docids:
-                if not docid in exclude:
-                    doc = None
-                    try:
-                        doc = Document.objects.get(external_id=docid)
-                    except Document.DoesNotExist as err:
-                        if create_emptydoc:
-                            doc = Document.objects.create(external_id=docid, title='-')
-                        else:
-                            if skip_docfail:
-                                pass
-                                # self.stderr.write("illegal document reference to %s" % (str(docid,)))
-                            else:
-                                raise err
-                    if not doc is None:
-                        crefs = dict((_ctmplt.format(cid=cid), float(score)) for cid, score in map(_parse_cell, _cells[1:]))
-                        indexer.assign_scored(doc, crefs)          
-                        if not collection is None:
-                            collection.documents.add(doc)
-                        if limit > -1 and doci >= limit:
-                            break
-                    doci += 1
-        # TODO need to call collection.save() ?!
+        records = rcstorage.read_lines(self.file.path, self.get_index(), docids)
+        n_imported = 0
+        loader = bulk_loader.get_loader()
+        with loader.import_session():
+            for chunk in rcstorage.chunked(records, batch_size):
+                if limit > -1:
+                    chunk = chunk[:max(limit - n_imported, 0)]
+                    if len(chunk) == 0:
+                        break
+                statements = [_parse_line(ln, _ctmplt) for _, ln in chunk]
+                statements = rcstorage.filter_statements(statements, min_score, top_k)
+                with transaction.atomic():
+                    n_docs, _ = import_statements(self.indexer, statements, create_emptydoc, skip_docfail, 
+                                                  collection, batch_size, delta, loader)
+                n_imported += n_docs
+        return n_imported
     
     def __str__(self):
         return self.name
@@ -496,3 +800,196 @@ class ReleaseCandidate(models.Model):
     class Meta:
         ordering = ('pub_date', 'name',)
         get_latest_by = "pub_date"
+
+
+def import_statements(indexer, statements, create_emptydoc=True, skip_docfail=False, 
+                      collection=None, batch_size=IMPORT_BATCH_SIZE, delta=False, loader=None, locations=None):
+    """
+    bulk import of subject assignments by indexer for a chunk of statements (see rcstorage.parse_line),
+    with a constant number of queries, call it inside a transaction.
+    
+    Documents that already have assignments by indexer are skipped (see ReleaseCandidate.import_records),
+    unless delta is set. In delta mode, assignments with subject level reviews are never deleted (a warning is logged).
+    New assignments are written by loader, defaults to the bulk loader of the db backend (see bulk_loader).
+    locations: optional LIST of the source of each statement (e.g., "file:line"), reported by errors
+    
+    returns: (number of imported documents, number of inserted assignments)
+    """
+    chunk_ids = [stmt["external_id"] for stmt in statements]
+    ## determine already available assignments
+    existing = defaultdict(dict) # document id => {concept id: (assignment id, score)}
+    exclude = set()
+    if delta:
+        for sa_id, doc_id, cid, score in SubjectAssignment.objects.filter(
+                document_id__in=chunk_ids, indexer=indexer, review_binding__isnull=True).values_list(
+                        "id", "document_id", "concept_id", "score"):
+            existing[doc_id][cid] = (sa_id, score)
+    else:
+        # these documents are excluded
+        exclude = set(SubjectAssignment.objects.filter(
+                document__external_id__in=chunk_ids, indexer=indexer).values_list("document_id", flat=True))
+    docs = Document.objects.in_bulk(chunk_ids)
+    missing = [docid for docid in chunk_ids if not docid in docs]
+    if missing:
+        if create_emptydoc:
+            stubs = [Document(external_id=docid, title='-') for docid in missing]
+            Document.objects.bulk_create(stubs, batch_size=batch_size, ignore_conflicts=True)
+            docs.update((doc.external_id, doc) for doc in stubs)
+        elif not skip_docfail:
+            where = "" if locations is None else " (%s)" % (locations[chunk_ids.index(missing[0])],)
+            raise Document.DoesNotExist("illegal document reference to %s%s" % (missing[0], where))
+    concept_ids = Concept.intern((subj for stmt in statements for subj in stmt["subjects"]), batch_size)
+    if loader is None:
+        loader = bulk_loader.get_loader()
+    rows = list()
+    updates = list()
+    deletes = list()
+    imported = list()
+    for stmt in statements:
+        doc = docs.get(stmt["external_id"])
+        if doc is None or doc.external_id in exclude:
+            continue
+        subjects = dict((concept_ids[subj], score) for subj, score in stmt["subjects"].items())
+        old = existing.get(doc.pk)
+        if old:
+            for cid, (sa_id, score) in old.items():
+                if not cid in subjects:
+                    deletes.append(sa_id)
+                elif _quantize_score(subjects[cid]) != score:
+                    updates.append(SubjectAssignment(id=sa_id, score=_quantize_score(subjects[cid])))
+            subjects = dict((cid, score) for cid, score in subjects.items() if not cid in old)
+        rows += [(doc.pk, cid, indexer.pk, _quantize_score(score)) for cid, score in subjects.items()]
+        imported.append(doc)
+    n_rows = loader.insert_rows(SubjectAssignment, ("document", "concept", "indexer", "score"), rows, batch_size)
+    if updates:
+        SubjectAssignment.objects.bulk_update(updates, ["score"], batch_size=batch_size)
+    for ids in rcstorage.chunked(deletes, batch_size):
+        ## reviewed assignments are kept, deleting them would cascade to the reviews
+        reviewed = set(SubjectLevelReview.objects.filter(subject_assignment_id__in=ids).values_list(
+                "subject_assignment_id", flat=True))
+        if reviewed:
+            logging.warning("delta import by %s: kept %d reviewed assignments that are no longer in the records (ids: %s)" 
+                            % (indexer, len(reviewed), ", ".join(str(sa_id) for sa_id in sorted(reviewed))))
+        SubjectAssignment.objects.filter(id__in=ids).exclude(id__in=reviewed).delete()
+    if not collection is None:
+        Through = Collection.documents.through
+        links = [Through(collection_id=collection.pk, document_id=doc.pk) for doc in imported]
+        Through.objects.bulk_create(links, batch_size=batch_size, ignore_conflicts=True)
+    return len(imported), n_rows
+
+
+class ReleaseCandidateValidation(models.Model):
+    """
+    Result of the validation of a release candidate's file, 
+    run in the background when the file is uploaded, see pipeline (validate stage).
+    
+    counts: {issue kind: number of issues}
+    issues: LIST of the first issues, [line number, kind, message]
+    """
+    rc = models.OneToOneField(ReleaseCandidate, on_delete=models.CASCADE, primary_key=True, related_name='validation')
+    checked = models.DateTimeField(auto_now=True)
+    n_lines = models.IntegerField()
+    n_issues = models.IntegerField()
+    counts = models.JSONField(default=dict)
+    issues = models.JSONField(default=list)
+    
+    def is_valid(self):
+        return self.n_issues == 0
+    
+    def __str__(self):
+        return "validation(%s)" % (self.rc_id,)
+
+
+## stages of the release candidate pipeline, in order, see pipeline.py
+STAGE_VALIDATE = "validate"
+STAGE_INDEX = "index"
+STAGE_STATS = "stats"
+STAGE_STUBS = "stubs"
+STAGE_METADATA = "metadata"
+PIPELINE_STAGES = (STAGE_VALIDATE, STAGE_INDEX, STAGE_STATS, STAGE_STUBS, STAGE_METADATA)
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STAGE_STATUS_CHOICES = tuple((status, status) for status in (STATUS_PENDING, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED))
+
+class PipelineStage(models.Model):
+    """
+    Progress record of one stage of a pipeline run for a release candidate.
+    
+    A stage is split into n_chunks django-q tasks, n_done counts the finished ones;
+    run identifies the pipeline run, tasks of earlier runs are ignored.
+    """
+    rc = models.ForeignKey(ReleaseCandidate, on_delete=models.CASCADE, related_name='pipeline_stages')
+    run = models.CharField(max_length=32)
+    stage = models.CharField(max_length=20, choices=tuple((stage, stage) for stage in PIPELINE_STAGES))
+    position = models.SmallIntegerField()
+    status = models.CharField(max_length=10, choices=STAGE_STATUS_CHOICES, default=STATUS_PENDING)
+    n_chunks = models.IntegerField(default=0)
+    n_done = models.IntegerField(default=0)
+    message = models.CharField(max_length=500, blank=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    
+    def progress(self):
+        return "%d/%d" % (self.n_done, self.n_chunks)
+    
+    def __str__(self):
+        return "%s:%s (%s, %s)" % (self.rc_id, self.stage, self.status, self.progress())
+    
+    class Meta:
+        unique_together = ("rc", "stage")
+        ordering = ("rc", "position")
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress of a bulk import of a subject assignment file (see rt_import_subjas),
+    updated in the transaction of each committed chunk.
+    
+    offset: byte position right after the last committed line (of the decompressed content)
+    file_size: size of the file when the import started, to detect modified files
+    min_score, top_k: subject filter of the import
+    """
+    file = models.CharField(max_length=500)
+    indexer = models.ForeignKey(SubjectIndexer, on_delete=models.CASCADE)
+    file_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    n_lines = models.BigIntegerField(default=0)
+    n_assignments = models.BigIntegerField(default=0)
+    min_score = models.FloatField(blank=True, null=True)
+    top_k = models.PositiveIntegerField(blank=True, null=True)
+    completed = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return "%s@%d (%s)" % (self.file, self.offset, self.indexer)
+    
+    class Meta:
+        unique_together = ("file", "indexer")
+
+
+SCORE_HISTOGRAM_BINS = 10
+
+class ReleaseCandidateStatistics(models.Model):
+    """
+    Statistics of a release candidate's file, computed once in the background
+    when the file is uploaded, see pipeline (stats stage).
+    
+    subjects_per_document: LIST, i-th entry = number of documents with i subjects
+    score_histogram: {"edges": [...], "counts": [...]}, scores in [0, 1]
+    """
+    rc = models.OneToOneField(ReleaseCandidate, on_delete=models.CASCADE, primary_key=True, related_name='statistics')
+    computed = models.DateTimeField(auto_now=True)
+    n_lines = models.IntegerField()
+    n_assignments = models.BigIntegerField()
+    n_concepts = models.IntegerField()
+    subjects_per_document = models.JSONField(default=list)
+    score_histogram = models.JSONField(default=dict)
+    
+    def mean_subjects(self):
+        return self.n_assignments / self.n_lines if self.n_lines > 0 else 0.0
+    
+    def __str__(self):
+        return "stats(%s)" % (self.rc_id,)
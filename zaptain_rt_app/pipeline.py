@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Staged background pipeline for release candidates, run by django-q workers:
+
+    validate -> index -> stats -> stubs -> metadata
+
+Each stage is split into chunks, one task per chunk, so that several workers share a stage.
+The progress of each stage is recorded by a PipelineStage object (see the ReleaseCandidate admin);
+the task that finishes the last chunk of a stage enqueues the next stage.
+
+validate, index and stats read the whole file and form a single chunk each
+(django-q workers are daemonic and cannot start child processes, thus the columnar store 
+of the stats stage is parsed within the worker, see rcstorage.map_ranges);
+stubs and metadata are chunked by the document ids of the sidecar index.
+"""
+__author__ = "Martin Toepfer"
+
+import logging
+import uuid
+
+from django.db.models import F
+from django.utils import timezone as tz
+from django_q.tasks import async_task
+
+from .models import ReleaseCandidate, Document, Concept, PipelineStage
+from .models import PIPELINE_STAGES, STAGE_VALIDATE, STAGE_INDEX, STAGE_STATS, STAGE_STUBS, STAGE_METADATA
+from .models import STATUS_RUNNING, STATUS_DONE, STATUS_FAILED
+from .catalog_connection import CatalogApi
+from .thesaurus_store import get_store
+from .exceptions import InvalidReleaseCandidateException
+
+## task function, referenced by name for django-q (see tasks.run_pipeline_chunk)
+CHUNK_TASK = "zaptain_rt_app.tasks.run_pipeline_chunk"
+
+## number of documents per chunk
+CHUNK_SIZES = {
+    STAGE_STUBS: 10000,
+    STAGE_METADATA: 200,
+}
+
+
+def start(rc, stages=PIPELINE_STAGES):
+    """
+    (re)start the pipeline for rc with the given stages (in pipeline order),
+    returns: the run id
+    """
+    run = uuid.uuid4().hex
+    stages = [stage for stage in PIPELINE_STAGES if stage in stages]
+    PipelineStage.objects.filter(rc=rc).delete()
+    PipelineStage.objects.bulk_create([PipelineStage(rc=rc, run=run, stage=stage, position=i) 
+                                       for i, stage in enumerate(stages)])
+    if stages:
+        enqueue_stage(rc, run, stages[0])
+    return run
+
+def enqueue_stage(rc, run, stage):
+    """
+    mark the stage as running and enqueue one task per chunk
+    """
+    n_chunks = _count_chunks(rc, stage)
+    PipelineStage.objects.filter(rc=rc, run=run, stage=stage).update(
+            status=STATUS_RUNNING, n_chunks=n_chunks, n_done=0, started=tz.now())
+    if n_chunks == 0:
+        _finish_stage(rc, run, stage)
+    for chunk_no in range(n_chunks):
+        async_task(CHUNK_TASK, rc.name, run, stage, chunk_no)
+
+def run_chunk(rc_name, run, stage, chunk_no):
+    """
+    process chunk chunk_no of the stage, tasks of outdated runs are skipped.
+    """
+    records = PipelineStage.objects.filter(rc_id=rc_name, run=run, stage=stage, status=STATUS_RUNNING)
+    if not records.exists():
+        logging.info("pipeline %s of %s: stage %s is not running, skip chunk %d" % (run, rc_name, stage, chunk_no))
+        return
+    rc = ReleaseCandidate.objects.get(name=rc_name)
+    try:
+        message = _STAGE_FUNCS[stage](rc, chunk_no)
+    except Exception as err:
+        records.update(status=STATUS_FAILED, message=("chunk %d: %s" % (chunk_no, err))[:500], finished=tz.now())
+        raise
+    if message:
+        records.update(message=message[:500])
+    records.update(n_done=F("n_done") + 1)
+    ## exactly one task observes the last chunk
+    if records.filter(n_done=F("n_chunks")).update(status=STATUS_DONE, finished=tz.now()) == 1:
+        _next_stage(rc, run, stage)
+
+def _finish_stage(rc, run, stage):
+    if PipelineStage.objects.filter(rc=rc, run=run, stage=stage, status=STATUS_RUNNING).update(
+            status=STATUS_DONE, finished=tz.now()) == 1:
+        _next_stage(rc, run, stage)
+
+def _next_stage(rc, run, stage):
+    nxt = PipelineStage.objects.filter(rc=rc, run=run, position__gt=
+                                       PipelineStage.objects.get(rc=rc, run=run, stage=stage).position).first()
+    if not nxt is None:
+        enqueue_stage(rc, run, nxt.stage)
+
+## the RecordIndex is cached per process, slicing its docids avoids copying all ids for every chunk
+def _count_chunks(rc, stage):
+    if stage in CHUNK_SIZES:
+        size = CHUNK_SIZES[stage]
+        return (len(rc.get_index()) + size - 1) // size
+    return 1
+
+def _chunk_docids(rc, stage, chunk_no):
+    size = CHUNK_SIZES[stage]
+    return rc.get_index().docids[chunk_no * size:(chunk_no + 1) * size]
+
+#----# STAGES #----#
+
+def _known_concepts():
+    """
+    returns: (collection of valid concept URIs or None, description of the concept check),
+    the harvested thesaurus store is preferred over the concepts in the db
+    """
+    store = get_store()
+    if not store is None:
+        return store.index, "concepts checked against the thesaurus store"
+    if Concept.objects.exists():
+        return set(Concept.objects.values_list("uri", flat=True)), "concepts checked against the db"
+    return None, "concept check skipped (no thesaurus store, no concepts in the db)"
+
+def _validate(rc, chunk_no):
+    known_concepts, concept_check = _known_concepts()
+    validation = rc.validate(known_concepts)
+    if not validation.is_valid():
+        raise InvalidReleaseCandidateException("%d issues in %d lines, %s, see the validation of %s" 
+                                               % (validation.n_issues, validation.n_lines, concept_check, rc.name))
+    return "%d lines, %s" % (validation.n_lines, concept_check)
+
+def _index(rc, chunk_no):
+    rc.build_index()
+    return "%d records" % (len(rc.get_index()),)
+
+def _stats(rc, chunk_no):
+    stats = rc.compute_statistics()
+    return "%d documents, %d assignments" % (stats.n_lines, stats.n_assignments)
+
+def _stubs(rc, chunk_no):
+    n_created = rc.create_document_stubs(_chunk_docids(rc, STAGE_STUBS, chunk_no))
+    return "chunk %d: %d stubs created" % (chunk_no, n_created)
+
+def _metadata(rc, chunk_no):
+    catapi = CatalogApi.create_from_db()
+    catapi.fetch_metadata(Document.objects.filter(external_id__in=_chunk_docids(rc, STAGE_METADATA, chunk_no)))
+
+_STAGE_FUNCS = {
+    STAGE_VALIDATE: _validate,
+    STAGE_INDEX: _index,
+    STAGE_STATS: _stats,
+    STAGE_STUBS: _stubs,
+    STAGE_METADATA: _metadata,
+}
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Document-level diff of two release candidates.
+
+The diff is a merge-join over the document dictionaries of both columnar stores
+(see releasecandidate_storage.ColumnarRC), sorted by external id.
+Only one document pair is materialized at a time, corpus-wide counters are NumPy arrays.
+
+Documents that occur several times in a file are compared by their FIRST record
+(like releasecandidate_storage.RecordIndex), further records are skipped and counted.
+"""
+__author__ = "Martin Toepfer"
+
+from collections import namedtuple
+
+import numpy as np
+
+## status of a document in the diff
+ONLY_A = "only_a"
+ONLY_B = "only_b"
+BOTH = "both"
+
+DocumentDiff = namedtuple("DocumentDiff", [
+        "external_id", "status", "n_a", "n_b", "jaccard",
+        "added", "removed", "score_deltas"])
+DocumentDiff.__doc__ = """
+added, removed: LISTs of concept ids, score_deltas: LIST of (concept id, score b - score a)
+"""
+
+
+## documents are checked for sort order in blocks of this size
+_SORTED_BLOCK = 1 << 16
+
+def _is_sorted(documents):
+    for lo in range(0, max(documents.shape[0] - 1, 0), _SORTED_BLOCK):
+        block = documents[lo:lo + _SORTED_BLOCK + 1]
+        if (block[1:] < block[:-1]).any():
+            return False
+    return True
+
+class _Cursor(object):
+    """
+    Walks the documents of a ColumnarRC in external id order,
+    docid/pos: current external id (None at the end) and its document index.
+    
+    Files that are sorted by external id are walked in place,
+    otherwise, a permutation of the document indexes is computed once (stable: duplicates keep file order).
+    """
+    
+    def __init__(self, cols):
+        self.documents = cols.documents
+        self.order = None if _is_sorted(self.documents) else np.argsort(self.documents, kind="stable")
+        self.i = 0
+        self._load()
+    
+    def _load(self):
+        if self.i < self.documents.shape[0]:
+            self.pos = self.i if self.order is None else int(self.order[self.i])
+            self.docid = str(self.documents[self.pos])
+        else:
+            self.pos, self.docid = None, None
+    
+    def advance(self):
+        """
+        move to the next external id, returns: the number of skipped duplicates of the current one
+        """
+        docid = self.docid
+        n_skipped = -1
+        while not self.docid is None and self.docid == docid:
+            self.i += 1
+            n_skipped += 1
+            self._load()
+        return n_skipped
+
+
+class RcDiff(object):
+    """
+    Streaming diff of two ColumnarRC objects a (old) and b (new).
+    
+    Iterate over the object to get one DocumentDiff per document (sorted by external id),
+    afterwards, summary() and top_concepts() report corpus-wide figures.
+    """
+    
+    def __init__(self, cols_a, cols_b):
+        self.a = cols_a
+        self.b = cols_b
+        ## common concept space: sorted union of both concept dictionaries,
+        # the concept indexes of each document are mapped when it is compared
+        self.concepts = np.union1d(cols_a.concepts, cols_b.concepts)
+        self._map_a = np.searchsorted(self.concepts, cols_a.concepts).astype(np.int32)
+        self._map_b = np.searchsorted(self.concepts, cols_b.concepts).astype(np.int32)
+        self.n_added = np.zeros(self.concepts.shape[0], dtype=np.int64)
+        self.n_removed = np.zeros(self.concepts.shape[0], dtype=np.int64)
+        self.counts = {ONLY_A: 0, ONLY_B: 0, BOTH: 0}
+        self.n_duplicates = {ONLY_A: 0, ONLY_B: 0}
+        self.n_identical = 0
+        self.sum_jaccard = 0.0
+        self.sum_abs_delta = 0.0
+        self.n_deltas = 0
+    
+    def _subjects(self, cols, concept_map, i):
+        lo, hi = cols.indptr[i], cols.indptr[i + 1]
+        return dict(zip(concept_map[cols.concept_idx[lo:hi]].tolist(), cols.scores[lo:hi].tolist()))
+    
+    def _diff(self, external_id, subj_a, subj_b):
+        if subj_a is None:
+            status = ONLY_B
+            subj_a = dict()
+        elif subj_b is None:
+            status = ONLY_A
+            subj_b = dict()
+        else:
+            status = BOTH
+        keys_a, keys_b = set(subj_a), set(subj_b)
+        common = keys_a & keys_b
+        union = keys_a | keys_b
+        added = sorted(keys_b - keys_a)
+        removed = sorted(keys_a - keys_b)
+        deltas = [(c, subj_b[c] - subj_a[c]) for c in sorted(common) if subj_b[c] != subj_a[c]]
+        jaccard = len(common) / len(union) if union else 1.0
+        self.counts[status] += 1
+        if status == BOTH:
+            self.n_added[added] += 1
+            self.n_removed[removed] += 1
+            self.sum_jaccard += jaccard
+            self.sum_abs_delta += sum(abs(d) for _, d in deltas)
+            self.n_deltas += len(common)
+            if not added and not removed and not deltas:
+                self.n_identical += 1
+        cid = lambda c: str(self.concepts[c])
+        return DocumentDiff(external_id, status, len(keys_a), len(keys_b), jaccard,
+                            [cid(c) for c in added], [cid(c) for c in removed],
+                            [(cid(c), d) for c, d in deltas])
+    
+    def __iter__(self):
+        cur_a = _Cursor(self.a)
+        cur_b = _Cursor(self.b)
+        while not cur_a.docid is None or not cur_b.docid is None:
+            doc_a, doc_b = cur_a.docid, cur_b.docid
+            if doc_b is None or (not doc_a is None and doc_a < doc_b):
+                yield self._diff(doc_a, self._subjects(self.a, self._map_a, cur_a.pos), None)
+                self.n_duplicates[ONLY_A] += cur_a.advance()
+            elif doc_a is None or doc_b < doc_a:
+                yield self._diff(doc_b, None, self._subjects(self.b, self._map_b, cur_b.pos))
+                self.n_duplicates[ONLY_B] += cur_b.advance()
+            else:
+                yield self._diff(doc_a, self._subjects(self.a, self._map_a, cur_a.pos),
+                                 self._subjects(self.b, self._map_b, cur_b.pos))
+                self.n_duplicates[ONLY_A] += cur_a.advance()
+                self.n_duplicates[ONLY_B] += cur_b.advance()
+    
+    def summary(self):
+        n_both = self.counts[BOTH]
+        return {
+            "n_documents_a": self.counts[ONLY_A] + n_both,
+            "n_documents_b": self.counts[ONLY_B] + n_both,
+            "n_overlap": n_both,
+            "n_only_a": self.counts[ONLY_A],
+            "n_only_b": self.counts[ONLY_B],
+            "n_identical": self.n_identical,
+            "mean_jaccard": self.sum_jaccard / n_both if n_both > 0 else None,
+            "mean_abs_score_delta": self.sum_abs_delta / self.n_deltas if self.n_deltas > 0 else None,
+            "n_duplicates_a": self.n_duplicates[ONLY_A],
+            "n_duplicates_b": self.n_duplicates[ONLY_B],
+        }
+    
+    def top_concepts(self, k=20):
+        """
+        the k most-changed concepts of documents that are part of both RCs,
+        returns a LIST of dicts with keys concept, added, removed
+        """
+        changes = self.n_added + self.n_removed
+        top = np.argsort(-changes, kind="stable")[:k]
+        return [{"concept": str(self.concepts[c]), "added": int(self.n_added[c]), "removed": int(self.n_removed[c])}
+                for c in top if changes[c] > 0]
@@ -0,0 +1,616 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+File-level access to release candidate data.
+
+Release candidates are tab-separated files with millions of lines,
+thus, they are accompanied by a sidecar index (docid -> byte offset, length)
+that allows random access to single records without reading the whole file,
+and by a memory-mappable columnar store (NumPy arrays) for vectorized analyses.
+
+Files may be compressed (.gz, .bz2, .xz, .zst), they are decompressed as a stream,
+byte offsets then refer to the decompressed content.
+"""
+__author__ = "Martin Toepfer"
+
+import os
+import shutil
+import logging
+import tempfile
+import itertools
+import collections
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import gzip
+import bz2
+import lzma
+import io
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_SUFFIX = ".idx"
+
+## cell format: "concept id:score" or "concept id" (score 1.0)
+parse_cell = lambda cell: (cell if ':' in cell else cell + ':1.0').split(':') 
+
+def parse_line(ln, ctmplt):
+    """
+    parse one line of a release candidate file,
+    returns a statement {"external_id": docid, "subjects": {concept uri: score}}
+    """
+    _cells = ln.strip().split("\t")
+    docid = _cells[0]
+    crefs = dict((ctmplt.format(cid=cid), float(score)) for cid, score in map(parse_cell, _cells[1:]))
+    return {"external_id": docid, "subjects": crefs}
+
+class CompactRecord(object):
+    """
+    Compact alternative to the statement dictionaries of parse_line:
+    
+    external_id: document id
+    concepts: tuple of the raw concept ids (concept_template not applied)
+    scores: array('f') of the scores
+    
+    Concept URIs are only formatted on demand, see uris/subjects.
+    """
+    __slots__ = ("external_id", "concepts", "scores")
+    
+    def __init__(self, external_id, concepts, scores):
+        self.external_id = external_id
+        self.concepts = concepts
+        self.scores = scores
+    
+    def __len__(self):
+        return len(self.concepts)
+    
+    def uris(self, ctmplt):
+        return [ctmplt.format(cid=cid) for cid in self.concepts]
+    
+    def subjects(self, ctmplt):
+        """
+        returns: dictionary, concept uri => score, like parse_line
+        """
+        return dict(zip(self.uris(ctmplt), self.scores))
+    
+    def to_statement(self, ctmplt):
+        return {"external_id": self.external_id, "subjects": self.subjects(ctmplt)}
+    
+    def __repr__(self):
+        return "CompactRecord(%r, %r, %r)" % (self.external_id, self.concepts, list(self.scores))
+
+def parse_record(ln):
+    """
+    parse one line of a release candidate file into a CompactRecord,
+    returns None for blank lines.
+    
+    Duplicate concepts of a line resolve like in parse_line (last score wins, first position).
+    """
+    _cells = ln.strip().split("\t")
+    if not _cells[0]:
+        return None
+    concepts = list()
+    scores = array('f')
+    for cell in _cells[1:]:
+        cid, sep, score = cell.partition(':')
+        if sep and ':' in score:
+            raise ValueError("malformed cell: %s" % (cell,))
+        concepts.append(cid)
+        scores.append(float(score) if sep else 1.0)
+    if len(set(concepts)) < len(concepts):
+        subjects = dict(zip(concepts, scores))
+        concepts, scores = list(subjects), array('f', subjects.values())
+    return CompactRecord(_cells[0], tuple(concepts), scores)
+
+def iter_compact_records(path, start=0, end=None):
+    """
+    yield CompactRecords of the lines of the file at path that start in [start, end)
+    """
+    for ln in iter_range_lines(path, start, end):
+        record = parse_record(ln)
+        if not record is None:
+            yield record
+
+def filter_statements(statements, min_score=None, top_k=None):
+    """
+    keep only the subjects with score >= min_score, and at most the top_k best scored ones,
+    of each statement (see parse_line); a LIST of statements is filtered in one vectorized pass.
+    
+    Ties are broken by the order of the subjects in the line.
+    returns: LIST of statements
+    """
+    if min_score is None and top_k is None:
+        return statements
+    lengths = np.fromiter((len(stmt["subjects"]) for stmt in statements), dtype=np.int64, count=len(statements))
+    scores = np.fromiter((score for stmt in statements for score in stmt["subjects"].values()), 
+                         dtype=np.float64, count=int(lengths.sum()))
+    keep = np.ones(scores.shape[0], dtype=bool)
+    if not min_score is None:
+        keep &= scores >= min_score
+    if not top_k is None:
+        doc_idx = np.repeat(np.arange(len(statements)), lengths)
+        order = np.lexsort((-scores, doc_idx)) # stable: by document, best score first
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0]) - starts[doc_idx[order]]
+        keep &= rank < top_k
+    filtered = list()
+    pos = 0
+    for stmt, n in zip(statements, lengths):
+        subjects = dict(item for item, kept in zip(stmt["subjects"].items(), keep[pos:pos + n]) if kept)
+        filtered.append({"external_id": stmt["external_id"], "subjects": subjects})
+        pos += n
+    return filtered
+
+#----# (COMPRESSED) FILE ACCESS #----#
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+
+def is_compressed(path):
+    return path.lower().endswith(COMPRESSED_SUFFIXES)
+
+def _open_zstd(path):
+    if zstandard is None:
+        raise ImportError("reading .zst files requires the zstandard package")
+    reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return io.BufferedReader(reader)
+
+def open_binary(path):
+    """
+    open the release candidate file at path for binary reading,
+    compressed files are decompressed transparently.
+    
+    Compressed streams only seek forward efficiently, thus, access them in file order.
+    """
+    lpath = path.lower()
+    if lpath.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    elif lpath.endswith(".bz2"):
+        return bz2.open(path, 'rb')
+    elif lpath.endswith(".xz"):
+        return lzma.open(path, 'rb')
+    elif lpath.endswith(".zst"):
+        return _open_zstd(path)
+    return open(path, 'rb')
+
+def open_text(path):
+    """
+    like open_binary, but returns a text stream (utf-8).
+    """
+    return io.TextIOWrapper(open_binary(path), encoding='utf-8')
+
+#----# SIDECAR INDEX #----#
+
+## cache of loaded indexes, path => (mtime, RecordIndex)
+_INDEX_CACHE = dict()
+
+
+class RecordIndex(object):
+    """
+    In-memory representation of a sidecar index.
+    
+    docids: LIST of all document ids in file order (may contain duplicates)
+    offsets: dictionary, docid => (offset, length) of the FIRST record of docid
+    """
+    
+    def __init__(self, entries):
+        self.docids = list()
+        self.offsets = dict()
+        for docid, offset, length in entries:
+            self.docids.append(docid)
+            if not docid in self.offsets:
+                self.offsets[docid] = (offset, length)
+    
+    def __len__(self):
+        return len(self.docids)
+    
+    def __contains__(self, docid):
+        return docid in self.offsets
+
+
+def chunked(iterable, size):
+    """
+    lazily split iterable into lists of at most size elements.
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+def scan_entries(path):
+    """
+    scan the release candidate file once,
+    yield (docid, offset, length) for every non-empty line.
+    """
+    with open_binary(path) as fin:
+        offset = 0
+        for ln in fin:
+            docid = ln.split(b'\t', 1)[0].strip()
+            if docid:
+                yield docid.decode('utf-8'), offset, len(ln)
+            offset += len(ln)
+
+def build_index(path):
+    """
+    write the sidecar index of the release candidate file at path.
+    
+    returns the path of the index file.
+    """
+    idx_path = index_path(path)
+    tmp_path = idx_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as fout:
+        for docid, offset, length in scan_entries(path):
+            fout.write("%s\t%d\t%d\n" % (docid, offset, length))
+    os.replace(tmp_path, idx_path) # never expose half-written indexes
+    _INDEX_CACHE.pop(idx_path, None)
+    return idx_path
+
+def _read_index(idx_path):
+    with open(idx_path, 'r', encoding='utf-8') as fin:
+        for ln in fin:
+            docid, offset, length = ln.rstrip('\n').split('\t')
+            yield docid, int(offset), int(length)
+
+def load_index(path):
+    """
+    return the RecordIndex of the release candidate file at path.
+    
+    The sidecar index is (re-)built when it is missing or older than the file.
+    If it cannot be written (e.g., read-only storage), the index is only kept in memory.
+    """
+    idx_path = index_path(path)
+    try:
+        if not os.path.exists(idx_path) or os.path.getmtime(idx_path) < os.path.getmtime(path):
+            build_index(path)
+    except OSError as err:
+        logging.warning("could not write index for %s: %s" % (path, str(err)))
+        return RecordIndex(scan_entries(path))
+    mtime = os.path.getmtime(idx_path)
+    cached = _INDEX_CACHE.get(idx_path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, RecordIndex(_read_index(idx_path)))
+        _INDEX_CACHE[idx_path] = cached
+    return cached[1]
+
+def read_lines(path, index, docids):
+    """
+    random access: yield (docid, line) for all docids that are part of the index,
+    in file order.
+    """
+    positions = sorted(index.offsets[docid] for docid in set(docids) if docid in index)
+    compressed = is_compressed(path)
+    with open_binary(path) as fin:
+        pos = 0
+        for offset, length in positions:
+            if compressed:
+                _skip(fin, offset - pos)
+            else:
+                fin.seek(offset)
+            ln = fin.read(length).decode('utf-8')
+            pos = offset + length
+            yield ln.split('\t', 1)[0].strip(), ln
+
+def _skip(fin, n, bufsize=1 << 20):
+    """
+    move forward by n bytes in a stream that may not be seekable
+    """
+    while n > 0:
+        n_read = len(fin.read(min(n, bufsize)))
+        if n_read == 0:
+            break
+        n -= n_read
+
+
+#----# COLUMNAR STORE #----#
+
+COLUMNS_SUFFIX = ".cols"
+
+class ColumnarRC(object):
+    """
+    Memory-mapped columnar representation of a release candidate:
+    
+    documents: document dictionary, document index => external id
+    concepts: concept dictionary, concept index => concept id (without concept_template)
+    indptr: int64, assignments of the i-th document are in [indptr[i], indptr[i+1])
+    doc_idx: int32, document index for each assignment
+    concept_idx: int32, concept index for each assignment
+    scores: float32 (or float16), score for each assignment
+    """
+    _ARRAYS = ("documents", "concepts", "indptr", "doc_idx", "concept_idx", "scores")
+    
+    def __init__(self, cols_path, mmap_mode='r'):
+        for name in ColumnarRC._ARRAYS:
+            setattr(self, name, np.load(os.path.join(cols_path, name + ".npy"), mmap_mode=mmap_mode))
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        in-memory ColumnarRC, arrays: {array name: array}
+        """
+        cols = cls.__new__(cls)
+        for name in ColumnarRC._ARRAYS:
+            setattr(cols, name, arrays[name])
+        return cols
+    
+    @property
+    def n_documents(self):
+        return self.documents.shape[0]
+    
+    @property
+    def n_assignments(self):
+        return self.concept_idx.shape[0]
+    
+    def subjects_per_document(self):
+        return np.diff(self.indptr)
+    
+    def concept_counts(self):
+        """
+        returns: number of assignments per concept index
+        """
+        return np.bincount(self.concept_idx, minlength=self.concepts.shape[0])
+
+def columns_path(path):
+    return path + COLUMNS_SUFFIX
+
+def _parse_columns(path, start, end):
+    """
+    parse the lines in [start, end) of the file into columns with a LOCAL concept dictionary,
+    returns (docids, concept ids, indptr, concept_idx, scores)
+    """
+    docids = list()
+    concept_ids = dict() # concept id => concept index
+    indptr = array('q', [0])
+    concept_idx = array('i')
+    scores = array('f')
+    for record in iter_compact_records(path, start, end):
+        docids.append(record.external_id)
+        concept_idx.extend(concept_ids.setdefault(cid, len(concept_ids)) for cid in record.concepts)
+        scores.extend(record.scores)
+        indptr.append(len(concept_idx))
+    return (docids, list(concept_ids), np.frombuffer(indptr, dtype=np.int64),
+            np.frombuffer(concept_idx, dtype=np.int32), np.frombuffer(scores, dtype=np.float32))
+
+def _column_arrays(path, score_dtype=np.float32, workers=None, range_bytes=None):
+    """
+    parse the release candidate file at path once into the arrays of a ColumnarRC,
+    large files are parsed by several processes, see map_ranges.
+    
+    returns: {array name: array}
+    """
+    docids = list()
+    concept_ids = dict() # concept id => GLOBAL concept index
+    indptrs, concept_idxs, scores = [np.zeros(1, dtype=np.int64)], list(), list()
+    parts = map_ranges(path, _parse_columns, workers=workers, range_bytes=range_bytes or RANGE_BYTES)
+    for part_docids, part_concepts, part_indptr, part_cidx, part_scores in parts:
+        remap = np.array([concept_ids.setdefault(cid, len(concept_ids)) for cid in part_concepts], dtype=np.int32)
+        docids += part_docids
+        indptrs.append(part_indptr[1:] + indptrs[-1][-1])
+        concept_idxs.append(remap[part_cidx] if remap.size > 0 else part_cidx)
+        scores.append(part_scores)
+    indptr = np.concatenate(indptrs)
+    return {
+        "documents": np.array(docids, dtype=str),
+        "concepts": np.array(list(concept_ids), dtype=str),
+        "indptr": indptr,
+        "doc_idx": np.repeat(np.arange(len(docids), dtype=np.int32), np.diff(indptr)),
+        "concept_idx": np.concatenate(concept_idxs) if concept_idxs else np.zeros(0, dtype=np.int32),
+        "scores": (np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)).astype(score_dtype),
+    }
+
+def _write_columns(arrays, cols_path):
+    """
+    write the arrays into a private temporary directory next to cols_path, then swap it in,
+    concurrent builds never see each other's half-written files.
+    """
+    parent, name = os.path.split(cols_path)
+    tmp_path = tempfile.mkdtemp(prefix=name + ".", suffix=".tmp", dir=parent)
+    old_path = None
+    try:
+        os.chmod(tmp_path, 0o755) # mkdtemp is private to the user
+        for arr_name, arr in arrays.items():
+            np.save(os.path.join(tmp_path, arr_name + ".npy"), arr)
+        if os.path.exists(cols_path):
+            ## a directory cannot replace a non-empty one, move the old store aside first
+            old_path = tempfile.mkdtemp(prefix=name + ".", suffix=".old", dir=parent)
+            os.replace(cols_path, os.path.join(old_path, name))
+        try:
+            os.replace(tmp_path, cols_path)
+        except OSError:
+            ## another build has won the race, its store is as good as ours
+            if not os.path.isdir(cols_path):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not old_path is None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+def build_columns(path, score_dtype=np.float32, workers=None, range_bytes=None):
+    """
+    parse the release candidate file at path once and write its columnar store,
+    large files are parsed by several processes, see map_ranges.
+    
+    returns the path of the store (a directory of .npy files).
+    """
+    cols_path = columns_path(path)
+    _write_columns(_column_arrays(path, score_dtype, workers, range_bytes), cols_path)
+    return cols_path
+
+def load_columns(path):
+    """
+    return the memory-mapped ColumnarRC of the release candidate file at path,
+    the store is (re-)built when it is missing or older than the file.
+    If it cannot be written (e.g., read-only storage), the columns are only kept in memory.
+    """
+    cols_path = columns_path(path)
+    if not os.path.exists(cols_path) or os.path.getmtime(cols_path) < os.path.getmtime(path):
+        arrays = _column_arrays(path)
+        try:
+            _write_columns(arrays, cols_path)
+        except OSError as err:
+            logging.warning("could not write columns for %s: %s" % (path, str(err)))
+            return ColumnarRC.from_arrays(arrays)
+    return ColumnarRC(cols_path)
+
+
+#----# PARALLEL PARSING #----#
+
+## size of the byte ranges that are parsed by one worker process
+RANGE_BYTES = 1 << 24
+
+def split_ranges(path, range_bytes=RANGE_BYTES, start=0):
+    """
+    split the file at path, from byte start on, into byte ranges [start, end) of about range_bytes,
+    aligned to line starts (start has to be a line start as well).
+    
+    Compressed files cannot be split, they form a single range [start, None).
+    """
+    if is_compressed(path):
+        return [(start, None)]
+    size = os.path.getsize(path)
+    ranges = list()
+    with open(path, 'rb') as fin:
+        while start < size:
+            fin.seek(min(start + range_bytes, size))
+            fin.readline() # move to the start of the next line
+            end = min(fin.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def iter_range_offsets(path, start, end):
+    """
+    yield (offset, line) for the decoded lines of the file at path that start in [start, end),
+    offset = position right after the line, i.e. the start of the next line;
+    end = None: up to the end of the file
+    
+    Offsets of compressed files refer to the decompressed stream.
+    """
+    with open_binary(path) as fin:
+        if start > 0:
+            if is_compressed(path):
+                _skip(fin, start)
+            else:
+                fin.seek(start)
+        pos = start
+        while end is None or pos < end:
+            ln = fin.readline()
+            if not ln:
+                break
+            pos += len(ln)
+            yield pos, ln.decode('utf-8')
+
+def iter_range_lines(path, start, end):
+    """
+    yield decoded lines of the file at path that start in [start, end),
+    end = None: up to the end of the file
+    """
+    for _, ln in iter_range_offsets(path, start, end):
+        yield ln
+
+def parse_range(path, start, end, ctmplt):
+    """
+    returns a LIST of statements (see parse_line) of the lines in [start, end)
+    """
+    return [parse_line(ln, ctmplt) for ln in iter_range_lines(path, start, end) if ln.strip()]
+
+def parse_range_offsets(path, start, end, ctmplt):
+    """
+    like parse_range, but returns (number of lines in [start, end), LIST of (offset, line number, statement)),
+    offsets see iter_range_offsets, line numbers count the lines of the range from 1 (empty lines included)
+    """
+    records = list()
+    n_lines = 0
+    for pos, ln in iter_range_offsets(path, start, end):
+        n_lines += 1
+        if ln.strip():
+            records.append((pos, n_lines, parse_line(ln, ctmplt)))
+    return n_lines, records
+
+def count_lines(path, end):
+    """
+    returns: the number of lines of the file at path before offset end (a line start)
+    """
+    n_lines = 0
+    with open_binary(path) as fin:
+        while end > 0:
+            block = fin.read(min(end, 1 << 20))
+            if not block:
+                break
+            n_lines += block.count(b"\n")
+            end -= len(block)
+    return n_lines
+
+def map_ranges(path, func, args=(), workers=None, ordered=True, range_bytes=RANGE_BYTES, start=0):
+    """
+    apply func(path, start, end, *args) to line-aligned byte ranges of the file at path,
+    and yield the results, in file order if ordered, else as soon as they are available.
+    
+    func has to be a module level function (pickled for the worker processes).
+    workers: number of processes, defaults to the number of CPUs;
+             with a single range or worker, func is applied in this process.
+             Daemonic processes (e.g. django-q workers) cannot have children, 
+             they always apply func themselves.
+    start: skip the file content before this (line start) offset
+    """
+    ranges = split_ranges(path, range_bytes, start)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if multiprocessing.current_process().daemon:
+        workers = 1
+    if workers < 2 or len(ranges) < 2:
+        for start, end in ranges:
+            yield func(path, start, end, *args)
+        return
+    ## bound the number of pending results to keep memory flat
+    max_pending = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for start, end in ranges:
+            pending.append(executor.submit(func, path, start, end, *args))
+            if len(pending) >= max_pending:
+                yield from _pop_results(pending, ordered)
+        while pending:
+            yield from _pop_results(pending, ordered)
+
+def _pop_results(pending, ordered):
+    if ordered:
+        yield pending.popleft().result()
+    else:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            yield future.result()
+
+def iter_statements_parallel(path, ctmplt, workers=None, ordered=True, range_bytes=RANGE_BYTES):
+    """
+    parse the file at path with several processes, yield statements (see parse_line).
+    """
+    for statements in map_ranges(path, parse_range, (ctmplt,), workers=workers, ordered=ordered, range_bytes=range_bytes):
+        yield from statements
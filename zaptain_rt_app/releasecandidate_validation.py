@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Validation of release candidate files in one streaming pass,
+to find problems before they surface halfway through an import.
+
+Each line is checked for
+- malformed cells (document id, concept id:score),
+- scores outside [0, 1] or beyond the precision of SubjectAssignment.score,
+- duplicate document ids,
+- invalid or unknown concepts, after applying the concept_template.
+"""
+__author__ = "Martin Toepfer"
+
+from collections import namedtuple, Counter
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+
+from . import releasecandidate_storage as rcstorage
+
+## kinds of issues
+MALFORMED = "malformed"
+SCORE_RANGE = "score_range"
+SCORE_PRECISION = "score_precision"
+DUPLICATE_DOCUMENT = "duplicate_document"
+INVALID_CONCEPT = "invalid_concept"
+UNKNOWN_CONCEPT = "unknown_concept"
+
+ISSUE_KINDS = (MALFORMED, SCORE_RANGE, SCORE_PRECISION, DUPLICATE_DOCUMENT, INVALID_CONCEPT, UNKNOWN_CONCEPT)
+
+## precision of SubjectAssignment.score: DecimalField(max_digits=3, decimal_places=2)
+SCORE_QUANTUM = Decimal("0.01")
+## see Concept.uri
+MAX_URI_LENGTH = 300
+
+Issue = namedtuple("Issue", ["line", "kind", "message"])
+Issue.__doc__ = """
+line: line number (starting at 1)
+"""
+
+
+class RcValidator(object):
+    """
+    Streaming validator, feed it lines via check_line or validate, 
+    then counts holds the number of issues per kind.
+    
+    concept_template: str.format template with the concept id as cid, 
+                      without template all concepts are reported as invalid
+    known_concepts: collection of valid concept URIs, None: accept all well-formed URIs
+    """
+    
+    def __init__(self, concept_template, known_concepts=None):
+        self.ctmplt = concept_template
+        self.known_concepts = known_concepts
+        self.counts = Counter()
+        self.n_lines = 0
+        self._docids = dict() # docid => first line number
+        self._concepts = dict() # concept id => (kind of issue or None, uri)
+        self._is_url = URLValidator(regex=r"^http[s]?:\S+\Z")
+    
+    def validate(self, lines):
+        """
+        yield the issues of all lines (in order)
+        """
+        for lni, ln in enumerate(lines, 1):
+            yield from self.check_line(lni, ln)
+    
+    def check_line(self, lni, ln):
+        """
+        returns: LIST of issues of line number lni
+        """
+        self.n_lines = lni
+        issues = list()
+        ln = ln.strip()
+        if not ln:
+            return issues
+        cells = ln.split("\t")
+        docid = cells[0].strip()
+        if not docid:
+            issues.append(Issue(lni, MALFORMED, "invalid document id '%s'" % (docid,)))
+        elif docid in self._docids:
+            issues.append(Issue(lni, DUPLICATE_DOCUMENT, "document %s already in line %d" % (docid, self._docids[docid])))
+        else:
+            self._docids[docid] = lni
+        for cell in cells[1:]:
+            issue = self._check_cell(cell)
+            if not issue is None:
+                issues.append(Issue(lni, issue[0], issue[1]))
+        self.counts.update(issue.kind for issue in issues)
+        return issues
+    
+    def _check_cell(self, cell):
+        parts = cell.split(":")
+        if len(parts) > 2 or not parts[0].strip():
+            return MALFORMED, "malformed cell '%s', expected concept id:score" % (cell,)
+        cid = parts[0].strip()
+        if len(parts) == 2:
+            try:
+                score = Decimal(parts[1].strip())
+            except InvalidOperation:
+                return MALFORMED, "malformed score in cell '%s'" % (cell,)
+            if not score.is_finite() or score < 0 or score > 1:
+                return SCORE_RANGE, "score of %s outside [0, 1]: %s" % (cid, parts[1])
+            if score != score.quantize(SCORE_QUANTUM):
+                return SCORE_PRECISION, "score of %s has more than 2 decimal places: %s" % (cid, parts[1])
+        kind, uri = self._check_concept(cid)
+        if kind == INVALID_CONCEPT and not self.ctmplt:
+            return kind, "no concept_template to build the URI of %s" % (cid,)
+        elif kind == INVALID_CONCEPT:
+            return kind, "invalid concept URI %s" % (uri,)
+        elif kind == UNKNOWN_CONCEPT:
+            return kind, "unknown concept %s" % (uri,)
+        return None
+    
+    def _check_concept(self, cid):
+        ## each concept is checked once
+        if not cid in self._concepts:
+            kind = None
+            try:
+                if not self.ctmplt:
+                    raise ValueError("no concept_template")
+                uri = self.ctmplt.format(cid=cid)
+            except (KeyError, IndexError, ValueError):
+                uri = cid
+                kind = INVALID_CONCEPT
+            if kind is None:
+                try:
+                    if len(uri) > MAX_URI_LENGTH:
+                        raise ValidationError("too long")
+                    self._is_url(uri)
+                except ValidationError:
+                    kind = INVALID_CONCEPT
+            if kind is None and not self.known_concepts is None and not uri in self.known_concepts:
+                kind = UNKNOWN_CONCEPT
+            self._concepts[cid] = (kind, uri)
+        return self._concepts[cid]
+    
+    def summary(self):
+        return dict((kind, self.counts[kind]) for kind in ISSUE_KINDS)
+
+
+def validate_file(path, concept_template, known_concepts=None, max_issues=100):
+    """
+    validate the (optionally compressed) release candidate file at path,
+    returns: (validator, LIST of the first max_issues issues), max_issues = None: all
+    """
+    validator = RcValidator(concept_template, known_concepts)
+    issues = list()
+    with rcstorage.open_text(path) as fin:
+        for issue in validator.validate(fin):
+            if max_issues is None or len(issues) < max_issues:
+                issues.append(issue)
+    return validator, issues
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Single-pass random sampling with bounded memory.
+
+All functions draw from a random.Random instance,
+thus, samples are reproducible when the generator is seeded.
+"""
+__author__ = "Martin Toepfer"
+
+import random
+
+
+def new_seed():
+    """
+    return a fresh seed, it should be recorded to reproduce a sample later.
+    """
+    return random.SystemRandom().randrange(2**32)
+
+
+class Reservoir(object):
+    """
+    Uniform reservoir sample (algorithm R) of at most k items from a stream of unknown length.
+    """
+    
+    def __init__(self, k, rng):
+        self.k = k
+        self.rng = rng
+        self.items = list()
+        self.n_seen = 0
+    
+    def add(self, item):
+        self.n_seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+        else:
+            j = self.rng.randrange(self.n_seen)
+            if j < self.k:
+                self.items[j] = item
+
+
+def reservoir_sample(items, k, rng):
+    """
+    returns a LIST of k items (or less, if the stream is shorter) in random order.
+    """
+    res = Reservoir(k, rng)
+    for item in items:
+        res.add(item)
+    rng.shuffle(res.items)
+    return res.items
+
+def _allocate(sizes, k):
+    """
+    distribute k proportionally to the stratum sizes (largest remainder method),
+    
+    sizes: LIST of (key, size)
+    returns a dictionary, key => quota
+    """
+    total = sum(size for _, size in sizes)
+    if total == 0:
+        return dict()
+    k = min(k, total)
+    exact = [(key, k * size / total) for key, size in sizes]
+    quotas = dict((key, int(q)) for key, q in exact)
+    rest = k - sum(quotas.values())
+    for key, q in sorted(exact, key=lambda e: int(e[1]) - e[1])[:rest]:
+        quotas[key] += 1
+    return quotas
+
+def stratified_sample(keyed_items, k, rng):
+    """
+    Proportionally stratified sample of k items,
+    keyed_items: stream of (stratum key, item) tuples.
+    
+    Memory is bounded by k items per stratum.
+    
+    returns a LIST of items in random order.
+    """
+    reservoirs = dict()
+    for key, item in keyed_items:
+        res = reservoirs.get(key)
+        if res is None:
+            res = reservoirs[key] = Reservoir(k, rng)
+        res.add(item)
+    ## sort by repr: stable order for mixed key types (None, bool, str)
+    keys = sorted(reservoirs, key=repr)
+    quotas = _allocate([(key, reservoirs[key].n_seen) for key in keys], k)
+    sample = list()
+    for key in keys:
+        sample += rng.sample(reservoirs[key].items, quotas.get(key, 0))
+    rng.shuffle(sample)
+    return sample
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Background tasks, executed by django-q workers (see: django_q.tasks.async_task).
+
+Tasks receive primary keys rather than model instances,
+so that they always operate on the current state of the db.
+"""
+__author__ = "Martin Toepfer"
+
+from . import pipeline
+
+
+def run_pipeline_chunk(rc_name, run, stage, chunk_no):
+    """
+    one chunk of a stage of the release candidate pipeline, see pipeline.run_chunk.
+    """
+    pipeline.run_chunk(rc_name, run, stage, chunk_no)
@@ -23,27 +23,56 @@ __author__ = "Martin Toepfer"
 
 import logging
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.test import override_settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.module_loading import import_string
 
 from django.utils import timezone as tz
 from django.core.exceptions import ObjectDoesNotExist
 
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 from collections import OrderedDict
 import pandas as pd
+import numpy as np
+import requests
 import json
 
 from .models import RtConfig, Document, Collection, ReleaseCandidate
-from .models import ReviewerWrapper, Review, Guideline
-from .models import SubjectAssignment, SubjectIndexer
+from .models import ReviewerWrapper, Review, Guideline, SubjectLevelReview
+from .models import SubjectAssignment, SubjectIndexer, ReleaseCandidateStatistics, Concept, ImportCheckpoint
+from .models import PIPELINE_STAGES, STAGE_VALIDATE, STAGE_INDEX, STAGE_STUBS, STAGE_METADATA
+from .models import STATUS_PENDING, STATUS_DONE, STATUS_FAILED
 from .online_configuration import CK_MAIN_AI
 from .online_configuration import CK_CATALOG_API_PATTERN, CK_DOCUMENT_WEBLINK_PATTERN, CK_SUPPORT_EMAIL
 from .online_configuration import CK_THES_DESCRIPTOR_TYPE, CK_THES_CATEGORY_TYPE, CK_THES_SPARQL_ENDPOINT
-from .thesaurus_connection import ThesaurusApi
+from .thesaurus_connection import ThesaurusApi, ConceptCache, Q_TOP_CATEGORIES
+from . import releasecandidate_storage as rcstorage
+from .releasecandidate_diff import RcDiff
+from . import releasecandidate_validation as rcvalidation
+from . import bulk_loader
+from . import pipeline
+from . import thesaurus_store
+from .exceptions import InvalidReleaseCandidateException
 
 import os
+import re
+import shutil
+import gzip
+import bz2
+import lzma
+import tempfile
+from io import StringIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import multiprocessing
+from decimal import Decimal
+from unittest.mock import patch
 
 # see:
 # https://docs.djangoproject.com/en/2.0/intro/tutorial05/
@@ -115,10 +144,11 @@ class TestContentManager(object):
     
     def clear(self):
         # clear the top level objects
-        for clz in [RtConfig, Guideline, Collection, Document, Review, SubjectIndexer]:
+        for clz in [RtConfig, Guideline, Collection, Document, Review, SubjectIndexer, Concept]:
             clz.objects.all().delete()
+        Concept.clear_cache()
     
-    def populate_db(self):
+    def populate_db(self, rc_file=os.path.join(DIR_TESTDATA, 'rc1.tsv')):
         logging.warning("RESET THE USER ACCOUNTS BEFORE LEAVING THE DEBUG MODE")
         try:
             user_x = User.objects.get(username='aaa')
@@ -215,7 +245,7 @@ class TestContentManager(object):
         rc1 = ReleaseCandidate.objects.create(name="RC1",
                                               pub_date=tz.now(),
                                               indexer=ai_main,
-                                              file=os.path.join(DIR_TESTDATA, 'rc1.tsv'),
+                                              file=rc_file,
                                               concept_template=_tmplt_c
                                               )
         rc1.save()
@@ -258,10 +288,18 @@ class CollectionIterationTests(TestCase):
 
 class SamplingTests(TestCase):
     
-    @override_settings(MEDIA_ROOT=DIR_TESTDATA)
+    def setUp(self):
+        ## the sidecar files of rc1.tsv are written next to it, keep them out of the source tree
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        shutil.copy(os.path.join(DIR_TESTDATA, "rc1.tsv"), self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+    
     def test_sample(self):
         tcm = TestContentManager()
-        tcm.populate_db()
+        tcm.populate_db(rc_file="rc1.tsv")
         #
         # TODO test sample releasecandidate
         rc1 = ReleaseCandidate.objects.get(name='RC1')
@@ -282,8 +320,826 @@ class SamplingTests(TestCase):
         white_jrlabstract = set(jrl.narrower.filter(has_abstract=True).values_list("external_id", flat=True))
         jrlabstractsz_expected = 1
         self.assertEqual(rc1.sample(9, white_jrlabstract).shape[0], jrlabstractsz_expected)
-        
-        
+    
+    def test_sample_seeded(self):
+        tcm = TestContentManager()
+        tcm.clear()
+        tcm.populate_db(rc_file="rc1.tsv")
+        rc1 = ReleaseCandidate.objects.get(name='RC1')
+        docids, seed = rc1.sample_stream(5)
+        self.assertEqual(len(set(docids)), 5)
+        self.assertListEqual(rc1.sample_stream(5, seed=seed)[0], docids)
+        ## stratify by a document attribute; documents without db object form their own stratum
+        docids, seed = rc1.sample_stream(12, stratify_by="has_abstract")
+        self.assertSetEqual(set(docids), set(rc1.get_document_ids()))
+        ## restrict candidates by queryset
+        docids, seed = rc1.sample_stream(9, stratify_by="score_band", queryset=Document.objects.filter(has_abstract=True))
+        self.assertListEqual(docids, ["10011619528"])
+
+
+def _build_columns_daemon(path, queue):
+    ## like a django-q worker: a daemonic process that must not start worker processes
+    cols = rcstorage.ColumnarRC(rcstorage.build_columns(path, workers=2, range_bytes=64))
+    queue.put(cols.documents.tolist())
+
+def _mk_rc(media_root, name="RC1", fname="rc1.tsv"):
+    """
+    copy a test release candidate into media_root and create its db object.
+    """
+    shutil.copy(os.path.join(DIR_TESTDATA, fname), os.path.join(media_root, fname))
+    ai, _ = SubjectIndexer.objects.get_or_create(ai_name="stwai_main")
+    return ReleaseCandidate.objects.create(name=name, pub_date=tz.now(), indexer=ai,
+                                           file=fname, concept_template="http://zbw.eu/stw/descriptor/{cid}")
+
+class ReleaseCandidateIndexTests(TestCase):
+    
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        Concept.clear_cache()
+    
+    def test_index(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            rc.build_index()
+            self.assertTrue(os.path.exists(rc.file.path + ".idx"))
+            expected = [stmt["external_id"] for stmt in rc.iter_statements()]
+            self.assertListEqual(rc.get_document_ids(), expected)
+            self.assertTrue(rc.has_document("10001601438"))
+            self.assertFalse(rc.has_document("99999999999"))
+            rec = rc.get_record("10001601438")
+            self.assertDictEqual(rec["subjects"], {"http://zbw.eu/stw/descriptor/10215-1": 1.0,
+                                                   "http://zbw.eu/stw/descriptor/10011-3": 1.0})
+            self.assertIsNone(rc.get_record("99999999999"))
+    
+    def test_columns(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            cols = rc.get_columns()
+            statements = list(rc.iter_statements())
+            self.assertListEqual(cols.documents.tolist(), [stmt["external_id"] for stmt in statements])
+            self.assertListEqual(cols.subjects_per_document().tolist(), [len(stmt["subjects"]) for stmt in statements])
+            self.assertEqual(cols.n_assignments, cols.concept_counts().sum())
+            ## reconstruct the subjects of the 4th document
+            i = 3
+            concepts = rc.format_concepts(cols.concepts[cols.concept_idx[cols.indptr[i]:cols.indptr[i+1]]])
+            self.assertListEqual(sorted(concepts), sorted(statements[i]["subjects"]))
+            self.assertTrue((cols.doc_idx[cols.indptr[i]:cols.indptr[i+1]] == i).all())
+            ## rebuilding replaces the store and leaves no temporary directories behind
+            rc.build_columns()
+            self.assertListEqual(sorted(os.listdir(self.media_root)), ["rc1.tsv", "rc1.tsv.cols"])
+            ## if the store cannot be written, the columns are kept in memory
+            shutil.rmtree(rc.file.path + ".cols")
+            with patch("tempfile.mkdtemp", side_effect=PermissionError("read-only")):
+                with self.assertLogs(level="WARNING"):
+                    mcols = rcstorage.load_columns(rc.file.path)
+            self.assertListEqual(mcols.documents.tolist(), cols.documents.tolist())
+            self.assertListEqual(mcols.concept_idx.tolist(), cols.concept_idx.tolist())
+            self.assertFalse(os.path.exists(rc.file.path + ".cols"))
+    
+    def test_parallel_parsing(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            statements = list(rc.iter_statements())
+            parallel = list(rcstorage.iter_statements_parallel(rc.file.path, rc.concept_template, workers=2, range_bytes=64))
+            self.assertListEqual(parallel, statements)
+            unordered = rcstorage.iter_statements_parallel(rc.file.path, rc.concept_template, workers=2, ordered=False, range_bytes=64)
+            self.assertEqual(sorted(stmt["external_id"] for stmt in unordered), sorted(stmt["external_id"] for stmt in statements))
+            ## columns built from several ranges equal the sequentially built ones
+            cols = rcstorage.ColumnarRC(rcstorage.build_columns(rc.file.path, workers=1))
+            subjects = [sorted(cols.concepts[cols.concept_idx[i:j]]) for i, j in zip(cols.indptr, cols.indptr[1:])]
+            pcols = rcstorage.ColumnarRC(rcstorage.build_columns(rc.file.path, workers=2, range_bytes=64))
+            psubjects = [sorted(pcols.concepts[pcols.concept_idx[i:j]]) for i, j in zip(pcols.indptr, pcols.indptr[1:])]
+            self.assertListEqual(psubjects, subjects)
+            self.assertListEqual(pcols.documents.tolist(), cols.documents.tolist())
+            ## daemonic processes parse the ranges themselves
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=_build_columns_daemon, args=(rc.file.path, queue), daemon=True)
+            proc.start()
+            self.assertListEqual(queue.get(timeout=60), cols.documents.tolist())
+            proc.join()
+            self.assertEqual(proc.exitcode, 0)
+    
+    def test_diff(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            fn_b = os.path.join(self.media_root, "rc1_b.tsv")
+            with open(fn_b, "w") as fout:
+                fout.write("X1\t10382-3\n10011704735\t11613-5:0.5\t99999-9\n")
+                ## duplicate documents are compared by their first record (like the sidecar index)
+                fout.write("10011704735\t10382-3\n")
+            rcdiff = RcDiff(rc.get_columns(), rcstorage.load_columns(fn_b))
+            docdiffs = list(rcdiff)
+            self.assertListEqual([d.external_id for d in docdiffs], sorted(set(rc.get_document_ids()) | {"X1"}))
+            diffs = dict((d.external_id, d) for d in docdiffs)
+            self.assertEqual(len(diffs), 13)
+            self.assertEqual(rcdiff.summary()["n_duplicates_b"], 1)
+            self.assertEqual(rcdiff.summary()["n_duplicates_a"], 0)
+            d = diffs["10011704735"]
+            self.assertEqual(d.status, "both")
+            self.assertAlmostEqual(d.jaccard, 1/3)
+            self.assertListEqual(d.added, ["99999-9"])
+            self.assertListEqual(d.removed, ["11540-6"])
+            self.assertListEqual(d.score_deltas, [("11613-5", -0.5)])
+            self.assertEqual(diffs["X1"].status, "only_b")
+            self.assertEqual(rcdiff.summary()["n_overlap"], 1)
+            self.assertEqual(len(rcdiff.top_concepts()), 2)
+            ## sorted files are walked in place
+            fn_c = os.path.join(self.media_root, "rc1_c.tsv")
+            with open(fn_c, "w") as fout:
+                fout.write("10011704735\t11613-5:0.5\t99999-9\nX1\t10382-3\n")
+            rcdiff = RcDiff(rcstorage.load_columns(fn_c), rcstorage.load_columns(fn_b))
+            self.assertListEqual([d.status for d in rcdiff], ["both", "both"])
+            self.assertEqual(rcdiff.summary()["n_identical"], 2)
+    
+    def test_compressed(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            with open(rc.file.path, 'rb') as fin:
+                content = fin.read()
+            statements = list(rc.iter_statements())
+            compressors = [(".gz", gzip.compress), (".bz2", bz2.compress), (".xz", lzma.compress)]
+            if rcstorage.zstandard is not None:
+                compressors.append((".zst", rcstorage.zstandard.ZstdCompressor().compress))
+            for suffix, compress in compressors:
+                fname = "rc1.tsv" + suffix
+                with open(os.path.join(self.media_root, fname), 'wb') as fout:
+                    fout.write(compress(content))
+                rcz = ReleaseCandidate.objects.create(name="RC1" + suffix, pub_date=tz.now(), indexer=rc.indexer,
+                                                      file=fname, concept_template=rc.concept_template)
+                self.assertListEqual(list(rcz.iter_statements()), statements)
+                self.assertListEqual(rcz.get_document_ids(), rc.get_document_ids())
+                self.assertDictEqual(rcz.get_record("10001601438"), rc.get_record("10001601438"))
+                self.assertListEqual(list(rcz.iter_statements_parallel(workers=2)), statements)
+                self.assertEqual(rcz.get_columns().n_assignments, rc.get_columns().n_assignments)
+    
+    def test_statistics(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            self.assertIsNone(rc.get_statistics())
+            rc.compute_statistics()
+            stats = ReleaseCandidate.objects.get(name=rc.name).get_statistics()
+            n_subjects = [len(stmt["subjects"]) for stmt in rc.iter_statements()]
+            self.assertEqual(stats.n_lines, 12)
+            self.assertEqual(stats.n_assignments, sum(n_subjects))
+            self.assertEqual(sum(stats.subjects_per_document), 12)
+            self.assertEqual(stats.subjects_per_document[2], n_subjects.count(2))
+            self.assertEqual(sum(stats.score_histogram["counts"]), sum(n_subjects))
+    
+    def test_import_records(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            col = Collection.objects.create(name="imported", description="")
+            rc.import_records(["10011619528", "10001601438", "99999999999"], collection=col)
+            self.assertEqual(col.documents.count(), 2)
+            self.assertEqual(SubjectAssignment.objects.filter(document__external_id="10001601438").count(), 2)
+    
+    def test_import_records_batched(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            docids = rc.get_document_ids()
+            self.assertEqual(rc.import_records(docids, batch_size=5, limit=7), 7)
+            self.assertEqual(Document.objects.filter(external_id__in=docids).count(), 7)
+            ## already imported documents are excluded
+            self.assertEqual(rc.import_records(docids, batch_size=5), len(docids) - 7)
+            n_subjects = sum(len(stmt["subjects"]) for stmt in rc.iter_statements())
+            self.assertEqual(SubjectAssignment.objects.filter(indexer=rc.indexer).count(), n_subjects)
+    
+    def test_import_records_delta(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            docid = "10011704735" # 11613-5, 11540-6
+            rc.import_records([docid])
+            _c = lambda cid: "http://zbw.eu/stw/descriptor/" + cid
+            unchanged = SubjectAssignment.objects.get(document_id=docid, concept__uri=_c("11613-5"))
+            with open(rc.file.path, "w") as fout:
+                fout.write(docid + "\t11613-5\t11540-6:0.3\t10382-3:0.7\n")
+            self.assertEqual(rc.import_records([docid]), 0)
+            self.assertEqual(rc.import_records([docid], delta=True), 1)
+            scores = dict(SubjectAssignment.objects.filter(document_id=docid).values_list("concept__uri", "score"))
+            self.assertEqual(len(scores), 3)
+            self.assertAlmostEqual(float(scores[_c("11540-6")]), 0.3)
+            self.assertAlmostEqual(float(scores[_c("10382-3")]), 0.7)
+            self.assertEqual(SubjectAssignment.objects.get(document_id=docid, concept__uri=_c("11613-5")).id, unchanged.id)
+            with open(rc.file.path, "w") as fout:
+                fout.write(docid + "\t10382-3:0.7\n")
+            rc.import_records([docid], delta=True)
+            self.assertListEqual(list(SubjectAssignment.objects.filter(document_id=docid).values_list("concept__uri", flat=True)),
+                                 [_c("10382-3")])
+    
+    def test_import_records_delta_reviewed(self):
+        ## reviewed assignments survive a delta import that drops their subject
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            docid = "10011704735" # 11613-5, 11540-6
+            rc.import_records([docid])
+            _c = lambda cid: "http://zbw.eu/stw/descriptor/" + cid
+            reviewed = SubjectAssignment.objects.get(document_id=docid, concept__uri=_c("11613-5"))
+            review = Review.objects.create(ai=rc.indexer, reviewer=User.objects.create(username="rev_delta"), 
+                                           document_id=docid, total_rating="fair",
+                                           guideline=Guideline.objects.create(name="g", pub_date=tz.now()))
+            SubjectLevelReview.objects.create(subject_assignment=reviewed, review=review, value="helpful")
+            with open(rc.file.path, "w") as fout:
+                fout.write(docid + "\t10382-3:0.7\n")
+            with self.assertLogs(level="WARNING") as logs:
+                rc.import_records([docid], delta=True)
+            self.assertIn("kept 1 reviewed assignments", logs.output[0])
+            self.assertSetEqual(set(SubjectAssignment.objects.filter(document_id=docid).values_list("concept__uri", flat=True)),
+                                {_c("11613-5"), _c("10382-3")})
+            self.assertEqual(SubjectLevelReview.objects.get().subject_assignment_id, reviewed.id)
+    
+    def test_concepts(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            docids = rc.get_document_ids()
+            rc.import_records(docids)
+            uris = set(subj for stmt in rc.iter_statements() for subj in stmt["subjects"])
+            self.assertSetEqual(set(Concept.objects.values_list("uri", flat=True)), uris)
+            ids = Concept.intern(uris)
+            self.assertEqual(Concept.objects.count(), len(uris))
+            sa = SubjectAssignment.objects.filter(document_id=docids[0]).first()
+            self.assertEqual(ids[sa.subject], sa.concept_id)
+            ## construction by URI
+            sa = SubjectAssignment(subject="http://zbw.eu/stw/descriptor/99999-9")
+            self.assertEqual(Concept.get_uri(sa.concept_id), "http://zbw.eu/stw/descriptor/99999-9")
+    
+    def test_import_from_rc(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            col = Collection.objects.create(name="whitelisted", description="")
+            other = Document.objects.create(external_id="other", title="other")
+            col.documents.add(other)
+            fn = os.path.join(self.media_root, "whitelist.txt")
+            with open(fn, "w") as fout:
+                fout.write("10011619528\n10001601438\n\n10001601438\n99999999999\n")
+            call_command("rt_import_subjas_from_rc", "--f_whitelist", fn, "--collection", col.name, 
+                         "--rc", rc.name, stdout=StringIO())
+            self.assertSetEqual(set(col.documents.values_list("external_id", flat=True)), 
+                                {"10011619528", "10001601438"})
+            self.assertTrue(Document.objects.filter(external_id="other").exists())
+            ## documents imported before stay members
+            col.documents.clear()
+            call_command("rt_import_subjas_from_rc", "--f_whitelist", fn, "--collection", col.name, 
+                         "--rc", rc.name, stdout=StringIO())
+            self.assertEqual(col.documents.count(), 2)
+    
+    def test_validate(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            validation = rc.validate()
+            self.assertTrue(validation.is_valid())
+            self.assertEqual(rc.get_validation().n_lines, validation.n_lines)
+            with open(rc.file.path, "w") as fout:
+                fout.write("d1\t10382-3:0.7\t11540-6\n")
+                fout.write("d2\t10382-3:1.5\t11540-6:0.123\tx:y:z\t10382-4:abc\n")
+                fout.write("d1\t10382-3:0.70\tbad cid\n")
+            known = {"http://zbw.eu/stw/descriptor/10382-3", "http://zbw.eu/stw/descriptor/11540-6"}
+            validation = rc.validate(known_concepts=known)
+            self.assertEqual(validation.n_lines, 3)
+            self.assertDictEqual(dict((kind, n) for kind, n in validation.counts.items() if n > 0), {
+                    rcvalidation.SCORE_RANGE: 1, rcvalidation.SCORE_PRECISION: 1, rcvalidation.MALFORMED: 2,
+                    rcvalidation.DUPLICATE_DOCUMENT: 1, rcvalidation.INVALID_CONCEPT: 1})
+            self.assertListEqual([issue[0] for issue in validation.issues], [2, 2, 2, 2, 3, 3])
+            with self.assertRaisesRegex(CommandError, "6 issues"):
+                call_command("rt_rc_validate", rc.name, stdout=StringIO())
+            validator, issues = rcvalidation.validate_file(rc.file.path, rc.concept_template, known_concepts=set())
+            self.assertEqual(validator.counts[rcvalidation.UNKNOWN_CONCEPT], 3)
+            ## files need a concept template, a missing template of an RC is reported
+            with self.assertRaisesRegex(CommandError, "concept_template is required"):
+                call_command("rt_rc_validate", "--file", rc.file.path, stdout=StringIO())
+            rc.concept_template = None
+            validation = rc.validate()
+            self.assertEqual(validation.counts[rcvalidation.INVALID_CONCEPT], 4)
+            self.assertIn("no concept_template", validation.issues[0][2])
+    
+    def test_create_document_stubs(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            docids = rc.get_document_ids()
+            Document.objects.create(external_id=docids[1], title="known")
+            calls = list()
+            n_created = rc.create_document_stubs(batch_size=4, progress=lambda *args: calls.append(args))
+            self.assertEqual(n_created, len(set(docids)) - 1)
+            self.assertEqual(Document.objects.get(external_id=docids[1]).title, "known")
+            self.assertEqual(len(calls), (len(docids) + 3) // 4)
+            self.assertEqual(calls[-1], (len(docids), len(docids), n_created))
+            self.assertEqual(rc.create_document_stubs(), 0)
+    
+    def test_import_records_filtered(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            statements = [{"external_id": "a", "subjects": {"x": 0.2, "y": 0.9, "z": 0.5, "w": 0.5}}, 
+                          {"external_id": "b", "subjects": {"q": 0.1}}]
+            self.assertListEqual([stmt["subjects"] for stmt in rcstorage.filter_statements(statements, top_k=2)],
+                                 [{"y": 0.9, "z": 0.5}, {"q": 0.1}])
+            self.assertListEqual([stmt["subjects"] for stmt in rcstorage.filter_statements(statements, 0.3, 1)],
+                                 [{"y": 0.9}, {}])
+            docids = rc.get_document_ids()
+            rc.import_records(docids[:5], top_k=1, min_score=0.5)
+            statements = list(rc.iter_statements())
+            expected = rcstorage.filter_statements(statements[:5], 0.5, 1)
+            self.assertEqual(SubjectAssignment.objects.filter(indexer=rc.indexer).count(), 
+                             sum(len(stmt["subjects"]) for stmt in expected))
+            self.assertFalse(SubjectAssignment.objects.filter(indexer=rc.indexer, score__lt=0.5).exists())
+            ## filters apply to a single call only
+            rc.refresh_from_db()
+            self.assertEqual((rc.top_k, rc.min_score), (None, None))
+            rc.import_records(docids[5:])
+            self.assertEqual(SubjectAssignment.objects.filter(indexer=rc.indexer, document__external_id__in=docids[5:]).count(), 
+                             sum(len(stmt["subjects"]) for stmt in statements[5:]))
+            ## the command records the filter of its import, without filter it is cleared
+            fn = os.path.join(self.media_root, "whitelist.txt")
+            with open(fn, "w") as fout:
+                fout.write("\n".join(docids[:2]))
+            col = Collection.objects.create(name="col_filtered")
+            call_command("rt_import_subjas_from_rc", "--f_whitelist", fn, "--collection", col.name, "--rc", rc.name, 
+                         "--top-k", "2", stdout=StringIO())
+            rc.refresh_from_db()
+            self.assertEqual((rc.top_k, rc.min_score), (2, None))
+            call_command("rt_import_subjas_from_rc", "--f_whitelist", fn, "--collection", col.name, "--rc", rc.name, 
+                         stdout=StringIO())
+            rc.refresh_from_db()
+            self.assertEqual((rc.top_k, rc.min_score), (None, None))
+    
+    def test_compact_records(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            records = list(rc.iter_compact_records())
+            statements = list(rc.iter_statements())
+            self.assertEqual(len(records), len(statements))
+            for record, stmt in zip(records, statements):
+                self.assertEqual(record.external_id, stmt["external_id"])
+                self.assertListEqual(list(record.subjects(rc.concept_template)), list(stmt["subjects"]))
+                for score, expected in zip(record.scores, stmt["subjects"].values()):
+                    self.assertAlmostEqual(score, expected, places=6)
+            self.assertEqual(next(rc.iter_compact_records([records[3].external_id])).concepts, records[3].concepts)
+            record = rcstorage.parse_record("d1\ta:0.5\tb\ta:0.25\n")
+            self.assertEqual(record.concepts, ("a", "b"))
+            self.assertListEqual(list(record.scores), [0.25, 1.0])
+            self.assertIsNone(rcstorage.parse_record("\n"))
+    
+    def test_import_records_docfail(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            with self.assertRaises(Document.DoesNotExist):
+                rc.import_records(["10011619528"], create_emptydoc=False)
+            self.assertEqual(rc.import_records(["10011619528"], create_emptydoc=False, skip_docfail=True), 0)
+
+class SubjectQueryTests(TestCase):
+    
+    def test_explain_queries(self):
+        ## the concepts of the assignments are joined, the number of queries does not depend on them
+        User.objects.create_user("rt_reviewer", "", "pw")
+        self.client.login(username="rt_reviewer", password="pw")
+        ai = SubjectIndexer.objects.create(ai_name="ai_queries")
+        for n in [1, 5]:
+            doc = Document.objects.create(external_id="doc%d" % n, title="-")
+            cids = Concept.intern(["http://zbw.eu/stw/descriptor/1000%d-1" % i for i in range(n)])
+            SubjectAssignment.objects.bulk_create([SubjectAssignment(document=doc, concept_id=cid, indexer=ai, score=0.5) 
+                                                   for cid in cids.values()])
+        thes = ThesaurusApi("http://localhost/sparql", "-", "-", cache=None)
+        with patch.object(ThesaurusApi, "create", return_value=thes), patch.object(ThesaurusApi, "labels", return_value={}):
+            Concept.clear_cache()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get("/releasetool/api/explain/doc1")
+            Concept.clear_cache()
+            with self.assertNumQueries(len(queries)):
+                rsp = self.client.get("/releasetool/api/explain/doc5")
+        self.assertEqual(len(rsp.json()["assignments"]), 5)
+
+class DocumentStubTransactionTests(TransactionTestCase):
+    
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        Concept.clear_cache()
+    
+    def test_chunks_committed(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            docids = rc.get_document_ids()
+            def progress(n_processed, n_total, n_created):
+                ## each chunk is committed before the next one starts
+                self.assertFalse(connection.in_atomic_block)
+                self.assertEqual(Document.objects.filter(external_id__in=docids).count(), n_created)
+                if n_processed >= 8:
+                    raise KeyboardInterrupt()
+            with self.assertRaises(KeyboardInterrupt):
+                rc.create_document_stubs(batch_size=4, progress=progress)
+            ## an interrupted run keeps the committed chunks
+            self.assertEqual(Document.objects.filter(external_id__in=docids).count(), len(set(docids[:8])))
+
+class ImportCommandTests(TestCase):
+    
+    def setUp(self):
+        Concept.clear_cache()
+        self.fn = os.path.join(DIR_TESTDATA, "rc1.tsv")
+        with open(self.fn) as fin:
+            self.statements = [rcstorage.parse_line(ln, "{cid}") for ln in fin if ln.strip()]
+    
+    def _import(self, *args):
+        out = StringIO()
+        call_command("rt_import_subjas", "--indexer", "ai_bulk", "--create_indexer", 
+                     "--concept_template", "http://zbw.eu/stw/descriptor/{cid}", *args, self.fn, stdout=out)
+        return out.getvalue()
+    
+    def test_bulk(self):
+        out = self._import("--create_emptydoc", "--collection", "bulk", "--batch-size", "4")
+        self.assertIn("rows/s", out)
+        col = Collection.objects.get(name="bulk")
+        self.assertEqual(col.documents.count(), len(self.statements))
+        n_subjects = sum(len(stmt["subjects"]) for stmt in self.statements)
+        self.assertEqual(SubjectAssignment.objects.filter(indexer__ai_name="ai_bulk").count(), n_subjects)
+    
+    def test_default_loader(self):
+        ## without bulk options, the rows are written by the bulk loader of the backend as well
+        with patch("zaptain_rt_app.management.commands.rt_import_subjas.get_loader", 
+                   wraps=bulk_loader.get_loader) as get_loader:
+            out = self._import("--create_emptydoc")
+        get_loader.assert_called_once_with()
+        self.assertIn("rows/s", out)
+        n_subjects = sum(len(stmt["subjects"]) for stmt in self.statements)
+        self.assertEqual(SubjectAssignment.objects.count(), n_subjects)
+    
+    def test_bulk_workers(self):
+        ## tiny ranges to get several of them
+        with patch("zaptain_rt_app.management.commands.rt_import_subjas.IMPORT_RANGE_BYTES", 256):
+            self._import("--create_emptydoc", "--batch-size", "3", "--workers", "2")
+        n_subjects = sum(len(stmt["subjects"]) for stmt in self.statements)
+        self.assertEqual(SubjectAssignment.objects.count(), n_subjects)
+        ## the first illegal reference (in file order) is reported
+        Document.objects.all().delete()
+        with self.assertRaisesRegex(Document.DoesNotExist, self.statements[0]["external_id"]):
+            self._import("--batch-size", "3", "--workers", "2")
+    
+    def test_bulk_docfail_location(self):
+        ## the file and line of an illegal reference are reported, empty lines are counted
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        with open(self.fn) as fin:
+            lines = fin.readlines()
+        self.fn = os.path.join(tmpdir, "rc1_blank.tsv")
+        with open(self.fn, "w") as fout:
+            fout.writelines(lines[:3] + ["\n"] + lines[3:])
+        missing = self.statements[8]["external_id"] # line 10
+        for stmt in self.statements:
+            if stmt["external_id"] != missing:
+                Document.objects.create(external_id=stmt["external_id"], title="-")
+        for workers in ("1", "2"):
+            with patch("zaptain_rt_app.management.commands.rt_import_subjas.IMPORT_RANGE_BYTES", 64), \
+                    self.assertRaisesRegex(Document.DoesNotExist, "%s \\(%s:10\\)" % (missing, re.escape(self.fn))):
+                self._import("--batch-size", "3", "--workers", workers)
+        ## resumed imports count the lines before the checkpoint
+        with self.assertRaisesRegex(Document.DoesNotExist, ":10\\)"):
+            self._import("--batch-size", "3", "--workers", "2", "--resume")
+    
+    def test_bulk_resume(self):
+        n_subjects = sum(len(stmt["subjects"]) for stmt in self.statements)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        fn_gz = os.path.join(tmpdir, "rc1.tsv.gz")
+        with open(self.fn, "rb") as fin, gzip.open(fn_gz, "wb") as fout:
+            fout.write(fin.read())
+        for fn, workers in [(self.fn, "1"), (self.fn, "2"), (fn_gz, "1")]:
+            SubjectAssignment.objects.all().delete()
+            self.fn = fn
+            ## interrupted import
+            self._import("--create_emptydoc", "--batch-size", "2", "--workers", workers, "--limit", "5")
+            checkpoint = ImportCheckpoint.objects.get(file=os.path.abspath(fn))
+            self.assertEqual(checkpoint.n_lines, 5)
+            self.assertFalse(checkpoint.completed)
+            out = self._import("--create_emptydoc", "--batch-size", "2", "--workers", workers, "--resume")
+            self.assertIn("resuming at byte %d" % (checkpoint.offset,), out)
+            checkpoint.refresh_from_db()
+            self.assertTrue(checkpoint.completed)
+            self.assertEqual(checkpoint.n_lines, len(self.statements))
+            self.assertEqual(checkpoint.n_assignments, n_subjects)
+            self.assertEqual(SubjectAssignment.objects.count(), n_subjects)
+            self.assertIn("already imported", self._import("--batch-size", "2", "--resume"))
+    
+    def test_bulk_filtered(self):
+        self._import("--create_emptydoc", "--top-k", "1")
+        self.assertEqual(SubjectAssignment.objects.count(), sum(1 for stmt in self.statements if stmt["subjects"]))
+        self.assertEqual(ImportCheckpoint.objects.get().top_k, 1)
+        with self.assertRaisesRegex(CommandError, "top-k 1"):
+            self._import("--resume")
+    
+    def test_bulk_docfail(self):
+        with self.assertRaises(Document.DoesNotExist):
+            self._import("--batch-size", "4")
+        self._import("--skip_docfail", "--batch-size", "4")
+        self.assertEqual(SubjectAssignment.objects.count(), 0)
+
+def _run_task(func, *args, **kwargs):
+    """
+    replacement of async_task: run the task immediately
+    """
+    if isinstance(func, str):
+        func = import_string(func)
+    return func(*args)
+
+@patch("zaptain_rt_app.pipeline.async_task", _run_task)
+class PipelineTests(TestCase):
+    
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+    
+    def test_pipeline(self):
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                patch.dict(pipeline.CHUNK_SIZES, {STAGE_STUBS: 4}):
+            rc = _mk_rc(self.media_root)
+            stages = [stage for stage in PIPELINE_STAGES if stage != STAGE_METADATA]
+            pipeline.start(rc, stages)
+            records = list(rc.pipeline_stages.all())
+            self.assertListEqual([r.stage for r in records], stages)
+            self.assertTrue(all(r.status == STATUS_DONE for r in records))
+            docids = rc.get_document_ids()
+            self.assertEqual(records[-1].n_chunks, (len(docids) + 3) // 4)
+            self.assertEqual(Document.objects.filter(external_id__in=docids).count(), len(set(docids)))
+            self.assertTrue(rc.get_validation().is_valid())
+            self.assertEqual(rc.get_statistics().n_lines, len(docids))
+    
+    def test_admin_upload(self):
+        ## saving a new file in the admin starts the pipeline, actions restart single stages
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                patch.dict(pipeline._STAGE_FUNCS, {STAGE_METADATA: lambda rc, i: "fetched"}):
+            User.objects.create_superuser("rt_admin", "", "pw")
+            self.client.login(username="rt_admin", password="pw")
+            ai = SubjectIndexer.objects.create(ai_name="ai_upload")
+            with open(os.path.join(DIR_TESTDATA, "rc1.tsv"), "rb") as fin:
+                data = fin.read()
+            ## the pipeline is only started once the admin transaction commits
+            on_commit = list()
+            with patch("zaptain_rt_app.admin.transaction.on_commit", on_commit.append):
+                rsp = self.client.post("/admin/zaptain_rt_app/releasecandidate/add/", {
+                        "name": "UP", "pub_date_0": "2020-01-01", "pub_date_1": "00:00:00", "indexer": ai.pk,
+                        "concept_template": "http://zbw.eu/stw/descriptor/{cid}", "description": "",
+                        "pipeline_stages-TOTAL_FORMS": "0", "pipeline_stages-INITIAL_FORMS": "0",
+                        "file": SimpleUploadedFile("up.tsv", data)})
+            self.assertEqual(rsp.status_code, 302)
+            rc = ReleaseCandidate.objects.get(name="UP")
+            self.assertFalse(rc.pipeline_stages.exists())
+            self.assertEqual(len(on_commit), 1)
+            on_commit.pop()()
+            records = list(rc.pipeline_stages.all())
+            self.assertListEqual([r.stage for r in records], list(PIPELINE_STAGES))
+            self.assertTrue(all(r.status == STATUS_DONE for r in records))
+            rsp = self.client.get("/admin/zaptain_rt_app/releasecandidate/")
+            self.assertContains(rsp, "%s: %s 1/1" % (STAGE_METADATA, STATUS_DONE))
+            with patch("zaptain_rt_app.admin.transaction.on_commit", on_commit.append):
+                rsp = self.client.post("/admin/zaptain_rt_app/releasecandidate/", 
+                                       {"action": "create_stubs", "_selected_action": ["UP"]}, follow=True)
+            self.assertContains(rsp, "progress</a>")
+            on_commit.pop()()
+            self.assertListEqual([r.stage for r in rc.pipeline_stages.all()], [STAGE_STUBS])
+    
+    def test_pipeline_invalid(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            rc = _mk_rc(self.media_root)
+            with open(rc.file.path, "a") as fout:
+                fout.write("d1\t10382-3:7\n")
+            with self.assertRaises(InvalidReleaseCandidateException):
+                pipeline.start(rc)
+            records = dict((r.stage, r) for r in rc.pipeline_stages.all())
+            self.assertEqual(records[STAGE_VALIDATE].status, STATUS_FAILED)
+            self.assertIn("1 issues", records[STAGE_VALIDATE].message)
+            self.assertEqual(records[STAGE_INDEX].status, STATUS_PENDING)
+            ## tasks of outdated runs are ignored
+            pipeline.start(rc, [STAGE_INDEX])
+            pipeline.run_chunk(rc.name, "outdated", STAGE_INDEX, 0)
+            self.assertEqual(rc.pipeline_stages.get().n_done, 1)
+    
+    def test_validate_concepts(self):
+        ## concepts are checked against the thesaurus store, else the db, else the check is skipped
+        with override_settings(MEDIA_ROOT=self.media_root, RT_THESAURUS_STORE=None):
+            rc = _mk_rc(self.media_root)
+            uris = set(rc.format_concepts(rc.get_columns().concepts))
+            pipeline.start(rc, [STAGE_VALIDATE])
+            self.assertIn("concept check skipped", rc.pipeline_stages.get().message)
+            Concept.intern(["http://zbw.eu/stw/descriptor/10382-3"])
+            with self.assertRaises(InvalidReleaseCandidateException):
+                pipeline.start(rc, [STAGE_VALIDATE])
+            self.assertIn("against the db", rc.pipeline_stages.get().message)
+            self.assertGreater(rc.get_validation().counts.get(rcvalidation.UNKNOWN_CONCEPT, 0), 0)
+            store = thesaurus_store.ThesaurusStore.build({"languages": []}, [(uri, thesaurus_store.KIND_DESCRIPTOR) for uri in uris], 
+                                                         [], [], {})
+            with override_settings(RT_THESAURUS_STORE=store.save(os.path.join(self.media_root, "thes"))):
+                pipeline.start(rc, [STAGE_VALIDATE])
+            self.assertIn("against the thesaurus store", rc.pipeline_stages.get().message)
+            self.assertTrue(ReleaseCandidate.objects.get(name=rc.name).get_validation().is_valid())
+
+class BulkLoaderTests(TestCase):
+    
+    def test_loaders(self):
+        self.assertIsInstance(bulk_loader.get_loader(), bulk_loader.SqliteLoader)
+        ai = SubjectIndexer.objects.create(ai_name="ai_loader")
+        docs = [Document.objects.create(external_id="doc%d" % i, title="-") for i in range(3)]
+        cids = Concept.intern(["http://zbw.eu/stw/descriptor/10382-3", "http://zbw.eu/stw/descriptor/11540-6"])
+        fields = ("document", "concept", "indexer", "score")
+        for i, clz in enumerate([bulk_loader.SqliteLoader, bulk_loader.OrmLoader]):
+            loader = clz(connection)
+            rows = [(docs[i].pk, cid, ai.pk, Decimal("0.25")) for cid in cids.values()]
+            with loader.import_session():
+                self.assertEqual(loader.insert_rows(SubjectAssignment, fields, rows, batch_size=1), 2)
+            scores = SubjectAssignment.objects.filter(document=docs[i]).values_list("score", flat=True)
+            self.assertListEqual(list(scores), [Decimal("0.25")] * 2)
+        ## drivers without copy_expert (here: sqlite3) fall back to bulk_create
+        rows = [(docs[2].pk, cid, ai.pk, Decimal("0.25")) for cid in cids.values()]
+        self.assertEqual(bulk_loader.PostgresLoader(connection).insert_rows(SubjectAssignment, fields, rows), 2)
+        self.assertEqual(SubjectAssignment.objects.filter(document=docs[2]).count(), 2)
+    
+    def test_copy_value(self):
+        self.assertEqual(bulk_loader._copy_value(None), "\\N")
+        self.assertEqual(bulk_loader._copy_value("a\tb\\"), "a\\tb\\\\")
+        self.assertEqual(bulk_loader._copy_value(Decimal("0.70")), "0.70")
+
+class BulkLoaderSessionTests(TransactionTestCase):
+    
+    def _synchronous(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            return cursor.fetchone()[0]
+    
+    def test_sqlite_synchronous(self):
+        ## NORMAL during imports, OFF only on request, restored afterwards
+        loader = bulk_loader.SqliteLoader(connection)
+        previous = self._synchronous()
+        with loader.import_session():
+            self.assertEqual(self._synchronous(), 1)
+        self.assertEqual(self._synchronous(), previous)
+        with override_settings(RT_SQLITE_IMPORT_SYNCHRONOUS="off"), loader.import_session():
+            self.assertEqual(self._synchronous(), 0)
+        with override_settings(RT_SQLITE_IMPORT_SYNCHRONOUS="fast"), self.assertRaises(ValueError):
+            with loader.import_session():
+                pass
+
+class _SparqlResponse(object):
+    
+    def __init__(self, bindings, status_code=200):
+        self.bindings = bindings
+        self.status_code = status_code
+        self.content = b""
+    
+    def json(self):
+        return {"results": {"bindings": self.bindings}}
+
+class ThesaurusCacheTests(TestCase):
+    
+    def test_labels_cached(self):
+        thes = ThesaurusApi("http://localhost/sparql", "-", "-", cache=ConceptCache(maxsize=2, ttl=60))
+        c1, c2, c3 = ["http://zbw.eu/stw/descriptor/%s" % c for c in ["10382-3", "11540-6", "19032-3"]]
+        binding = lambda c, label: {"c": {"value": c}, "label": {"value": label}}
+        with patch.object(ThesaurusApi, "_q", return_value=_SparqlResponse([binding(c1, "Reform")])) as q:
+            self.assertDictEqual(thes.labels([c1, c2]), {c1: "Reform"})
+            ## c2 has no label, which is cached as well
+            self.assertDictEqual(thes.labels([c2, c1]), {c1: "Reform"})
+            self.assertEqual(q.call_count, 1)
+            ## only missing concepts are queried, c2 is evicted (least recently used)
+            thes.labels([c3, c1])
+            self.assertListEqual(q.call_args[1]["concept_uris"], [c3])
+            thes.labels([c2])
+            self.assertEqual(q.call_count, 3)
+        ## failed requests fall back to the uris and are not cached
+        thes.cache.clear()
+        with patch.object(ThesaurusApi, "_q", return_value=_SparqlResponse([], status_code=500)) as q:
+            self.assertDictEqual(thes.labels([c1]), {c1: c1})
+            thes.labels([c1])
+            self.assertEqual(q.call_count, 2)
+    
+    def test_chunks(self):
+        thes = ThesaurusApi("http://localhost/sparql", "-", "-", cache=ConceptCache(), chunk_size=2)
+        curis = ["http://zbw.eu/stw/descriptor/%d" % i for i in range(5)]
+        def _q(query, concept_uris=None, timeout=None):
+            if curis[2] in concept_uris:
+                raise requests.exceptions.ConnectionError("connection reset")
+            return _SparqlResponse([{"c": {"value": c}, "label": {"value": c[-1]}} for c in concept_uris])
+        with patch.object(ThesaurusApi, "_q", side_effect=_q) as q:
+            labels = thes.labels(curis)
+            self.assertEqual(q.call_count, 3)
+            self.assertListEqual([labels[c] for c in curis], ["0", "1", curis[2], curis[3], "4"])
+            ## only the failed chunk is queried again
+            thes.labels(curis)
+            self.assertEqual(q.call_count, 4)
+            self.assertListEqual(q.call_args[1]["concept_uris"], curis[2:4])
+    
+    def test_relations_chunks(self):
+        thes = ThesaurusApi("http://localhost/sparql", "-", "-", cache=None, chunk_size=2)
+        curis = ["http://zbw.eu/stw/descriptor/%d" % i for i in range(3)]
+        queries = list()
+        def _q(query):
+            queries.append(query)
+            ## the query of the last chunk against the first chunk fails
+            if ("<%s>" % curis[2]) in query.split("values (?c_other)")[0] and ("<%s>" % curis[0]) in query.split("values (?c_other)")[1]:
+                return _SparqlResponse([], status_code=503)
+            return _SparqlResponse([{"c": {"value": c}, "c_other": {"value": c}, "label": {"value": "-"}} 
+                                    for c in curis if ("<%s>" % c) in query.split("values (?c_other)")[0]])
+        with patch.object(ThesaurusApi, "_q", side_effect=_q):
+            relations = thes.relations(curis, include_RT=False)
+        self.assertEqual(len(queries), 4)
+        self.assertTrue(all(q.count("(<http") <= 4 for q in queries))
+        self.assertListEqual(sorted(r["source"] for r in relations), [curis[0], curis[0], curis[1], curis[1], curis[2]])
+    
+    def test_session(self):
+        ## first request fails with 503, the retry and later requests reuse one connection
+        statuses = [503, 200, 200, 200]
+        clients = set()
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                clients.add(self.client_address)
+                body = json.dumps({"results": {"bindings": []}}).encode("utf-8")
+                self.send_response(statuses.pop(0))
+                self.send_header("Content-Type", "application/sparql-results+json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            thes = ThesaurusApi("http://127.0.0.1:%d/sparql" % server.server_port, "-", "-", cache=None)
+            for i in range(3):
+                self.assertEqual(thes._q(Q_TOP_CATEGORIES).status_code, 200)
+            self.assertListEqual(statuses, [])
+            self.assertEqual(len(clients), 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+    
+    def test_ttl(self):
+        cache = ConceptCache(maxsize=10, ttl=-1)
+        cache.set_many({("labels", "e", "c"): "x"})
+        self.assertDictEqual(cache.get_many([("labels", "e", "c")]), {})
+        self.assertEqual(len(cache), 0)
+
+class ThesaurusStoreTests(TestCase):
+    
+    D = "http://zbw.eu/namespaces/zbw-extensions/Descriptor"
+    K = "http://zbw.eu/namespaces/zbw-extensions/Thsys"
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        uri = lambda c: {"value": "http://zbw.eu/stw/" + c}
+        lit = lambda v: {"value": v}
+        self.bindings = [
+            ("?c ?type", [{"c": uri(c), "type": lit(t)} for c, t in 
+                          [("V", self.K), ("V.01", self.K), ("W", self.K), ("W.01", self.K), 
+                           ("d1", self.D), ("d2", self.D), ("d3", self.D), ("d4", self.D)]]),
+            ("AS ?lang", [{"c": uri(c), "label": lit(l), "lang": lit(lang)} for c, l, lang in 
+                          [("d1", "Reform", "en"), ("d1", "Reformen", "de"), ("d2", "Tax reform", "en"), ("d3", "Tax", "en")]]),
+            ("skos:broader ?c_other", [{"c": uri(c), "c_other": uri(o)} for c, o in 
+                                       [("V.01", "V"), ("d1", "V.01"), ("d2", "d1"), ("W.01", "d4"), ("d4", "W"), ("d3", "W.01")]]),
+            ("skos:narrower ?c_other", []),
+            ("skos:related ?c_other", [{"c": uri("d2"), "c_other": uri("d3")}]),
+            ("topConceptOf", [{"t": uri("V"), "code": lit("V")}, {"t": uri("W"), "code": lit("W")}]),
+        ]
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+    
+    def _q(self, query, timeout=None):
+        bindings = [b for marker, b in self.bindings if marker in query][0]
+        return _SparqlResponse(bindings if "OFFSET 0" in query else [])
+    
+    def _harvest(self):
+        api = ThesaurusApi("http://localhost/sparql", self.D, self.K, cache=None)
+        with patch.object(ThesaurusApi, "_q", side_effect=self._q):
+            store = thesaurus_store.harvest(api, page_size=100)
+        return store.save(os.path.join(self.tmp_dir, "stw"))
+    
+    def test_harvest(self):
+        path = self._harvest()
+        with override_settings(RT_THESAURUS_STORE=path):
+            thes = ThesaurusApi.create("http://localhost/sparql", self.D, self.K)
+            self.assertIsInstance(thes, thesaurus_store.LocalThesaurusApi)
+            self.assertNotIsInstance(ThesaurusApi.create("http://other/sparql", self.D, self.K), 
+                                     thesaurus_store.LocalThesaurusApi)
+        c1, c2, c3 = ["http://zbw.eu/stw/" + c for c in ["d1", "d2", "d3"]]
+        self.assertDictEqual(thes.labels([c1, c3, "http://zbw.eu/stw/unknown"]), {c1: "Reform / Reformen", c3: "Tax"})
+        self.assertDictEqual(thes.top_categories(), {"V": "http://zbw.eu/stw/V", "W": "http://zbw.eu/stw/W"})
+        self.assertDictEqual(thes.categories([c1, c2]), {c1: ["V"], c2: []})
+        self.assertDictEqual(thes.categories(c1, return_type='uri'), {c1: ["http://zbw.eu/stw/V"]})
+        relations = thes.relations([c1, c2, c3])
+        self.assertIn({"source": c2, "target": c1, "relation": "BT"}, relations)
+        self.assertIn({"source": c3, "target": c2, "relation": "RT"}, relations)
+        self.assertEqual(len(relations), 3)
+    
+    def test_closure(self):
+        path = self._harvest()
+        for name in ["categories_ptr", "categories_idx"]:
+            os.remove(os.path.join(path, name + ".npy"))
+        thes = thesaurus_store.LocalThesaurusApi(thesaurus_store.ThesaurusStore.load(path))
+        c1, c3 = ["http://zbw.eu/stw/" + c for c in ["d1", "d3"]]
+        ## like skos:narrower*, the path from W.01 to W may pass concepts of any type
+        self.assertDictEqual(thes.categories([c1, c3]), {c1: ["V"], c3: ["W"]})
+        call_command("rt_thes_harvest", output=path, closure_only=True, stdout=StringIO())
+        store = thesaurus_store.ThesaurusStore.load(path)
+        self.assertTrue(isinstance(store.categories_idx, np.memmap))
+        self.assertDictEqual(thesaurus_store.LocalThesaurusApi(store).categories([c1, c3]), {c1: ["V"], c3: ["W"]})
+
 def _mk_ThesStw():
     endpoint = "http://zbw.eu/beta/sparql/stw/query"
     d_type = "http://zbw.eu/namespaces/zbw-extensions/Descriptor"
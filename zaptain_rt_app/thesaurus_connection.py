@@ -22,7 +22,10 @@ Connection accessing thesaurus API services.
 __author__ = "Martin Toepfer"
 
 import requests
-from requests.exceptions import Timeout # ... ReadTimeout
+from requests.adapters import HTTPAdapter
+from requests.exceptions import Timeout, RequestException # ... ReadTimeout
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ReadTimeoutError
 
 #import json
 try:
@@ -31,8 +34,16 @@ except ImportError:
     JSONDecodeError = ValueError
 
 import logging
+import hashlib
+import threading
+import time
+import random
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
 
 from .models import RtConfig
 from .online_configuration import RtConfigChoices
@@ -165,6 +176,43 @@ WHERE {{
 }}
 """
 
+## harvesting, see thesaurus_store, LIMIT and OFFSET are appended
+QT_HARVEST_CONCEPTS = """
+PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+SELECT DISTINCT ?c ?type
+WHERE {{
+  values (?type) {{ (<{descriptor_type}>) (<{kat_type}>) }} .
+  ?c a ?type .
+}}
+ORDER BY ?c ?type
+"""
+
+QT_HARVEST_LABELS = """
+PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+SELECT DISTINCT ?c ?label (lang(?label) AS ?lang)
+WHERE {{
+  values (?type) {{ (<{descriptor_type}>) (<{kat_type}>) }} .
+  ?c a ?type ;
+     skos:prefLabel ?label .
+  FILTER (lang(?label) IN ( {languages} ))
+}}
+ORDER BY ?c ?label
+"""
+
+QT_HARVEST_EDGES = """
+PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+SELECT DISTINCT ?c ?c_other
+WHERE {{
+  values (?type) {{ (<{descriptor_type}>) (<{kat_type}>) }} .
+  ?c a ?type ;
+     skos:{relation} ?c_other .
+}}
+ORDER BY ?c ?c_other
+"""
+
 # see: https://jena.apache.org/documentation/query/text-query.html#syntax
 Q_AUTOCOMPLETE_FUZZY = """
 PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -206,19 +254,178 @@ WHERE {{
 ORDER BY DESC(?score) DESC(lang(?prefLabel))
 """
 
+#----# CACHE #----#
+
+## per-concept results (labels, categories) are cached in process memory,
+# settings may override the defaults; RT_THESAURUS_DJANGO_CACHE = "<cache alias>"
+# additionally spills them to a Django cache shared by several workers
+THESAURUS_CACHE_SIZE = 50000
+THESAURUS_CACHE_TTL_S = 24 * 60 * 60
+
+
+class ConceptCache(object):
+    """
+    Thread-safe LRU cache with a time to live for each entry,
+    optionally backed by a Django cache (given by its alias).
+    
+    Keys are tuples of strings, e.g. ("labels", endpoint, concept uri).
+    """
+    
+    def __init__(self, maxsize=THESAURUS_CACHE_SIZE, ttl=THESAURUS_CACHE_TTL_S, django_cache=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.django_cache = django_cache
+        self._data = OrderedDict() # key => (expiry time, value), least recently used first
+        self._lock = threading.Lock()
+    
+    def get_many(self, keys):
+        """
+        returns: dictionary key => value for the keys in the cache
+        """
+        found = dict()
+        missing = list()
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    missing.append(key)
+                elif entry[0] < now:
+                    del self._data[key]
+                    missing.append(key)
+                else:
+                    self._data.move_to_end(key)
+                    found[key] = entry[1]
+        if missing and not self.django_cache is None:
+            shared_keys = dict((ConceptCache._shared_key(key), key) for key in missing)
+            shared = caches[self.django_cache].get_many(list(shared_keys))
+            shared = dict((shared_keys[skey], value) for skey, value in shared.items())
+            self._put(shared)
+            found.update(shared)
+        return found
+    
+    def set_many(self, items):
+        """
+        items: dictionary key => value
+        """
+        self._put(items)
+        if items and not self.django_cache is None:
+            caches[self.django_cache].set_many(dict((ConceptCache._shared_key(key), value) for key, value in items.items()), 
+                                               timeout=self.ttl)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def _put(self, items):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in items.items():
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    @staticmethod
+    def _shared_key(key):
+        ## safe for all cache backends (memcached: no spaces, < 250 chars)
+        return "rt_thes:" + hashlib.sha1("\t".join(key).encode("utf-8")).hexdigest()
+
+
+_CACHE = None
+
+def get_cache():
+    """
+    returns: the process-wide ConceptCache, configured by the settings
+    """
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = ConceptCache(getattr(settings, "RT_THESAURUS_CACHE_SIZE", THESAURUS_CACHE_SIZE),
+                              getattr(settings, "RT_THESAURUS_CACHE_TTL_S", THESAURUS_CACHE_TTL_S),
+                              getattr(settings, "RT_THESAURUS_DJANGO_CACHE", None))
+    return _CACHE
+
+#----# CONCURRENT REQUESTS #----#
+
+## large lists of concepts are queried in chunks (VALUES clauses of bounded size),
+# chunks are fetched concurrently by a process-wide pool of threads
+THESAURUS_CHUNK_SIZE = 200
+THESAURUS_WORKERS = 4
+
+_EXECUTOR = None
+
+def get_executor():
+    """
+    returns: the process-wide ThreadPoolExecutor (RT_THESAURUS_WORKERS threads)
+    """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=getattr(settings, "RT_THESAURUS_WORKERS", THESAURUS_WORKERS),
+                                       thread_name_prefix="rt_thesaurus")
+    return _EXECUTOR
+
+#----# HTTP SESSIONS #----#
+
+## one pooled session (keep-alive) per endpoint and process,
+# failed requests (5xx, timeouts, connection errors) are retried with jittered exponential backoff
+THESAURUS_RETRIES = 2
+THESAURUS_BACKOFF_S = 0.3
+THESAURUS_POOL_SIZE = 10
+_RETRY_STATUS = (500, 502, 503, 504)
+
+class _JitteredRetry(Retry):
+    
+    def get_backoff_time(self):
+        ## spread retries of concurrent requests
+        backoff = super(_JitteredRetry, self).get_backoff_time()
+        return backoff * random.uniform(0.5, 1.5)
+
+## SPARQL queries are sent by POST but they are idempotent, urllib3 < 1.26 calls the option method_whitelist
+_RETRY_METHODS = {"allowed_methods" if hasattr(Retry, "DEFAULT_ALLOWED_METHODS") else "method_whitelist": frozenset(["GET", "POST"])}
+
+_SESSIONS = dict() # endpoint => requests.Session
+_SESSIONS_LOCK = threading.Lock()
+
+def get_session(endpoint):
+    """
+    returns: the process-wide requests.Session for the endpoint
+    """
+    with _SESSIONS_LOCK:
+        if not endpoint in _SESSIONS:
+            retries = getattr(settings, "RT_THESAURUS_RETRIES", THESAURUS_RETRIES)
+            retry = _JitteredRetry(total=retries, connect=retries, read=retries, status=retries,
+                                   status_forcelist=_RETRY_STATUS, raise_on_status=False, 
+                                   backoff_factor=THESAURUS_BACKOFF_S, **_RETRY_METHODS)
+            ## at least one connection per thread of the executor
+            pool_size = max(THESAURUS_POOL_SIZE, getattr(settings, "RT_THESAURUS_WORKERS", THESAURUS_WORKERS))
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SESSIONS[endpoint] = session
+        return _SESSIONS[endpoint]
+
 #----# CLASSES #----#
 
 class ThesaurusApi(object):
     
-    def __init__(self, endpoint, descriptor_type, category_type, languages=["de", "en"]):
+    def __init__(self, endpoint, descriptor_type, category_type, languages=["de", "en"], cache=True, chunk_size=None):
         """
         examples:
             see tests.py
+        
+        cache: True = process-wide cache (see get_cache), or a ConceptCache, or None
+        chunk_size: max. number of concepts per request, default: RT_THESAURUS_CHUNK_SIZE
         """
         self.endpoint = endpoint
         self.Dtype = descriptor_type
         self.Ktype = category_type
         self.languages = languages
+        self.cache = get_cache() if cache is True else cache
+        self.chunk_size = chunk_size or getattr(settings, "RT_THESAURUS_CHUNK_SIZE", THESAURUS_CHUNK_SIZE)
     
     def autocomplete(self, autocomplete_string, limit=-1, exact_begin=False):
         template = Q_AUTOCOMPLETE_EXACT if exact_begin else Q_AUTOCOMPLETE_FUZZY
@@ -239,28 +446,36 @@ class ThesaurusApi(object):
         """
         return a dictionary of concept_id --> prefLabel items
         """
+        labels_ = self._cached("labels", list(concept_uris), self._fetch_labels, lambda c: c)
+        return dict((c, label) for c, label in labels_.items() if not label is None)
+    
+    def _fetch_labels(self, concept_uris):
+        """
+        returns: (dictionary concept uri --> label or None, success)
+        """
         _fallback_rsp = dict((c, c) for c in concept_uris)
         try:
             rsp = self._q(QT_LABELS, concept_uris=concept_uris) # , prefix=prefix) # , accept="application/sparql-results+json")
         except Timeout as err:
             logging.error(err)
-            return _fallback_rsp
+            return _fallback_rsp, False
         if rsp.status_code != 200:
             logging.error("error querying labels... %s" % (repr(rsp), ))
             # logging.error(query)
             logging.error("Querying labels for concepts failed.")
             logging.error(rsp.content)
-            return _fallback_rsp
+            return _fallback_rsp, False
         thelabels = defaultdict(list)
         for e in rsp.json()["results"]["bindings"]:
             key = e['c']['value']
             value = e['label']['value']
             thelabels[key].append(value)
-        joinedlabels = {
+        joinedlabels = dict((c, None) for c in concept_uris) # None: no label
+        joinedlabels.update({
                 cncpt_id: ' / '.join(labels)
                 for cncpt_id, labels
-                in thelabels.items()}
-        return joinedlabels
+                in thelabels.items()})
+        return joinedlabels, True
     
     def top_categories(self):
         """
@@ -276,7 +491,7 @@ class ThesaurusApi(object):
                 return dict()
             rsp_bindings = rsp.json()["results"]["bindings"]
             return dict((e['code']['value'], e['t']['value']) for e in rsp_bindings)
-        except ReadTimeoutError:
+        except Timeout:
             logging.error("Querying top categories timed out.")
             return dict()
     
@@ -291,9 +506,9 @@ class ThesaurusApi(object):
         """
         if type(concept_uris) is str:
             concept_uris = [concept_uris,]
+        concept_uris = list(concept_uris)
         if len(concept_uris) < 1:
             return dict()
-        cidsstr = ThesaurusApi._curis_to_valueliststr(concept_uris)
         qtmplt = None
         if return_type == 'code':
             qtmplt = QT_CATEGORY_CODES
@@ -301,13 +516,21 @@ class ThesaurusApi(object):
             qtmplt = QT_CATEGORIES
         else:
             raise Exception('illegal return_type parameter given')
+        return self._cached("categories:" + return_type, concept_uris, 
+                            lambda uris: self._fetch_categories(qtmplt, uris), lambda c: [])
+    
+    def _fetch_categories(self, qtmplt, concept_uris):
+        """
+        returns: (dictionary concept uri --> LIST of categories, success)
+        """
+        cidsstr = ThesaurusApi._curis_to_valueliststr(concept_uris)
         thecks = dict((c_uri, []) for c_uri in concept_uris) # map to thesaurus categories
         query = qtmplt.format(cs=cidsstr, kat_type=self.Ktype)
         try:
             rsp = self._q(query)
         except Timeout as err:
             logging.error(err)
-            return thecks
+            return thecks, False
         jsonresult = rsp.json()["results"]["bindings"]
         for e in jsonresult:
             if not 'c' in e:
@@ -315,13 +538,54 @@ class ThesaurusApi(object):
             else:
                 c = e["c"]["value"]
                 kats = e["kat_info"]["value"].split(", ")
-                # add your special endpoint extensions for ordering of categories here:
-                if self.endpoint == "http://zbw.eu/beta/sparql/stw/query":
-                    _order = "VBWPNGA"
-                    _orderfun = lambda k: _order.index(k) if k in _order else 0
-                    kats = sorted(kats, key=_orderfun)
-                thecks[c] = kats
-        return thecks
+                thecks[c] = self._order_categories(kats)
+        return thecks, True
+    
+    def _order_categories(self, kats):
+        # add your special endpoint extensions for ordering of categories here:
+        if self.endpoint == "http://zbw.eu/beta/sparql/stw/query":
+            _order = "VBWPNGA"
+            _orderfun = lambda k: _order.index(k) if k in _order else 0
+            kats = sorted(kats, key=_orderfun)
+        return kats
+    
+    def _cached(self, kind, concept_uris, fetch, fallback):
+        """
+        look up per-concept results of kind in the cache and fetch only the missing concepts,
+        fetch(concept uris) returns (dictionary concept uri --> value, success),
+        fallback(concept uri) is the value for concepts of failed requests;
+        results of failed requests are returned but not cached.
+        """
+        keys = dict((c, (kind, self.endpoint, c)) for c in concept_uris)
+        result = dict()
+        if not self.cache is None:
+            cached = self.cache.get_many(list(keys.values()))
+            result.update((c, cached[key]) for c, key in keys.items() if key in cached)
+        missing = [c for c in keys if not c in result]
+        for fetched, ok in self._fetch_chunked(fetch, fallback, missing):
+            if ok and not self.cache is None:
+                self.cache.set_many(dict((keys[c], value) for c, value in fetched.items() if c in keys))
+            result.update(fetched)
+        return result
+    
+    def _fetch_chunked(self, fetch, fallback, concept_uris):
+        """
+        split the concepts into chunks of chunk_size and fetch them concurrently (see get_executor),
+        returns: LIST of (dictionary concept uri --> value, success) per chunk
+        """
+        chunks = [concept_uris[i:i + self.chunk_size] for i in range(0, len(concept_uris), self.chunk_size)]
+        if len(chunks) <= 1:
+            return [self._fetch_chunk(fetch, fallback, chunk) for chunk in chunks]
+        futures = [get_executor().submit(self._fetch_chunk, fetch, fallback, chunk) for chunk in chunks]
+        return [future.result() for future in futures]
+    
+    def _fetch_chunk(self, fetch, fallback, concept_uris):
+        ## a failed chunk only degrades its own concepts
+        try:
+            return fetch(concept_uris)
+        except (RequestException, ValueError, KeyError) as err:
+            logging.error("Querying %d concepts failed: %s" % (len(concept_uris), repr(err)))
+            return dict((c, fallback(c)) for c in concept_uris), False
     
 #    def groups(self, concept_ids):
 #        """
@@ -342,34 +606,57 @@ class ThesaurusApi(object):
         return relations_
 
     def _fetch_relations(self, template, concept_uris, relation_name):
+        ## both VALUES clauses are bounded: each chunk of concepts is queried against each chunk of other concepts
+        concept_uris = list(concept_uris)
+        others = [concept_uris[i:i + self.chunk_size] for i in range(0, len(concept_uris), self.chunk_size)]
+        fetch = lambda uris: self._fetch_relations_chunk(template, uris, others, relation_name)
         relations_ = [] # return obj
+        for fetched, ok in self._fetch_chunked(fetch, lambda c: [], concept_uris):
+            for c_relations in fetched.values():
+                relations_ += c_relations
+        return relations_
+    
+    def _fetch_relations_chunk(self, template, concept_uris, others, relation_name):
+        """
+        returns: (dictionary concept uri --> LIST of relations to the concepts of others, success)
+        """
+        relations_ = dict((c, []) for c in concept_uris)
+        ok = True
         cs = ThesaurusApi._curis_to_valueliststr(concept_uris)
-        qq = template.format(cs=cs, cs_other=cs, langstr='en', 
-                                 descriptor_type=self.Dtype)
-        rsp = self._q(qq)
-        if rsp.status_code != 200:
-            logging.error("error querying top categories... %s" % (repr(rsp), ))
-            logging.error(qq)
-            logging.error(rsp.content)
-        else:
+        for other in others:
+            qq = template.format(cs=cs, cs_other=ThesaurusApi._curis_to_valueliststr(other), langstr='en', 
+                                     descriptor_type=self.Dtype)
+            rsp = self._q(qq)
+            if rsp.status_code != 200:
+                logging.error("error querying relations... %s" % (repr(rsp), ))
+                logging.error(qq)
+                logging.error(rsp.content)
+                ok = False
+                continue
             jobj = rsp.json()['results']['bindings']
             for el_ in jobj:
                 if all(k in el_ for k in ['c_other', 'label']):
                     cid = el_['c']['value']
                     cid_other = el_['c_other']['value']
-                    relations_.append({"source": cid, "target": cid_other, "relation": relation_name })
+                    relations_.setdefault(cid, []).append({"source": cid, "target": cid_other, "relation": relation_name })
                 else:
                     logging.warning(el_)
-        return relations_
+        return relations_, ok
     
     def _q(self, query, concept_uris=None, timeout=_TIMEOUT_S):
         """
-        perform a POST http requests action,
-        please handle TIMEOUTs, --> ReadTimeoutError
+        perform a POST http requests action with the pooled session (retries, see get_session),
+        please handle TIMEOUTs, --> requests.exceptions.Timeout
         """
         if not concept_uris is None:
             query = query % (ThesaurusApi._curis_to_valueliststr(concept_uris))
-        return requests.post(self.endpoint, data={"query": query}, timeout=timeout)
+        try:
+            return get_session(self.endpoint).post(self.endpoint, data={"query": query}, timeout=timeout)
+        except requests.exceptions.ConnectionError as err:
+            ## read timeouts surface as connection errors when the retries are exhausted
+            if err.args and isinstance(getattr(err.args[0], "reason", None), ReadTimeoutError):
+                raise Timeout(err)
+            raise
     
     @staticmethod
     def _curis_to_valueliststr(concept_uris):
@@ -377,14 +664,27 @@ class ThesaurusApi(object):
     
 
     @classmethod
-    def create_from_db(Clz):
+    def create(Clz, endpoint, descriptor_type, category_type, local=True):
+        """
+        returns: LocalThesaurusApi if a local store of this thesaurus was harvested 
+        (settings.RT_THESAURUS_STORE, see thesaurus_store), else ThesaurusApi
+        """
+        if local:
+            from .thesaurus_store import get_local_api
+            api = get_local_api(endpoint, descriptor_type, category_type)
+            if not api is None:
+                return api
+        return Clz(endpoint, descriptor_type, category_type)
+
+    @classmethod
+    def create_from_db(Clz, local=True):
         ctx = dict()
         for k, k_hum in RtConfigChoices:
             try:
                 ctx[k] = RtConfig.objects.get(key=k).value
             except RtConfig.DoesNotExist:
                 pass
-        return Clz(ctx[CK_THES_SPARQL_ENDPOINT], ctx[CK_THES_DESCRIPTOR_TYPE], ctx[CK_THES_CATEGORY_TYPE])
+        return Clz.create(ctx[CK_THES_SPARQL_ENDPOINT], ctx[CK_THES_DESCRIPTOR_TYPE], ctx[CK_THES_CATEGORY_TYPE], local=local)
 
 
     
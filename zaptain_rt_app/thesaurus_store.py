@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+#
+#    releasetool - quality assessment for automatic subject indexing
+#    Copyright (C) 2018 Martin Toepfer <m.toepfer@zbw.eu> | ZBW -- Leibniz Information Centre for Economics
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Local snapshot of the thesaurus.
+
+The configured SKOS thesaurus is harvested once (see the command rt_thes_harvest)
+into a directory of memory-mappable .npy files, then LocalThesaurusApi answers
+labels, categories, relations and top categories without SPARQL requests.
+"""
+__author__ = "Martin Toepfer"
+
+import os
+import json
+import shutil
+import logging
+from collections import defaultdict
+
+import numpy as np
+
+from django.conf import settings
+from django.utils import timezone as tz
+
+from .exceptions import IllegalStateException
+from .thesaurus_connection import ThesaurusApi
+from .thesaurus_connection import QT_HARVEST_CONCEPTS, QT_HARVEST_LABELS, QT_HARVEST_EDGES, Q_TOP_CATEGORIES
+
+KIND_DESCRIPTOR = 1
+KIND_CATEGORY = 2
+
+## harvesting queries the whole thesaurus, page by page
+HARVEST_PAGE_SIZE = 10000
+HARVEST_TIMEOUT_S = 120.0
+
+META_FILE = "meta.json"
+
+#----# STORE #----#
+
+class ThesaurusStore(object):
+    """
+    Memory-mapped snapshot of a thesaurus:
+    
+    uris: concept index => concept uri
+    kinds: uint8, KIND_DESCRIPTOR and/or KIND_CATEGORY flags
+    notations: notation of the concept or ''
+    labels_<lang>: prefLabel in language lang or ''
+    top: bool, whether the concept is a top category
+    <relation>_ptr, <relation>_idx: int32, edges (i, j) with j in idx[ptr[i]:ptr[i+1]]
+        for the relations broader, narrower and related
+    categories_ptr, categories_idx: int32, precomputed top categories of each concept
+    
+    meta: endpoint, descriptor_type, category_type, languages and time of the harvest
+    """
+    RELATIONS = ("broader", "narrower", "related")
+    CLOSURES = ("categories",)
+    
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.languages = meta["languages"]
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+        self.index = dict((uri, i) for i, uri in enumerate(self.uris.tolist()))
+    
+    def __len__(self):
+        return self.uris.shape[0]
+    
+    @classmethod
+    def build(Clz, meta, concepts, labels, edges, top_categories):
+        """
+        concepts: LIST of (concept uri, kind flag)
+        labels: LIST of (concept uri, language, label)
+        edges: LIST of (relation, concept uri, concept uri), edges to unknown concepts are dropped
+        top_categories: dictionary notation => concept uri
+        """
+        kinds = defaultdict(int)
+        for uri, kind in concepts:
+            kinds[uri] |= kind
+        uris = sorted(kinds)
+        index = dict((uri, i) for i, uri in enumerate(uris))
+        arrays = {
+            "uris": np.array(uris, dtype=str),
+            "kinds": np.array([kinds[uri] for uri in uris], dtype=np.uint8),
+        }
+        notations = [''] * len(uris)
+        top = np.zeros(len(uris), dtype=bool)
+        for notation, uri in top_categories.items():
+            if uri in index:
+                notations[index[uri]] = notation
+                top[index[uri]] = True
+        arrays["notations"] = np.array(notations, dtype=str)
+        arrays["top"] = top
+        for lang in meta["languages"]:
+            ## multiple prefLabels in one language are joined like in the label query
+            labels_lang = defaultdict(list)
+            for uri, label_lang, label in labels:
+                if label_lang == lang and uri in index:
+                    labels_lang[index[uri]].append(label)
+            arrays["labels_" + lang] = np.array([" / ".join(sorted(labels_lang[i])) for i in range(len(uris))], dtype=str)
+        pairs = dict((relation, set()) for relation in Clz.RELATIONS)
+        for relation, uri, uri_other in edges:
+            if uri in index and uri_other in index:
+                pairs[relation].add((index[uri], index[uri_other]))
+        ## narrower is the inverse of broader, related is symmetric
+        pairs["narrower"] |= set((j, i) for i, j in pairs["broader"])
+        pairs["broader"] |= set((j, i) for i, j in pairs["narrower"])
+        pairs["related"] |= set((j, i) for i, j in pairs["related"])
+        for relation, relation_pairs in pairs.items():
+            arrays[relation + "_ptr"], arrays[relation + "_idx"] = _csr(len(uris), relation_pairs)
+        store = Clz(meta, arrays)
+        store.compute_closure()
+        return store
+    
+    def compute_closure(self):
+        """
+        precompute the transitive closure concept => top categories like QT_CATEGORIES: 
+        the top categories that are (skos:broader)* of a category that is skos:broader of the concept,
+        intermediate concepts may be of any (harvested) type, as with skos:narrower*.
+        """
+        is_category = (np.asarray(self.kinds) & KIND_CATEGORY) > 0
+        is_top = np.asarray(self.top) & is_category
+        tops = dict() # category index => top categories (skos:broader)* of it
+        def _tops(k):
+            if not k in tops:
+                seen = {k} # guards against cycles
+                stack = [k]
+                while stack:
+                    j = stack.pop()
+                    for b in self.neighbours("broader", j):
+                        b = int(b)
+                        if not b in seen:
+                            seen.add(b)
+                            stack.append(b)
+                tops[k] = [j for j in seen if is_top[j]]
+            return tops[k]
+        categories = set()
+        for i in range(len(self)):
+            for j in self.neighbours("broader", i):
+                j = int(j)
+                if is_category[j]:
+                    categories.update((i, k) for k in _tops(j))
+        self.categories_ptr, self.categories_idx = _csr(len(self), categories)
+    
+    def save(self, path):
+        """
+        write the store to the directory at path, an existing store is replaced.
+        """
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in self._array_names():
+            np.save(os.path.join(tmp_path, name + ".npy"), getattr(self, name))
+        with open(os.path.join(tmp_path, META_FILE), "w") as fout:
+            json.dump(self.meta, fout)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return path
+    
+    @classmethod
+    def load(Clz, path, mmap_mode='r'):
+        """
+        load the store at path, the closure is computed in memory
+        if it is missing (run rt_thes_harvest --closure_only to save it).
+        """
+        with open(os.path.join(path, META_FILE)) as fin:
+            meta = json.load(fin)
+        arrays = dict()
+        for name in Clz._array_names_for(meta["languages"]):
+            fn = os.path.join(path, name + ".npy")
+            if os.path.exists(fn):
+                arrays[name] = np.load(fn, mmap_mode=mmap_mode)
+        store = Clz(meta, arrays)
+        if any(not closure + "_ptr" in arrays for closure in Clz.CLOSURES):
+            logging.warning("local thesaurus store %s has no category closure, computing it." % (path, ))
+            store.compute_closure()
+        return store
+    
+    def _array_names(self):
+        return ThesaurusStore._array_names_for(self.languages)
+    
+    @staticmethod
+    def _array_names_for(languages):
+        names = ["uris", "kinds", "notations", "top"]
+        names += ["labels_" + lang for lang in languages]
+        for relation in ThesaurusStore.RELATIONS + ThesaurusStore.CLOSURES:
+            names += [relation + "_ptr", relation + "_idx"]
+        return names
+    
+    def neighbours(self, relation, i):
+        ptr = getattr(self, relation + "_ptr")
+        return getattr(self, relation + "_idx")[ptr[i]:ptr[i + 1]]
+    
+    def ancestors(self, i):
+        """
+        returns: set of concept indices reachable by (skos:broader)+
+        """
+        seen = set()
+        stack = list(self.neighbours("broader", i))
+        while stack:
+            j = int(stack.pop())
+            if not j in seen:
+                seen.add(j)
+                stack.extend(self.neighbours("broader", j))
+        return seen
+    
+    def label(self, i, languages=None):
+        """
+        returns: prefLabels of concept i joined by ' / ' or None
+        """
+        labels = [str(getattr(self, "labels_" + lang)[i]) for lang in sorted(languages or self.languages, reverse=True)
+                  if lang in self.languages]
+        labels = [label for label in labels if label]
+        return ' / '.join(labels) if labels else None
+    
+
+def _csr(n, pairs):
+    """
+    returns: (ptr, idx) of the sorted pairs (i, j), i and j in [0, n)
+    """
+    pairs = sorted(pairs)
+    ptr = np.zeros(n + 1, dtype=np.int32)
+    np.add.at(ptr, np.array([i + 1 for i, _ in pairs], dtype=np.int64), 1)
+    return np.cumsum(ptr, dtype=np.int32), np.array([j for _, j in pairs], dtype=np.int32)
+
+#----# HARVEST #----#
+
+def _select(api, query, page_size=HARVEST_PAGE_SIZE):
+    """
+    run the SELECT query page by page (the query must be ordered),
+    returns: LIST of bindings
+    """
+    bindings = list()
+    offset = 0
+    while True:
+        rsp = api._q(query + "LIMIT %d OFFSET %d" % (page_size, offset), timeout=HARVEST_TIMEOUT_S)
+        if rsp.status_code != 200:
+            logging.error(rsp.content)
+            raise IllegalStateException("harvesting the thesaurus failed: %s" % (repr(rsp), ))
+        page = rsp.json()["results"]["bindings"]
+        bindings += page
+        if len(page) < page_size:
+            return bindings
+        offset += page_size
+
+def harvest(api, languages=None, page_size=HARVEST_PAGE_SIZE):
+    """
+    harvest the descriptors and categories of the thesaurus behind the ThesaurusApi,
+    returns: ThesaurusStore
+    """
+    languages = list(languages or api.languages)
+    fmt = dict(descriptor_type=api.Dtype, kat_type=api.Ktype, 
+               languages=", ".join(["\"" + lang + "\"" for lang in languages]))
+    concepts = list()
+    for e in _select(api, QT_HARVEST_CONCEPTS.format(**fmt), page_size):
+        concepts.append((e["c"]["value"], KIND_DESCRIPTOR if e["type"]["value"] == api.Dtype else KIND_CATEGORY))
+    labels = [(e["c"]["value"], e["lang"]["value"], e["label"]["value"]) 
+              for e in _select(api, QT_HARVEST_LABELS.format(**fmt), page_size)]
+    edges = list()
+    for relation in ThesaurusStore.RELATIONS:
+        query = QT_HARVEST_EDGES.format(relation=relation, **fmt)
+        edges += [(relation, e["c"]["value"], e["c_other"]["value"]) for e in _select(api, query, page_size)]
+    top_categories = dict((e['code']['value'], e['t']['value']) 
+                          for e in _select(api, Q_TOP_CATEGORIES + "ORDER BY ?t\n", page_size))
+    meta = {
+        "endpoint": api.endpoint,
+        "descriptor_type": api.Dtype,
+        "category_type": api.Ktype,
+        "languages": languages,
+        "harvested": tz.now().isoformat(),
+    }
+    return ThesaurusStore.build(meta, concepts, labels, edges, top_categories)
+
+#----# BACKEND #----#
+
+_STORES = dict() # path => (modification time, ThesaurusStore)
+
+def get_store(path=None):
+    """
+    returns: the ThesaurusStore at path (default: settings.RT_THESAURUS_STORE) or None,
+    stores are loaded once per process and reloaded after a new harvest.
+    """
+    path = path or getattr(settings, "RT_THESAURUS_STORE", None)
+    if not path or not os.path.exists(os.path.join(path, META_FILE)):
+        return None
+    mtime = os.path.getmtime(os.path.join(path, META_FILE))
+    if not path in _STORES or _STORES[path][0] != mtime:
+        _STORES[path] = (mtime, ThesaurusStore.load(path))
+    return _STORES[path][1]
+
+def get_local_api(endpoint, descriptor_type, category_type, path=None):
+    """
+    returns: LocalThesaurusApi if a store was harvested with the same configuration, else None
+    """
+    store = get_store(path)
+    if store is None:
+        return None
+    if (store.meta["endpoint"], store.meta["descriptor_type"], store.meta["category_type"]) != (endpoint, descriptor_type, category_type):
+        logging.warning("local thesaurus store does not match the configuration, harvest again.")
+        return None
+    return LocalThesaurusApi(store)
+
+
+class LocalThesaurusApi(ThesaurusApi):
+    """
+    ThesaurusApi that answers lookups from a ThesaurusStore, 
+    autocomplete still queries the SPARQL endpoint.
+    """
+    
+    def __init__(self, store, languages=None):
+        super(LocalThesaurusApi, self).__init__(store.meta["endpoint"], store.meta["descriptor_type"], 
+             store.meta["category_type"], languages=languages or store.languages, cache=None)
+        self.store = store
+    
+    def labels(self, concept_uris, prefix=None):
+        labels_ = dict()
+        for c in concept_uris:
+            i = self.store.index.get(c)
+            label = None if i is None else self.store.label(i, self.languages)
+            if not label is None:
+                labels_[c] = label
+        return labels_
+    
+    def top_categories(self):
+        return dict((str(self.store.notations[i]), str(self.store.uris[i])) for i in np.flatnonzero(self.store.top))
+    
+    def categories(self, concept_uris, return_type='code'):
+        if type(concept_uris) is str:
+            concept_uris = [concept_uris,]
+        if return_type == 'code':
+            names = self.store.notations
+        elif return_type == 'uri':
+            names = self.store.uris
+        else:
+            raise Exception('illegal return_type parameter given')
+        thecks = dict()
+        for c in concept_uris:
+            i = self.store.index.get(c)
+            kats = [] if i is None else sorted(str(names[k]) for k in self.store.neighbours("categories", i))
+            thecks[c] = self._order_categories(kats) if return_type == 'code' else kats
+        return thecks
+    
+    def relations(self, concept_uris, include_RT=True):
+        store = self.store
+        idx = dict((store.index[c], c) for c in concept_uris if c in store.index)
+        relations_ = []
+        for i, c in idx.items():
+            for j in store.ancestors(i):
+                if j in idx and store.kinds[j] & KIND_DESCRIPTOR and store.label(j, ["en"]):
+                    relations_.append({"source": c, "target": idx[j], "relation": "BT"})
+        if include_RT:
+            for i, c in idx.items():
+                for j in store.neighbours("related", i):
+                    j = int(j)
+                    if j in idx and store.kinds[j] & KIND_DESCRIPTOR and store.label(j, ["en"]):
+                        relations_.append({"source": c, "target": idx[j], "relation": "RT"})
+        return relations_
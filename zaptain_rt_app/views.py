@@ -173,8 +173,8 @@ def review(request, external_id):
     SubjectMissingFormset = missingsubj_formsetfactory()
     
     hi = rqctx['reviewer'].as_indexer()
-    assignments = dbdoc.subjectassignment_set.filter(indexer=ai_main)
-    subjs_infodemanded = set(sa.subject for sa in dbdoc.subjectassignment_set.filter(indexer__user__isnull=True))
+    assignments = dbdoc.subjectassignment_set.filter(indexer=ai_main).select_related('concept')
+    subjs_infodemanded = set(sa.subject for sa in dbdoc.subjectassignment_set.filter(indexer__user__isnull=True).select_related('concept'))
     
     subjratings_form = None
     subjmissing_form = None
@@ -212,7 +212,7 @@ def review(request, external_id):
                             for srf in subjratings_form:
                                 subject = srf['uri'].value()
                                 value = srf['rating'].value()
-                                sa = dbdoc.subjectassignment_set.get(subject=subject, indexer=ai_main)
+                                sa = dbdoc.subjectassignment_set.get(concept__uri=subject, indexer=ai_main)
                                 SubjectLevelReview.objects.create(
                                         subject_assignment=sa,
                                         review=revnew,
@@ -224,7 +224,7 @@ def review(request, external_id):
                                              review=revnew)
                             for smf in subjmissing_form:
                                 sa = dbdoc.subjectassignment_set.get(
-                                        subject=smf['uri'].value(), indexer=hi)
+                                        concept__uri=smf['uri'].value(), indexer=hi)
                                 SubjectLevelReview.objects.create(
                                         subject_assignment=sa,
                                         review=revnew,
@@ -250,7 +250,7 @@ def review(request, external_id):
             ## try to recover data for form widgets:
             _initial_doc_level = dbreview.total_rating
             _initial_subjrating = []
-            _initial_subjmissing = [{"uri": sa.subject} for sa in dbdoc.subjectassignment_set.filter(indexer=hi)]
+            _initial_subjmissing = [{"uri": sa.subject} for sa in dbdoc.subjectassignment_set.filter(indexer=hi).select_related('concept')]
             for sa in assignments:
                 try:
                     subjrating = SubjectLevelReview.objects.get(review=dbreview, subject_assignment=sa)
@@ -296,7 +296,7 @@ def review(request, external_id):
         pass
     
     explanation = dict((subj, {"support": [], "label": subj_labels[subj]}) for subj in subjs_infodemanded)
-    for sa in dbdoc.subjectassignment_set.filter(indexer__user__isnull=True):
+    for sa in dbdoc.subjectassignment_set.filter(indexer__user__isnull=True).select_related('concept', 'indexer'):
         explanation[sa.subject]["support"].append({"indexer": sa.indexer.ai_name, "score": sa.score})
     explanation = list(explanation.items())
     
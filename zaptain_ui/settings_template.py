@@ -148,4 +148,12 @@ STATIC_ROOT =  None ## absolute path, e.g.: 'D:/tmp/dj_static'
 # see: https://docs.djangoproject.com/en/2.0/ref/settings/#media-url
 MEDIA_ROOT = None ## absolute path, e.g.:  'D:/tmp/dj_media'
 MEDIA_URL = '/media/'
+# Thesaurus lookups (labels, categories) are cached per concept:
+# RT_THESAURUS_CACHE_SIZE = 50000 ## number of entries in process memory
+# RT_THESAURUS_CACHE_TTL_S = 86400 ## seconds
+# RT_THESAURUS_DJANGO_CACHE = 'default' ## optional, alias of a shared cache in CACHES
+# RT_THESAURUS_CHUNK_SIZE = 200 ## max. number of concepts per SPARQL request
+# RT_THESAURUS_WORKERS = 4 ## number of concurrent SPARQL requests (per process)
+# RT_THESAURUS_RETRIES = 2 ## retries of SPARQL requests after 5xx responses, timeouts and connection errors
+# RT_THESAURUS_STORE = None ## optional, directory of the local thesaurus store (manage rt_thes_harvest)
 raise Exception("set *_ROOT directories, then run manage collectstatic!")
\ No newline at end of file